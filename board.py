@@ -1,4 +1,8 @@
+import random
+from collections import namedtuple
+from collections.abc import Sequence
 from copy import deepcopy
+from types import MappingProxyType
 
 import bitarray
 
@@ -20,6 +24,46 @@ class Piece:
         return not self.__eq__(other)
 
 
+# the (x, y) position of every square number, SQUARE_POSITIONS[0] is unused
+SQUARE_POSITIONS = (None,) + tuple(
+    (2 * (index % 5) + ((index // 5) % 2 == 0), index // 5)
+    for index in range(50)
+)
+
+
+# random 64-bit keys for Zobrist hashing: ZOBRIST_KEYS[square][side][status]
+# for a piece on a square (0 to 49), ZOBRIST_PLAYER_KEY if player 1 is to move
+_zobrist_random = random.Random(0x5eed)
+ZOBRIST_KEYS = tuple(
+    tuple(
+        tuple(_zobrist_random.getrandbits(64) for _ in range(2))
+        for _ in range(2)
+    )
+    for _ in range(50)
+)
+ZOBRIST_PLAYER_KEY = _zobrist_random.getrandbits(64)
+
+
+class CompactPiece(namedtuple('CompactPiece', ('square', 'is_king'))):
+    """An immutable piece, stored by its square number (1 to 50)."""
+
+    __slots__ = ()
+
+    @property
+    def pos(self):
+        return SQUARE_POSITIONS[self.square]
+
+    @staticmethod
+    def from_piece(piece):
+        return CompactPiece(
+            History.convert_pos_to_index(piece.pos),
+            bool(piece.is_king)
+        )
+
+    def to_piece(self):
+        return Piece(SQUARE_POSITIONS[self.square], self.is_king)
+
+
 class BoardGrid:
     """Encodes the pieces as a 1 dimensional array.
 
@@ -30,6 +74,11 @@ class BoardGrid:
         |+--> status
         +---> a piece exists at this location
 
+    The Zobrist hash of the pieces is stored in the key member, and is
+    updated whenever a piece is moved, removed or crowned. The squares of
+    the pieces of each player and of the kings are also kept as integer
+    masks (bit n set for square n + 1), so that pieces can be listed and
+    counted without scanning the board.
     """
 
     def __init__(self, pieces=None):
@@ -51,36 +100,130 @@ class BoardGrid:
         else:
             self._pieces = pieces
 
+        self.key = self._compute_key()
+
+        pieces_mask, self._kings, player1_mask = (
+            int.from_bytes(
+                bitarray.bitarray(
+                    self._pieces[offset::3],
+                    endian='little'
+                ).tobytes(),
+                'little'
+            ) for offset in range(3)
+        )
+        self._kings &= pieces_mask
+        self._player_masks = [pieces_mask & ~player1_mask, player1_mask]
+
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            if self._pieces == other._pieces:
-                return True
+            return self.key == other.key and self._pieces == other._pieces
 
-        return False
+        # let views (and other types) compare themselves
+        return NotImplemented
 
     def __ne__(self, other):
         return not self == other
 
+    @staticmethod
+    def from_squares(player_squares, king_squares=()):
+        """Create a BoardGrid from lists of square numbers (1 to 50).
+
+        :param player_squares: a tuple of two lists with the square numbers of
+            the pieces of player 0 and player 1
+        :param king_squares: the square numbers of the pieces that are kings
+        """
+
+        pieces = bitarray.bitarray(150)
+        pieces.setall(False)
+        for player_id in range(2):
+            for square in player_squares[player_id]:
+                board_index = (square - 1) * 3
+                pieces[board_index] = True
+                pieces[board_index + 1] = square in king_squares
+                pieces[board_index + 2] = player_id
+
+        return BoardGrid(pieces)
+
+    @staticmethod
+    def from_bytes(data):
+        """Create a BoardGrid from the output of BoardGrid.to_bytes()."""
+
+        pieces = bitarray.bitarray()
+        pieces.frombytes(bytes(data))
+
+        return BoardGrid(pieces[:150])
+
+    def to_bytes(self):
+        """Return the 3 bits per square encoding packed in 19 bytes."""
+
+        return self._pieces.tobytes()
+
     @staticmethod
     def _get_board_index(pos):
         return (10 * pos[1] + pos[0]) // 2 * 3
 
+    def _get_piece_key(self, board_index):
+        return ZOBRIST_KEYS[board_index // 3][
+            self._pieces[board_index + 2]
+        ][self._pieces[board_index + 1]]
+
+    def _update_masks(self, board_index, remove=False):
+        """Add the piece at board_index to the masks, or remove it."""
+
+        bit = 1 << board_index // 3
+        player_id = self._pieces[board_index + 2]
+        if remove:
+            self._player_masks[player_id] &= ~bit
+            self._kings &= ~bit
+        else:
+            self._player_masks[player_id] |= bit
+            if self._pieces[board_index + 1]:
+                self._kings |= bit
+
+    def _compute_key(self):
+        key = 0
+        for board_index in range(0, len(self._pieces), 3):
+            if self._pieces[board_index]:
+                key ^= self._get_piece_key(board_index)
+
+        return key
+
+    def get_bitboards(self):
+        """Return a tuple of integer masks (pieces, kings, player 1 pieces).
+
+        Bit n of each mask is set if square n + 1 contains such a piece.
+        """
+
+        return (
+            self._player_masks[0] | self._player_masks[1],
+            self._kings,
+            self._player_masks[1]
+        )
+
+    def get_player_mask(self, player_id):
+        """Return the mask of the squares of the pieces of a player."""
+
+        return self._player_masks[player_id]
+
+    def count_pieces(self, player_id):
+        return bin(self._player_masks[player_id]).count('1')
+
+    def count_kings(self, player_id):
+        return bin(self._player_masks[player_id] & self._kings).count('1')
+
     def get_pieces(self, player_id):
         """Get the list of pieces for the given player."""
 
         pieces = []
-        for y in range(10):
-            for x in range(5):
-                board_index = 15 * y + 3 * x
-                if self._pieces[board_index] and \
-                        self._pieces[board_index + 2] == player_id:
-                    square_offset = (board_index // 3 + 1) % 10
-                    pieces.append(
-                        Piece(
-                            (2 * x + (1 <= square_offset <= 5), y),
-                            self._pieces[board_index + 1]
-                        )
-                    )
+        kings = self._kings
+        mask = self._player_masks[player_id]
+        while mask:
+            lowest_bit = mask & -mask
+            index = lowest_bit.bit_length() - 1
+            pieces.append(
+                Piece(SQUARE_POSITIONS[index + 1], kings >> index & 1)
+            )
+            mask ^= lowest_bit
 
         return pieces
 
@@ -90,6 +233,8 @@ class BoardGrid:
         if not self._pieces[board_index]:
             return False
 
+        self.key ^= self._get_piece_key(board_index)
+        self._update_masks(board_index, remove=True)
         self._pieces[board_index:board_index + 3] = bitarray.bitarray('000')
 
         return True
@@ -105,6 +250,8 @@ class BoardGrid:
         if self._pieces[endpos_board_index]:
             return False
 
+        self.key ^= self._get_piece_key(startpos_board_index)
+        self._update_masks(startpos_board_index, remove=True)
         self._pieces[endpos_board_index] = True
         self._pieces[endpos_board_index + 1] = \
             self._pieces[startpos_board_index + 1]
@@ -113,6 +260,8 @@ class BoardGrid:
 
         self._pieces[startpos_board_index:startpos_board_index + 3] = \
             bitarray.bitarray('000')
+        self.key ^= self._get_piece_key(endpos_board_index)
+        self._update_masks(endpos_board_index)
 
         return True
 
@@ -122,10 +271,80 @@ class BoardGrid:
         if not self._pieces[board_index]:
             return False
 
+        self.key ^= self._get_piece_key(board_index)
         self._pieces[board_index + 1] = True
+        self.key ^= self._get_piece_key(board_index)
+        self._kings |= 1 << board_index // 3
 
         return True
 
+    def add_piece(self, pos, player_id, is_king=False):
+        board_index = self._get_board_index(pos)
+
+        if self._pieces[board_index]:
+            return False
+
+        self._pieces[board_index] = True
+        self._pieces[board_index + 1] = is_king
+        self._pieces[board_index + 2] = player_id
+        self.key ^= self._get_piece_key(board_index)
+        self._update_masks(board_index)
+
+        return True
+
+    def make_move(
+            self,
+            start_pos,
+            end_pos,
+            captured_positions=(),
+            crown=False
+    ):
+        """Move a piece in place and return a token for unmake_move().
+
+        The move is not validated.
+
+        :param start_pos: the position of the piece to move
+        :param end_pos: the position the piece ends at
+        :param captured_positions: the positions of the pieces to remove
+        :param crown: crown the piece after moving it
+        """
+
+        captured = tuple(
+            (
+                pos,
+                self.get_piece_player(pos),
+                self.get_piece_status(pos)
+            )
+            for pos in captured_positions
+        )
+        for pos in captured_positions:
+            self.remove_piece(pos)
+
+        self.move_piece(start_pos, end_pos)
+
+        crowned = crown and not self.get_piece_status(end_pos)
+        if crowned:
+            self.crown_piece(end_pos)
+
+        return start_pos, end_pos, crowned, captured
+
+    def unmake_move(self, token):
+        """Undo a move made with make_move()."""
+
+        start_pos, end_pos, crowned, captured = token
+
+        if crowned:
+            board_index = self._get_board_index(end_pos)
+            self.key ^= self._get_piece_key(board_index)
+            self._pieces[board_index + 1] = False
+            self.key ^= self._get_piece_key(board_index)
+            self._kings &= ~(1 << board_index // 3)
+
+        self.move_piece(end_pos, start_pos)
+
+        for pos, player_id, is_king in captured:
+            self.add_piece(pos, player_id, is_king)
+
     def get_piece_status(self, pos):
         board_index = self._get_board_index(pos)
 
@@ -176,6 +395,65 @@ class GameState:
         self.turn = turn
         self.current_player = player
 
+    @staticmethod
+    def from_fen(fen):
+        """Create a GameState from a FEN string.
+
+        A FEN string looks like 'W:W31-50:B1-20': the player to move,
+        followed by the squares of the white (player 0) and black (player 1)
+        pieces. Kings are prefixed with a K, e.g. 'B:WK46,28:B17,K5'.
+        """
+
+        fields = fen.strip().rstrip('.').split(':')
+        if len(fields) != 3 or fields[0].upper() not in ('W', 'B'):
+            raise Exception("Invalid FEN string: {0}".format(fen))
+
+        player_squares = ([], [])
+        king_squares = []
+        for field in fields[1:]:
+            player_id = 'WB'.index(field[0].upper())
+            for square in filter(None, field[1:].split(',')):
+                is_king = square.upper().startswith('K')
+                if is_king:
+                    square = square[1:]
+
+                if '-' in square:
+                    first, last = square.split('-')
+                    squares = range(int(first), int(last) + 1)
+                else:
+                    squares = [int(square)]
+
+                player_squares[player_id].extend(squares)
+                if is_king:
+                    king_squares.extend(squares)
+
+        return GameState(
+            board=BoardGrid.from_squares(player_squares, king_squares),
+            player='WB'.index(fields[0].upper())
+        )
+
+    def to_fen(self):
+        """Return the FEN string of this game state."""
+
+        fields = ['WB'[self.current_player]]
+        for player_id in range(2):
+            fields.append('WB'[player_id] + ','.join(
+                ('K' if piece.is_king else '')
+                + str(History.convert_pos_to_index(piece.pos))
+                for piece in self.board.get_pieces(player_id)
+            ))
+
+        return ':'.join(fields)
+
+    @property
+    def key(self):
+        """The Zobrist hash of the pieces and the player to move."""
+
+        if self.current_player:
+            return self.board.key ^ ZOBRIST_PLAYER_KEY
+
+        return self.board.key
+
     def is_opponent_winning(self):
         """Return True if the current game state is a win for the opponent."""
 
@@ -203,40 +481,65 @@ class GameState:
         :param move: a list of positions to visit
         """
 
-        possible_moves = DraughtsRules.get_piece_possible_moves(
-            piece,
-            self.board.get_pieces(self.current_player),
-            self.board.get_pieces(not self.current_player),
-            self.current_player
-        )
+        record = DraughtsRules.get_move_record(piece, move, self)
 
-        if move not in possible_moves:
+        if record is None:
             return None
 
         newstate = GameState(
             board=self.board,
-            turn=self.turn if not self.current_player else self.turn + 1,
-            player=not self.current_player,
-            tie_request=self.tie_request if
-            self.tie_request == self.current_player else NO_TIE_REQUEST
+            turn=self.turn,
+            player=self.current_player,
+            tie_request=self.tie_request
         )
+        newstate.make_move(piece, record.move, record.captured)
 
-        captured_pieces = DraughtsRules.get_captured_pieces(
-            piece,
-            move,
-            self.board.get_pieces(not self.current_player)
+        return newstate
+
+    def make_move(self, piece, move, captured=None):
+        """Apply a move to this GameState in place, without copying the board.
+
+        Returns a token to pass to unmake_move() to restore the state, or
+        None if the move is not legal.
+
+        :param piece: a board.Piece object
+        :param move: a list of positions to visit
+        :param captured: the positions of the pieces captured by the move,
+            e.g. from a draughtsrules.MoveRecord object. If None, the move
+            is validated and the captured pieces are looked up.
+        """
+
+        if captured is None:
+            record = DraughtsRules.get_move_record(piece, move, self)
+
+            if record is None:
+                return None
+
+            captured = record.captured
+
+        end_pos = move[-1]
+        board_token = self.board.make_move(
+            piece.pos,
+            end_pos,
+            captured,
+            end_pos[1] == GameState.KING_ROW[self.current_player]
         )
 
-        for captured_piece in captured_pieces:
-            newstate.board.remove_piece(captured_piece.pos)
+        token = (board_token, self.turn, self.current_player, self.tie_request)
 
-        newstate.board.move_piece(piece.pos, move[-1])
+        if self.current_player:
+            self.turn += 1
+        if self.tie_request != self.current_player:
+            self.tie_request = NO_TIE_REQUEST
+        self.current_player = not self.current_player
 
-        if move[-1][1] == \
-                GameState.KING_ROW[newstate.board.get_piece_player(move[-1])]:
-            newstate.board.crown_piece(move[-1])
+        return token
 
-        return newstate
+    def unmake_move(self, token):
+        """Undo a move made with make_move()."""
+
+        board_token, self.turn, self.current_player, self.tie_request = token
+        self.board.unmake_move(board_token)
 
 
 class HistoryMove:
@@ -259,19 +562,95 @@ class HistoryMove:
         self.resigned = resign
 
 
+class CompactHistoryMove(namedtuple('CompactHistoryMove', (
+        'player_id',
+        'square',
+        'is_king',
+        'path',
+        'captured_pieces',
+        'request_tie',
+        'accepted_tie',
+        'resigned'
+))):
+    """An immutable HistoryMove that stores squares instead of positions.
+
+    square is the square number of the moved piece and path is a tuple of
+    the square numbers it stops at (both are None if no piece was moved).
+    The piece and move properties convert these back to the board.Piece and
+    positions of a HistoryMove.
+    """
+
+    __slots__ = ()
+
+    @property
+    def piece(self):
+        if self.square is None:
+            return None
+
+        return Piece(SQUARE_POSITIONS[self.square], self.is_king)
+
+    @property
+    def move(self):
+        if self.path is None:
+            return None
+
+        return tuple(SQUARE_POSITIONS[square] for square in self.path)
+
+    @staticmethod
+    def from_history_move(move):
+        if move.piece is None:
+            square = None
+            is_king = False
+        else:
+            square = History.convert_pos_to_index(move.piece.pos)
+            is_king = bool(move.piece.is_king)
+
+        if move.move is None:
+            path = None
+        else:
+            path = tuple(
+                History.convert_pos_to_index(pos) for pos in move.move
+            )
+
+        return CompactHistoryMove(
+            move.player_id,
+            square,
+            is_king,
+            path,
+            bool(move.captured_pieces),
+            bool(move.request_tie),
+            bool(move.accepted_tie),
+            bool(move.resigned)
+        )
+
+    def to_history_move(self):
+        return HistoryMove(
+            self.player_id,
+            self.piece,
+            self.move,
+            self.captured_pieces,
+            self.request_tie,
+            self.accepted_tie,
+            self.resigned
+        )
+
+
 class History:
     """An object that stores past moves.
 
     Has the following members:
-        - movelist: a list of HistoryMove objects
+        - movelist: a list of CompactHistoryMove objects
         - gamestates: a list of tuples (GameState, amount_of_times_appeared)
             that stores each past game state.
+        - position_counts: a dict that maps the key of each past game state
+            to the amount of times it appeared
         - variables that measure when a draw happens
     """
 
     def __init__(self, initial_state):
         self.movelist = []
         self.gamestates = [(initial_state, 1)]
+        self.position_counts = {initial_state.key: 1}
         self.onevs2_moves = 0  # draw if 10
         self.onevs3_moves = 0  # draw if 32
         self.consecutive_moves_with_kings = 0  # draw if 50
@@ -280,10 +659,10 @@ class History:
         index = 0
         while index < len(self.movelist):
             if index + 1 < len(self.movelist) and \
-                    self.movelist[index + 1].move:
+                    self.movelist[index + 1].path:
                 yield (self.movelist[index], self.movelist[index + 1])
                 index += 1
-            elif self.movelist[index].move:
+            elif self.movelist[index].path:
                 yield (self.movelist[index],)
 
             index += 1
@@ -292,11 +671,15 @@ class History:
     def convert_pos_to_index(pos):
         return (10 * pos[1] + pos[0]) // 2 + 1
 
+    @staticmethod
+    def convert_index_to_pos(index):
+        return SQUARE_POSITIONS[index]
+
     def convert_move_to_str(self, move):
         return '{0}{1}{2}'.format(
-            self.convert_pos_to_index(move.piece.pos),
+            move.square,
             'x' if move.captured_pieces else '-',
-            self.convert_pos_to_index(move.move[-1])
+            move.path[-1]
         )
 
     def movelist_as_string(self):
@@ -308,39 +691,186 @@ class History:
         return str_movelist
 
     def add_move(self, new_gamestate, move, old_gamestate):
+        if not isinstance(move, CompactHistoryMove):
+            move = CompactHistoryMove.from_history_move(move)
+
         self.movelist.append(move)
 
-        pieces = [
-            old_gamestate.board.get_pieces(0),
-            old_gamestate.board.get_pieces(1)
-        ]
+        old_board = old_gamestate.board
+        num_pieces = [old_board.count_pieces(0), old_board.count_pieces(1)]
+        num_kings = [old_board.count_kings(0), old_board.count_kings(1)]
 
-        if move.move:
+        if move.path:
             for player_index in range(2):
                 opponent_index = not player_index
 
-                if len(pieces[player_index]) == 2 \
-                        and len(pieces[opponent_index]) == 1 \
-                        and any(piece.is_king
-                                for piece in pieces[player_index]) \
-                        and pieces[opponent_index][0].is_king:
+                if num_pieces[player_index] == 2 \
+                        and num_pieces[opponent_index] == 1 \
+                        and num_kings[player_index] \
+                        and num_kings[opponent_index]:
                     self.onevs2_moves += 1
-                elif len(pieces[player_index]) == 3 \
-                        and len(pieces[opponent_index]) == 1 \
-                        and any(piece.is_king
-                                for piece in pieces[player_index]) \
-                        and pieces[opponent_index][0].is_king:
+                elif num_pieces[player_index] == 3 \
+                        and num_pieces[opponent_index] == 1 \
+                        and num_kings[player_index] \
+                        and num_kings[opponent_index]:
                     self.onevs3_moves += 1
 
-            if move.piece.is_king and not move.captured_pieces:
+            if move.is_king and not move.captured_pieces:
                 self.consecutive_moves_with_kings += 1
             else:
                 self.consecutive_moves_with_kings = 0
 
-        num_gamestate = 1
-        for state in self.gamestates:
-            if new_gamestate.current_player == state[0].current_player \
-                    and new_gamestate.board == state[0].board:
-                num_gamestate += 1
+        key = new_gamestate.key
+        num_gamestate = self.position_counts.get(key, 0) + 1
+        self.position_counts[key] = num_gamestate
 
         self.gamestates.append((new_gamestate, num_gamestate))
+
+
+def _unbind_method(method):
+    """Return a function that calls a bound method, without its __self__."""
+
+    def call(*args, **kwargs):
+        return method(*args, **kwargs)
+
+    call.__name__ = method.__name__
+    call.__doc__ = method.__doc__
+
+    return call
+
+
+class ReadOnlyView:
+    """A view of an object whose members can be read, but not changed.
+
+    Subclasses list the methods that change the object in MUTATORS and map
+    members that have to be wrapped in a view themselves in VIEWS, so that
+    players can be given the game state without copying it. Use deepcopy()
+    to get a copy of the wrapped object that can be changed.
+
+    Methods are returned as plain functions, so that they do not give
+    access to the wrapped object through their __self__ attribute. A view
+    only prevents accidental changes: Python code that is determined to
+    reach the wrapped object, e.g. through object.__getattribute__() or the
+    closure of such a function, can still change it.
+    """
+
+    __slots__ = ('_wrapped',)
+
+    MUTATORS = ()
+    VIEWS = {}
+
+    def __init__(self, wrapped):
+        object.__setattr__(self, '_wrapped', wrapped)
+
+    def __getattr__(self, name):
+        if name in self.MUTATORS or name.startswith('_'):
+            raise AttributeError(
+                "'{0}' of {1} can not be accessed through a read-only view"
+                .format(name, type(self._wrapped).__name__)
+            )
+
+        value = getattr(self._wrapped, name)
+        if name in self.VIEWS:
+            return self.VIEWS[name](value)
+        if getattr(value, '__self__', None) is self._wrapped:
+            return _unbind_method(value)
+
+        return value
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "{0} is read-only".format(type(self._wrapped).__name__)
+        )
+
+    def __delattr__(self, name):
+        raise AttributeError(
+            "{0} is read-only".format(type(self._wrapped).__name__)
+        )
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self._wrapped, memo)
+
+    def __copy__(self):
+        return deepcopy(self._wrapped)
+
+    def copy(self):
+        """Return a copy of the wrapped object that can be changed."""
+
+        return deepcopy(self._wrapped)
+
+
+class SequenceView(Sequence):
+    """A read-only view of a list that wraps its items on access."""
+
+    __slots__ = ('_items', '_wrap')
+
+    def __init__(self, items, wrap=None):
+        self._items = items
+        self._wrap = wrap
+
+    def __getitem__(self, index):
+        if self._wrap is None:
+            return self._items[index]
+
+        if isinstance(index, slice):
+            return [self._wrap(item) for item in self._items[index]]
+
+        return self._wrap(self._items[index])
+
+    def __len__(self):
+        return len(self._items)
+
+
+class BoardGridView(ReadOnlyView):
+    """A read-only view of a BoardGrid object."""
+
+    __slots__ = ()
+
+    MUTATORS = (
+        'add_piece',
+        'remove_piece',
+        'move_piece',
+        'crown_piece',
+        'make_move',
+        'unmake_move'
+    )
+
+    def __eq__(self, other):
+        if isinstance(other, ReadOnlyView):
+            other = other._wrapped
+
+        return self._wrapped == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+class GameStateView(ReadOnlyView):
+    """A read-only view of a GameState object."""
+
+    __slots__ = ()
+
+    MUTATORS = ('make_move', 'unmake_move')
+    VIEWS = {'board': BoardGridView}
+
+
+def _view_gamestates(gamestates):
+    return SequenceView(
+        gamestates,
+        lambda item: (GameStateView(item[0]), item[1])
+    )
+
+
+class HistoryView(ReadOnlyView):
+    """A read-only view of a History object."""
+
+    __slots__ = ()
+
+    MUTATORS = ('add_move',)
+    VIEWS = {
+        'movelist': SequenceView,
+        'gamestates': _view_gamestates,
+        'position_counts': MappingProxyType
+    }
@@ -7,20 +7,23 @@ or by creating a Game object and calling its run method
 import argparse
 import configparser
 import copy
+import itertools
 import math
-import os
-import pickle
-import time
 from ast import literal_eval
 
 import pygame
 
 import board
+import gamerecord
 import graphics
 import humanplayer
+import pdn
 import replayplayer
 from draughtsrules import DraughtsRules
 from draughtsrules import TIE_REQUEST_TURN
+from headless import PlayerConfig
+from headless import parse_players
+from headless import save_history_to_file
 
 
 class Display:
@@ -219,7 +222,8 @@ class Game:
             players,
             disp_graphics=True,
             switch_sides=False,
-            record=False
+            record=False,
+            start_state=None
     ):
         """Initialize the Game object.
 
@@ -233,6 +237,8 @@ class Game:
         :param switch_sides: switches sides after each move (only visual)
         :param record: record the match and save it in a file with the
             current data as name
+        :param start_state: the GameState to start from (default: the
+            initial position)
         """
 
         self.display_screen = disp_graphics
@@ -242,7 +248,10 @@ class Game:
         if self.display_screen:
             self.display = Display(display_colors)
 
-        self.current_state = board.GameState()
+        if start_state is None:
+            self.current_state = board.GameState()
+        else:
+            self.current_state = copy.deepcopy(start_state)
         self.history = board.History(self.current_state)
 
         self.players = [None, None]
@@ -319,7 +328,10 @@ class Game:
                 )
 
         self.scrollindex = 0
-        self.captured_piece_nums = (0, 0)
+        self.captured_piece_nums = tuple(
+            max(0, 20 - self.current_state.board.count_pieces(player_id))
+            for player_id in range(2)
+        )
 
         self.keepgoing = True
 
@@ -349,7 +361,7 @@ class Game:
         )
         self.display.render_to_screen()
 
-    def show_move_anim(self, piece, move, captured_pieces):
+    def show_move_anim(self, piece, move, captured_positions):
         player_pieces = self.current_state.board.get_pieces(
             self.current_state.current_player
         )
@@ -386,21 +398,20 @@ class Game:
                 self.display.render_to_screen()
                 clock.tick(60)
 
-            if captured_pieces:
-                opponent_pieces.remove(captured_pieces[capt_piece_index])
+            if captured_positions:
+                captured_pos = captured_positions[capt_piece_index]
+                opponent_pieces = [
+                    opponent_piece for opponent_piece in opponent_pieces
+                    if opponent_piece.pos != captured_pos
+                ]
                 capt_piece_index += 1
 
     def save_history_to_file(self):
-        filename = '-'.join(str(t) for t in time.localtime()[1:6]) + '.bin'
-        with open(filename, 'wb') as file:
-            pickle.dump(
-                {
-                    'player1_name': self.players[0].name,
-                    'player2_name': self.players[1].name,
-                    'movelist': self.history.movelist
-                },
-                file
-            )
+        save_history_to_file(
+            self.history,
+            [self.players[0].name, self.players[1].name],
+            self.winner
+        )
 
     def run(self):
         """Run the draughts match.
@@ -420,8 +431,8 @@ class Game:
                 self.render_all()
 
             action = self.players[self.current_state.current_player].get_action(
-                copy.deepcopy(self.current_state),
-                copy.deepcopy(self.history)
+                board.GameStateView(self.current_state),
+                board.HistoryView(self.history)
             )
 
             if self.current_state.tie_request == board.INVALID_TIE_REQUEST:
@@ -459,11 +470,12 @@ class Game:
                         )
                     )
 
-            if not DraughtsRules.is_valid_move(
-                    action.piece,
-                    action.move,
-                    self.current_state
-            ):
+            record = DraughtsRules.get_move_record(
+                action.piece,
+                action.move,
+                self.current_state
+            )
+            if record is None:
                 raise Exception('Invalid move')
 
             if action.request_tie:
@@ -477,28 +489,20 @@ class Game:
                 self.current_state.tie_request = \
                     self.current_state.current_player
 
-            captured_pieces = DraughtsRules.get_captured_pieces(
-                action.piece,
-                action.move,
-                self.current_state.board.get_pieces(
-                    not self.current_state.current_player
-                )
-            )
-
             self.captured_piece_nums = (
                 self.captured_piece_nums[0]
                 + (self.current_state.current_player == 1)
-                * len(captured_pieces),
+                * record.num_captures,
                 self.captured_piece_nums[1]
                 + (self.current_state.current_player == 0)
-                * len(captured_pieces)
+                * record.num_captures
             )
 
             if self.display_screen:
                 self.show_move_anim(
                     copy.deepcopy(action.piece),
                     action.move,
-                    captured_pieces
+                    record.captured
                 )
 
             old_gamestate = copy.copy(self.current_state)
@@ -512,7 +516,7 @@ class Game:
                     old_gamestate.current_player,
                     action.piece,
                     action.move,
-                    len(captured_pieces) > 0,
+                    record.num_captures > 0,
                     action.request_tie
                 ),
                 old_gamestate
@@ -540,7 +544,7 @@ class Game:
             self.render_all()
 
         for p in self.players:
-            p.end_game(self.history, self.winner)
+            p.end_game(board.HistoryView(self.history), self.winner)
 
         if self.record:
             self.save_history_to_file()
@@ -717,25 +721,6 @@ class Game:
                 self.display.render_to_screen()
 
 
-class PlayerConfig:
-    """A class used as initialization for the players argument of a Game object.
-    """
-
-    def __init__(self, name=None, constructor=None,
-                 optional_args=None):
-        self.name = name
-
-        if constructor is None:
-            self.constructor = humanplayer.HumanPlayer
-        else:
-            self.constructor = constructor
-
-        if optional_args is None:
-            self.optional_args = {}
-        else:
-            self.optional_args = optional_args
-
-
 def parse_colors(args):
     clrs = {}
 
@@ -749,80 +734,6 @@ def parse_colors(args):
     return clrs
 
 
-def load_player(p, nographics):
-    python_path_str = os.path.expandvars("$PYTHONPATH")
-    if python_path_str.find(';') == -1:
-        python_path_dirs = python_path_str.split(':')
-    else:
-        python_path_dirs = python_path_str.split(';')
-    python_path_dirs.append('.')
-
-    for module_dir in python_path_dirs:
-        if not os.path.isdir(module_dir):
-            continue
-
-        modulenames = (
-            file for file in os.listdir(module_dir) if
-            file.endswith('player.py') and
-            not file.startswith('.') and
-            not file.startswith('_')
-        )
-        for modulename in modulenames:
-            try:
-                module = __import__(modulename[:-3])
-            except ImportError:
-                continue
-            if p in dir(module):
-                if nographics and modulename == 'humanplayer.py':
-                    raise Exception("Cannot use HumanPlayer without display")
-
-                return getattr(module, p)
-
-    raise Exception(
-        "The player {0} is not specified in any *player.py".format(p)
-    )
-
-
-def parse_playeropts(optionstr):
-    if optionstr is None:
-        return {}
-
-    if ',' in optionstr:
-        options = optionstr.split(',')
-    else:
-        options = [optionstr]
-
-    arguments = {}
-    for option in options:
-        if '=' in option:
-            key, val = option.split('=')
-
-            try:
-                val = literal_eval(val)
-            except SyntaxError or ValueError:
-                pass
-        else:
-            key, val = option, True
-
-        arguments[key] = val
-
-    return arguments
-
-
-def parse_players(player_names, player_options, nographics):
-    players = []
-    for index in range(len(player_names)):
-        if '=' in player_names[index]:
-            name, classname = player_names[index].split('=')
-        else:
-            name, classname = None, player_names[index]
-
-        players.append(PlayerConfig(name, load_player(classname, nographics),
-                                    parse_playeropts(player_options[index])))
-
-    return players
-
-
 def parse_command_args(command_args):
     args = dict(
         disp_graphics=command_args.disp_graphics,
@@ -839,26 +750,44 @@ def parse_command_args(command_args):
     )
 
     if command_args.replay_file:
-        with open(command_args.replay_file, "rb") as replayfile:
-            replaydata = pickle.load(replayfile)
+        if gamerecord.is_game_record_file(command_args.replay_file):
+            # read without a GameDatabase, which would write an index file
+            replaydata = gamerecord.read_game(
+                command_args.replay_file,
+                command_args.replay_game
+            )
+        elif command_args.replay_file.lower().endswith('.pdn'):
+            replaydata = next(itertools.islice(
+                pdn.read_pdn(command_args.replay_file),
+                command_args.replay_game,
+                None
+            ), None)
+            if replaydata is None:
+                raise Exception("{0} has no game {1}".format(
+                    command_args.replay_file,
+                    command_args.replay_game
+                ))
+        else:
+            replaydata = gamerecord.convert_pickle(command_args.replay_file)
 
+        args['start_state'] = replaydata.start_state
         args['players'] = [
             PlayerConfig(
-                name=replaydata['player1_name'],
+                name=replaydata.player1_name,
                 constructor=replayplayer.ReplayPlayer,
                 optional_args={
                     'movelist': [
-                        move for move in replaydata['movelist']
+                        move for move in replaydata.movelist
                         if move.player_id == 0
                     ]
                 }
             ),
             PlayerConfig(
-                name=replaydata['player2_name'],
+                name=replaydata.player2_name,
                 constructor=replayplayer.ReplayPlayer,
                 optional_args={
                     'movelist': [
-                        move for move in replaydata['movelist']
+                        move for move in replaydata.movelist
                         if move.player_id == 1
                     ]
                 }
@@ -943,9 +872,28 @@ def main():
         help="A file to replay",
         default=None
     )
+    parser.add_argument(
+        '--game',
+        dest='replay_game',
+        metavar='NUMBER',
+        type=int,
+        help="The number of the game to replay from a game database or "
+             "PDN file",
+        default=0
+    )
+
+    parser.add_argument(
+        '-b',
+        '--bitboards',
+        dest='use_bitboards',
+        action='store_true',
+        help="Use the bitboard move generator",
+        default=False
+    )
 
     command_args = parser.parse_args()
     args = parse_command_args(command_args)
+    DraughtsRules.use_bitboards = command_args.use_bitboards
 
     color_parser = configparser.ConfigParser()
     color_parser.read(['colors.cfg'])
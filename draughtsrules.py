@@ -8,214 +8,190 @@ directions = (
 TIE_REQUEST_TURN = 40
 
 
+class MoveRecord:
+    """A legal move together with the pieces it captures.
+
+    Has the following members:
+        - piece: the board.Piece object that is moved
+        - move: a tuple of positions that the piece stops at
+        - captured: a tuple with the positions of the captured pieces, in the
+            order in which they are captured
+    """
+
+    __slots__ = ('piece', 'move', 'captured')
+
+    def __init__(self, piece, move, captured=()):
+        self.piece = piece
+        self.move = move
+        self.captured = captured
+
+    @property
+    def num_captures(self):
+        return len(self.captured)
+
+
 class DraughtsRules:
     """An object with methods that calculate moves etc. given information
 
-    All methods are static, so no need to initialize this class
+    All methods are static, so no need to initialize this class. Set
+    DraughtsRules.use_bitboards to True to generate moves with the (faster)
+    bitboardrules.BitboardRules object instead.
     """
 
+    use_bitboards = False
+
+    # bitboardrules.BitboardRules, once it has been imported
+    _bitboard_rules = None
+
+    @staticmethod
+    def _get_bitboard_rules():
+        if DraughtsRules._bitboard_rules is None:
+            # imported here, as bitboardrules depends on the board module
+            from bitboardrules import BitboardRules
+            DraughtsRules._bitboard_rules = BitboardRules
+
+        return DraughtsRules._bitboard_rules
+
     @staticmethod
-    def _get_moves(
-            moves,
+    def _on_board(pos):
+        return 0 <= pos[0] <= 9 and 0 <= pos[1] <= 9
+
+    @staticmethod
+    def _get_captures(
+            pos,
             piece_is_king,
-            player_piece_positions,
-            opponent_piece_positions,
-            captured_piece_positions,
-            forward_directions
+            occupied_positions,
+            opponent_positions,
+            path,
+            captured,
+            records
     ):
-        if not piece_is_king:
-            newpositions = []
-            capturedpositions = []
-            for direction in directions:
-                (x, y) = moves[-1]
-                newpos = (x + direction[0], y + direction[1])
-                if 0 <= newpos[0] <= 9 and 0 <= newpos[1] <= 9:
-                    if newpos in opponent_piece_positions:
-                        after_capturepos = (
-                            newpos[0] + direction[0],
-                            newpos[1] + direction[1]
-                        )
-                        if after_capturepos not in player_piece_positions \
-                                and after_capturepos not in \
-                                opponent_piece_positions \
-                                and 0 <= after_capturepos[0] <= 9 \
-                                and 0 <= after_capturepos[1] <= 9:
-                            capturedpositions.append([newpos])
-                            capturedpositions[-1].append(after_capturepos)
-                    elif not captured_piece_positions \
-                            and direction in forward_directions \
-                            and newpos not in player_piece_positions:
-                        newpositions.append(newpos)
-
-            if capturedpositions:
-                for capturedpos in capturedpositions:
-                    if capturedpos not in captured_piece_positions:
-                        moves.append([capturedpos[1]])
-
-                        opponent_positions = [
-                            pos
-                            for pos in opponent_piece_positions
-                            if pos != capturedpos[0]
-                        ]
-                        captured_piece_positions.append(capturedpos[0])
-
-                        newmoves = moves[-1]
-
-                        newmoves = DraughtsRules._get_moves(
-                            newmoves,
-                            piece_is_king,
-                            player_piece_positions,
-                            opponent_positions,
-                            captured_piece_positions,
-                            forward_directions
-                        )
-
-                        newmoves = newmoves[1:]
-                        if newmoves:
-                            moves[-1].append(newmoves)
-            else:
-                for newpos in newpositions:
-                    moves.append([newpos])
+        """Add all capture sequences from a position to records.
 
-            return moves[1:]
-        else:
-            newpositions = []
-            capturedpositions = []
-            for direction in directions:
-                (x, y) = moves[-1]
-                newpos = (x + direction[0], y + direction[1])
-                while 0 <= newpos[0] <= 9 and 0 <= newpos[1] <= 9:
-                    if newpos in captured_piece_positions:
-                        break
-                    if newpos in player_piece_positions:
-                        newpos = (
-                            newpos[0] - direction[0],
-                            newpos[1] - direction[1]
-                        )
-                        while newpos != moves[-1]:
-                            if not captured_piece_positions:
-                                newpositions.append(newpos)
-                            newpos = (
-                                newpos[0] - direction[0],
-                                newpos[1] - direction[1]
-                            )
+        Captured pieces stay on the board until the move is completed, so
+        they are still part of occupied_positions, but they are removed from
+        opponent_positions so that they cannot be captured twice.
+        Only complete sequences are added, as tuples (path, captured).
+        """
 
-                        break
-                    elif newpos in opponent_piece_positions:
-                        if (
-                                newpos[0] + direction[0],
-                                newpos[1] + direction[1]
-                        ) not in player_piece_positions \
-                                and (
-                                newpos[0] + direction[0],
-                                newpos[1] + direction[1]
-                        ) not in opponent_piece_positions \
-                                and 0 <= newpos[0] + direction[0] <= 9 \
-                                and 0 <= newpos[1] + direction[1] <= 9:
-                            capturedpositions.append([newpos, []])
-                            newpos = (
-                                newpos[0] + direction[0],
-                                newpos[1] + direction[1]
-                            )
-                            while newpos not in player_piece_positions \
-                                    and newpos not in opponent_piece_positions \
-                                    and 0 <= newpos[0] <= 9 \
-                                    and 0 <= newpos[1] <= 9:
-                                capturedpositions[-1][1].append(newpos)
-                                newpos = (
-                                    newpos[0] + direction[0],
-                                    newpos[1] + direction[1]
-                                )
+        found = False
+        for direction in directions:
+            newpos = (pos[0] + direction[0], pos[1] + direction[1])
+            if piece_is_king:
+                while DraughtsRules._on_board(newpos) \
+                        and newpos not in occupied_positions:
+                    newpos = (newpos[0] + direction[0],
+                              newpos[1] + direction[1])
+
+            if newpos not in opponent_positions:
+                continue
+
+            landing = (newpos[0] + direction[0], newpos[1] + direction[1])
+            while DraughtsRules._on_board(landing) \
+                    and landing not in occupied_positions:
+                found = True
+                DraughtsRules._get_captures(
+                    landing,
+                    piece_is_king,
+                    occupied_positions,
+                    opponent_positions - {newpos},
+                    path + (landing,),
+                    captured + (newpos,),
+                    records
+                )
 
-                        break
-                    elif not captured_piece_positions:
-                        newpositions.append(newpos)
-
-                    newpos = (
-                        newpos[0] + direction[0],
-                        newpos[1] + direction[1]
-                    )
-
-            if capturedpositions:
-                for capturedpos in capturedpositions:
-                    opponent_positions = [
-                        pos for pos in opponent_piece_positions
-                        if pos != capturedpos[0]
-                    ]
-                    captured_positions = captured_piece_positions + [
-                        capturedpos[0]
-                    ]
-
-                    for move in capturedpos[1]:
-                        if move not in captured_piece_positions:
-                            moves.append([move])
-                            newmoves = [move]
-                            newmoves = DraughtsRules._get_moves(
-                                newmoves,
-                                piece_is_king,
-                                player_piece_positions,
-                                opponent_positions,
-                                captured_positions,
-                                forward_directions
-                            )
-                            newmoves = newmoves[1:]
-                            if newmoves:
-                                moves[-1].append(newmoves)
-
-                if captured_piece_positions:
-                    return moves
-                else:
-                    return [moves[1:]]
-            else:
-                for newpos in newpositions:
-                    moves.append([newpos])
+                if not piece_is_king:
+                    break
+
+                landing = (landing[0] + direction[0],
+                           landing[1] + direction[1])
 
-                return moves[1:]
+        if not found and path:
+            records.append((path, captured))
 
     @staticmethod
-    def _flatten_movelist(moves):
-        if isinstance(moves, list):
-            if len(moves) == 2 \
-                    and not isinstance(moves[0], list) \
-                    and isinstance(moves[1], list):
-                flattenedlist = [moves[0]]
-                flattenedlist.extend(DraughtsRules._flatten_movelist(moves[1]))
-                return flattenedlist
-            else:
-                flattenedlist = []
-                for move in moves:
-                    flattenedlist.append(DraughtsRules._flatten_movelist(move))
-                return flattenedlist
+    def _get_quiet_moves(pos, piece_is_king, occupied_positions, player_id):
+        if piece_is_king:
+            moves = []
+            for direction in directions:
+                newpos = (pos[0] + direction[0], pos[1] + direction[1])
+                while DraughtsRules._on_board(newpos) \
+                        and newpos not in occupied_positions:
+                    moves.append((newpos,))
+                    newpos = (newpos[0] + direction[0],
+                              newpos[1] + direction[1])
+
+            return moves
+
+        moves = []
+        for direction in directions[2 * player_id:2 * player_id + 2]:
+            newpos = (pos[0] + direction[0], pos[1] + direction[1])
+            if DraughtsRules._on_board(newpos) \
+                    and newpos not in occupied_positions:
+                moves.append((newpos,))
 
         return moves
 
     @staticmethod
-    def _get_longest_moves(action_list, moves):
-        action_list = list(action_list)
-        possible_moves = []
-        branched = False
-        for index in range(len(moves)):
-            if isinstance(moves[index], list):
-                branched = True
-                possible_moves.extend(
-                    DraughtsRules._get_longest_moves(
-                        action_list,
-                        moves[index]
-                    )
-                )
-            else:
-                action_list.append(moves[index])
+    def get_piece_move_records(
+            piece,
+            player_pieces,
+            opponent_pieces,
+            player_id
+    ):
+        """Get all legal moves for a given piece as MoveRecord objects.
 
-        if not branched:
-            possible_moves.append(action_list)
+        Only the moves that capture the most pieces are returned, but other
+        pieces are not taken into account.
 
-        possible_moves.sort(key=lambda move: len(move), reverse=True)
-        max_length = len(possible_moves[0])
-        possible_moves = [
-            move for move in possible_moves if len(move) == max_length
-        ]
+        :param piece: a board.Piece object
+        :param player_pieces: a list of board.Piece objects with player pieces
+        :param opponent_pieces: a list of board.Piece objects with pieces
+            from the opponent
+        :param player_id: the player ID of the current player
+        """
+
+        if DraughtsRules.use_bitboards:
+            bitboard_rules = DraughtsRules._get_bitboard_rules()
+            return bitboard_rules.get_piece_move_records(
+                piece,
+                player_pieces,
+                opponent_pieces,
+                player_id
+            )
 
-        return possible_moves
+        opponent_positions = {p.pos for p in opponent_pieces}
+        occupied_positions = {p.pos for p in player_pieces
+                              if p.pos != piece.pos} | opponent_positions
+
+        captures = []
+        DraughtsRules._get_captures(
+            piece.pos,
+            piece.is_king,
+            occupied_positions,
+            opponent_positions,
+            (),
+            (),
+            captures
+        )
+
+        if captures:
+            max_captures = max(len(captured) for _, captured in captures)
+            return [
+                MoveRecord(piece, path, captured)
+                for path, captured in captures
+                if len(captured) == max_captures
+            ]
+
+        return [
+            MoveRecord(piece, path)
+            for path in DraughtsRules._get_quiet_moves(
+                piece.pos,
+                piece.is_king,
+                occupied_positions,
+                player_id
+            )
+        ]
 
     @staticmethod
     def get_piece_possible_moves(
@@ -233,28 +209,23 @@ class DraughtsRules:
         :param player_id: the player ID of the current player
         """
 
-        player_piece_positions = [p.pos for p in player_pieces
-                                  if p.pos != piece.pos]
-        opponent_piece_positions = [p.pos for p in opponent_pieces]
-        forward_directions = directions[2 * player_id:2 * player_id + 2]
-
-        moves = DraughtsRules._get_longest_moves(
-            [],
-            DraughtsRules._flatten_movelist(
-                DraughtsRules._get_moves(
-                    [piece.pos],
-                    piece.is_king,
-                    player_piece_positions,
-                    opponent_piece_positions,
-                    [],
-                    forward_directions
-                )
+        if DraughtsRules.use_bitboards:
+            bitboard_rules = DraughtsRules._get_bitboard_rules()
+            return bitboard_rules.get_piece_possible_moves(
+                piece,
+                player_pieces,
+                opponent_pieces,
+                player_id
             )
-        )
-
-        possible_moves = list(set(tuple(move) for move in moves))
 
-        return possible_moves
+        return [
+            record.move for record in DraughtsRules.get_piece_move_records(
+                piece,
+                player_pieces,
+                opponent_pieces,
+                player_id
+            )
+        ]
 
     @staticmethod
     def get_orientation(startpos, endpos):
@@ -309,51 +280,71 @@ class DraughtsRules:
         return captured_pieces
 
     @staticmethod
-    def get_all_possible_moves(currentstate):
-        """Return a list of pieces with all their legal moves.
+    def get_all_move_records(currentstate):
+        """Return a list of MoveRecord objects with all legal moves.
 
-        The list returned consists of tuples (Piece, [moves])
+        With use_bitboards, the pieces of the records are shared with other
+        records and must not be changed. Use get_all_possible_moves() for
+        pieces that can be changed.
 
         :param currentstate: The current gamestate
         """
 
+        if DraughtsRules.use_bitboards:
+            bitboard_rules = DraughtsRules._get_bitboard_rules()
+            return bitboard_rules.get_all_move_records(currentstate)
+
         player_id = currentstate.current_player
         player_pieces = currentstate.board.get_pieces(player_id)
         opponent_pieces = currentstate.board.get_pieces(not player_id)
 
-        all_moves = []
+        all_records = []
         max_captures = 0
         for piece in player_pieces:
-            piece_moves = DraughtsRules.get_piece_possible_moves(
+            records = DraughtsRules.get_piece_move_records(
                 piece,
                 player_pieces,
                 opponent_pieces,
                 player_id
             )
-            if piece_moves and piece_moves[0]:
-                num_captures = len(
-                    DraughtsRules.get_captured_pieces(
-                        piece,
-                        piece_moves[0],
-                        opponent_pieces
-                    )
-                )
+            if records:
+                num_captures = records[0].num_captures
                 if num_captures > max_captures:
-                    all_moves = [(piece, piece_moves)]
+                    all_records = records
                     max_captures = num_captures
                 elif num_captures == max_captures:
-                    all_moves.append((piece, piece_moves))
+                    all_records.extend(records)
+
+        return all_records
+
+    @staticmethod
+    def get_all_possible_moves(currentstate):
+        """Return a list of pieces with all their legal moves.
+
+        The list returned consists of tuples (Piece, [moves])
+
+        :param currentstate: The current gamestate
+        """
+
+        if DraughtsRules.use_bitboards:
+            bitboard_rules = DraughtsRules._get_bitboard_rules()
+            return bitboard_rules.get_all_possible_moves(currentstate)
+
+        all_moves = []
+        for record in DraughtsRules.get_all_move_records(currentstate):
+            if all_moves and all_moves[-1][0] is record.piece:
+                all_moves[-1][1].append(record.move)
+            else:
+                all_moves.append((record.piece, [record.move]))
 
         return all_moves
 
     @staticmethod
-    def is_valid_move(piece, move, currentstate):
-        """Check if a given move is valid.
+    def get_move_record(piece, move, currentstate):
+        """Return the MoveRecord of a move, or None if it is not legal.
 
-        Validity of moves is checked by comparing with a list of legal moves
-        generated by this object, so moves obtained by calling
-        DraughtsRules.get_piece_possible_moves() or
-        DraughtsRules.get_all_possible_moves() don't have to be checked.
+        Like DraughtsRules.is_valid_move(), this does not check whether
+        another piece can capture more pieces.
 
         :param piece: a board.Piece object
         :param move: a list of positions to visit
@@ -364,14 +355,37 @@ class DraughtsRules:
             currentstate.current_player
         )
 
-        if piece in player_pieces:
-            possible_moves = DraughtsRules.get_piece_possible_moves(
+        if piece not in player_pieces:
+            return None
+
+        move = tuple(move)
+        for record in DraughtsRules.get_piece_move_records(
                 piece,
                 player_pieces,
                 currentstate.board.get_pieces(not currentstate.current_player),
                 currentstate.current_player
-            )
+        ):
+            if record.move == move:
+                return record
+
+        return None
+
+    @staticmethod
+    def is_valid_move(piece, move, currentstate):
+        """Check if a given move is valid.
 
-            return move in possible_moves
+        Validity of moves is checked by comparing with a list of legal moves
+        generated by this object, so moves obtained by calling
+        DraughtsRules.get_piece_possible_moves() or
+        DraughtsRules.get_all_possible_moves() don't have to be checked.
 
-        return False
+        :param piece: a board.Piece object
+        :param move: a list of positions to visit
+        :param currentstate: the current gamestate
+        """
+
+        return DraughtsRules.get_move_record(
+            piece,
+            move,
+            currentstate
+        ) is not None
@@ -0,0 +1,436 @@
+"""Static evaluation of draughts positions by weighted features.
+
+Every feature is counted for player 0 (white) minus player 1 (black):
+    - men: the amount of men
+    - kings: the amount of kings
+    - tempo: the amount of rows the men have advanced
+    - centre: the amount of pieces on the centre squares
+    - back_rank: the amount of men on the own back row, which keep the
+      opponent from crowning
+    - runaway: the amount of men close to the king row that cannot be
+      stopped, as there are no pieces in front of them
+
+All features but runaway are sums over the pieces, so an Evaluator keeps
+their weighted sum up to date while moves are made and unmade, instead of
+scanning the board for every evaluation:
+
+    evaluator = Evaluator(load_weights('weights.json'))
+    evaluator.reset(state.board)
+    token = evaluator.make_move(state, record.piece, record.move,
+                                record.captured)
+    score = evaluator.evaluate(state)
+    evaluator.unmake_move(state, token)
+
+Weights are stored as a JSON object of feature names and weights, and
+features that are left out have weight 0. get_feature_matrix() and
+evaluate_batch() compute the features and scores of many positions at once
+with NumPy, e.g. to fit the weights to the outcomes of games.
+
+Run the module to print the features and score of a position:
+
+    python -m evaluation --fen "W:W31-50:B1-20" --weights weights.json
+"""
+
+import argparse
+import json
+
+import board
+
+FEATURES = ('men', 'kings', 'tempo', 'centre', 'back_rank', 'runaway')
+
+# the features that are sums over the pieces
+PIECE_FEATURES = FEATURES[:5]
+
+DEFAULT_WEIGHTS = {
+    'men': 100,
+    'kings': 300,
+    'tempo': 2,
+    'centre': 0,
+    'back_rank': 0,
+    'runaway': 0
+}
+
+CENTRE_SQUARES = (22, 23, 24, 27, 28, 29)
+
+# the king row of player 0 is row 0 and of player 1 row 9
+KING_ROWS = (0, 9)
+
+# the amount of rows before the king row in which men can be runaways
+RUNAWAY_ROWS = 3
+
+
+def _get_piece_features(player_id, is_king, square):
+    """Return the features of a piece of player 0, or minus the features
+    of a piece of player 1.
+    """
+
+    y = board.SQUARE_POSITIONS[square][1]
+    advancement = abs(y - KING_ROWS[1 - player_id])
+    features = (
+        int(not is_king),
+        int(is_king),
+        0 if is_king else advancement,
+        int(square in CENTRE_SQUARES),
+        int(not is_king and advancement == 0)
+    )
+
+    return features if player_id == 0 else tuple(-value for value in features)
+
+
+# PIECE_FEATURE_TABLE[player_id][is_king][square - 1]
+PIECE_FEATURE_TABLE = tuple(
+    tuple(
+        tuple(
+            _get_piece_features(player_id, is_king, square)
+            for square in range(1, 51)
+        )
+        for is_king in (False, True)
+    )
+    for player_id in range(2)
+)
+
+
+def _get_cone_mask(square, player_id):
+    """Return the mask of the squares that a man has to pass to crown."""
+
+    x, y = board.SQUARE_POSITIONS[square]
+    step = 1 if player_id else -1
+
+    mask = 0
+    row = y + step
+    distance = 1
+    while 0 <= row <= 9:
+        for column in range(max(0, x - distance), min(9, x + distance) + 1):
+            if (column + row) % 2:
+                mask |= 1 << (10 * row + column) // 2
+        row += step
+        distance += 1
+
+    return mask
+
+
+# RUNAWAY_CONES[player_id] is a tuple of (square bit, cone mask) of the
+# squares on which men of the player can be runaways
+RUNAWAY_CONES = tuple(
+    tuple(
+        (1 << square - 1, _get_cone_mask(square, player_id))
+        for square in range(1, 51)
+        if 0 < abs(
+            board.SQUARE_POSITIONS[square][1] - KING_ROWS[player_id]
+        ) <= RUNAWAY_ROWS
+    )
+    for player_id in range(2)
+)
+
+
+def count_runaways(occupied, men, player_id):
+    """Return the amount of runaway men of a player.
+
+    :param occupied: the mask of all pieces
+    :param men: the mask of the men of the player
+    :param player_id: the player
+    """
+
+    return sum(
+        1 for bit, cone in RUNAWAY_CONES[player_id]
+        if men & bit and not occupied & cone
+    )
+
+
+def get_weight_vector(weights=None):
+    """Return a dict of weights as a tuple in the order of FEATURES."""
+
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+
+    for name in weights:
+        if name not in FEATURES:
+            raise Exception("Unknown evaluation feature: {0}".format(name))
+
+    return tuple(weights.get(name, 0) for name in FEATURES)
+
+
+def load_weights(filename):
+    """Return the dict of weights stored in a JSON file."""
+
+    with open(filename, 'r') as file:
+        weights = json.load(file)
+
+    if not isinstance(weights, dict):
+        raise Exception("Invalid weights file: {0}".format(filename))
+    get_weight_vector(weights)
+
+    return weights
+
+
+def save_weights(filename, weights):
+    with open(filename, 'w') as file:
+        json.dump(
+            {name: weights.get(name, 0) for name in FEATURES},
+            file,
+            indent=4
+        )
+        file.write('\n')
+
+
+def get_features(grid):
+    """Return the features of a BoardGrid as a tuple in the order of
+    FEATURES.
+    """
+
+    occupied, kings, player1 = grid.get_bitboards()
+    player_masks = (occupied & ~player1, player1)
+
+    features = [0] * len(FEATURES)
+    for player_id in range(2):
+        for is_king in (False, True):
+            mask = player_masks[player_id]
+            mask &= kings if is_king else ~kings
+            table = PIECE_FEATURE_TABLE[player_id][is_king]
+            while mask:
+                lowest_bit = mask & -mask
+                for index, value in enumerate(
+                        table[lowest_bit.bit_length() - 1]
+                ):
+                    features[index] += value
+                mask ^= lowest_bit
+
+    features[-1] = count_runaways(
+        occupied,
+        player_masks[0] & ~kings,
+        0
+    ) - count_runaways(occupied, player_masks[1] & ~kings, 1)
+
+    return tuple(features)
+
+
+def evaluate(state, weights=None):
+    """Return the score of a GameState for the player to move, computed
+    from scratch.
+
+    :param state: the GameState
+    :param weights: a dict of feature weights (default: DEFAULT_WEIGHTS)
+    """
+
+    score = sum(
+        weight * value
+        for weight, value in zip(
+            get_weight_vector(weights),
+            get_features(state.board)
+        )
+    )
+
+    return -score if state.current_player else score
+
+
+class Evaluator:
+    """Evaluates positions by features that are updated with every move."""
+
+    def __init__(self, weights=None):
+        """Initialize the Evaluator object.
+
+        :param weights: a dict of feature weights (default: DEFAULT_WEIGHTS)
+        """
+
+        self.weights = get_weight_vector(weights)
+        self.runaway_weight = self.weights[FEATURES.index('runaway')]
+
+        # the weighted piece features of player 0 by position, as make_move
+        # gets positions: _piece_scores[player_id][is_king][pos]
+        self._piece_scores = tuple(
+            tuple(
+                {
+                    board.SQUARE_POSITIONS[square]: sum(
+                        weight * value
+                        for weight, value in zip(
+                            self.weights,
+                            PIECE_FEATURE_TABLE[player_id][is_king][
+                                square - 1
+                            ]
+                        )
+                    )
+                    for square in range(1, 51)
+                }
+                for is_king in (False, True)
+            )
+            for player_id in range(2)
+        )
+
+        self.score = 0
+
+    def reset(self, grid):
+        """Compute the score of the pieces of a BoardGrid from scratch."""
+
+        self.score = 0
+        for player_id in range(2):
+            for piece in grid.get_pieces(player_id):
+                self.score += \
+                    self._piece_scores[player_id][piece.is_king][piece.pos]
+
+    def make_move(self, state, piece, move, captured=None):
+        """Make a move with GameState.make_move() and update the score.
+
+        Returns a token for unmake_move(), or None if the move is not
+        legal.
+        """
+
+        player_id = state.current_player
+        state_token = state.make_move(piece, move, captured)
+        if state_token is None:
+            return None
+
+        start_pos, end_pos, crowned, captured_pieces = state_token[0]
+        is_king = state.board.get_piece_status(end_pos)
+
+        scores = self._piece_scores[player_id]
+        delta = scores[is_king][end_pos] \
+            - scores[is_king and not crowned][start_pos]
+        for pos, captured_player, captured_king in captured_pieces:
+            delta -= self._piece_scores[captured_player][captured_king][pos]
+
+        self.score += delta
+
+        return state_token, delta
+
+    def unmake_move(self, state, token):
+        """Undo a move made with make_move()."""
+
+        state_token, delta = token
+        state.unmake_move(state_token)
+        self.score -= delta
+
+    def evaluate(self, state):
+        """Return the score of the GameState for the player to move.
+
+        The state must be the one the Evaluator was reset with, changed
+        only with make_move() and unmake_move().
+        """
+
+        score = self.score
+        if self.runaway_weight:
+            occupied, kings, player1 = state.board.get_bitboards()
+            score += self.runaway_weight * (
+                count_runaways(occupied, occupied & ~player1 & ~kings, 0)
+                - count_runaways(occupied, player1 & ~kings, 1)
+            )
+
+        return -score if state.current_player else score
+
+
+def get_bitboard_array(grids):
+    """Return the bitboards of BoardGrids as a NumPy array of shape (N, 3).
+
+    The columns are the masks of BoardGrid.get_bitboards(): the pieces, the
+    kings and the pieces of player 1.
+    """
+
+    # imported here, as only batch evaluation depends on NumPy
+    import numpy as np
+
+    return np.array(
+        [grid.get_bitboards() for grid in grids],
+        dtype=np.uint64
+    ).reshape(-1, 3)
+
+
+def get_feature_matrix(bitboards):
+    """Return the features of many positions as an array of shape (N,
+    len(FEATURES)).
+
+    :param bitboards: a NumPy array of shape (N, 3), see
+        get_bitboard_array()
+    """
+
+    # imported here, as only batch evaluation depends on NumPy
+    import numpy as np
+
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+    occupied, kings, player1 = bitboards.T
+    player_masks = (occupied & ~player1, player1)
+
+    shifts = np.arange(50, dtype=np.uint64)
+    features = np.zeros((len(bitboards), len(FEATURES)), dtype=np.int64)
+    for player_id in range(2):
+        for is_king in (False, True):
+            mask = player_masks[player_id] & (kings if is_king else ~kings)
+            squares = (mask[:, None] >> shifts) & np.uint64(1)
+            features[:, :-1] += squares.astype(np.int64) @ np.array(
+                PIECE_FEATURE_TABLE[player_id][is_king],
+                dtype=np.int64
+            )
+
+    zero = np.uint64(0)
+    for player_id, sign in ((0, 1), (1, -1)):
+        men = player_masks[player_id] & ~kings
+        for bit, cone in RUNAWAY_CONES[player_id]:
+            features[:, -1] += sign * (
+                ((men & np.uint64(bit)) != zero)
+                & ((occupied & np.uint64(cone)) == zero)
+            )
+
+    return features
+
+
+def evaluate_batch(bitboards, players=None, weights=None):
+    """Return the scores of many positions as a NumPy array.
+
+    :param bitboards: a NumPy array of shape (N, 3), see
+        get_bitboard_array()
+    :param players: the players to move, to score the positions for them
+        like evaluate() (default: the scores for player 0)
+    :param weights: a dict of feature weights (default: DEFAULT_WEIGHTS)
+    """
+
+    # imported here, as only batch evaluation depends on NumPy
+    import numpy as np
+
+    scores = get_feature_matrix(bitboards) @ np.array(
+        get_weight_vector(weights),
+        dtype=np.int64
+    )
+    if players is not None:
+        scores = np.where(np.asarray(players) == 1, -scores, scores)
+
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prints the evaluation features of a position."
+    )
+
+    parser.add_argument(
+        '--fen',
+        dest='fen',
+        help="The position to evaluate (default: initial position)",
+        default='W:W31-50:B1-20'
+    )
+    parser.add_argument(
+        '-w',
+        '--weights',
+        dest='weights',
+        help="A JSON file with the feature weights",
+        default=None
+    )
+
+    args = parser.parse_args()
+
+    weights = None
+    if args.weights is not None:
+        weights = load_weights(args.weights)
+
+    state = board.GameState.from_fen(args.fen)
+    for name, value, weight in zip(
+            FEATURES,
+            get_features(state.board),
+            get_weight_vector(weights)
+    ):
+        print("{0:10} {1:4} x {2}".format(name, value, weight))
+    print("score {0} for {1}".format(
+        evaluate(state, weights),
+        "white" if state.current_player == 0 else "black"
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""A database of recorded games, read through a memory map.
+
+The games are stored in a gamerecord file, to which new games are only
+appended. Next to it, an index file (the same name with '.idx' added)
+stores one fixed-size row per game with the offset of the game and the
+columns that games can be filtered on: the amount of moves, the winner and
+the CRC-32 of both player names. The index is read with NumPy, so filtering
+millions of games does not decode any of them, and games appended to the
+record file by other programs are indexed when the database is opened.
+
+Usage:
+    database = GameDatabase('games.dgr')
+    for number in database.filter(winner=0, min_moves=40, player='Random'):
+        for state in database.iter_positions(number):
+            ...
+
+From the command line, games can be added and the database queried:
+
+    python -m gamedatabase games.dgr --add new.dgr old.bin collection.pdn
+    python -m gamedatabase games.dgr --winner 1 --player Random --list
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import gamerecord
+import pdn
+
+INDEX_MAGIC = b'DRGINDEX'
+INDEX_VERSION = 1
+
+# the header of the index: magic, version and the size of the record file
+# that has been indexed
+_INDEX_HEADER = struct.Struct('<8sQQ')
+
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('num_moves', '<u4'),
+    ('winner', 'i1'),
+    ('player1', '<u4'),
+    ('player2', '<u4')
+])
+
+
+def get_name_key(name):
+    """Return the index column value of a player name."""
+
+    return zlib.crc32((name or '').encode('utf-8'))
+
+
+class GameDatabase:
+    """A gamerecord file with an index, opened with mmap.
+
+    Games are numbered from 0 in the order they were added. Use len() for
+    the amount of games and database[number] to get a gamerecord.GameRecord.
+    """
+
+    def __init__(self, filename, verify=True):
+        """Open a database, and create it if the file does not exist.
+
+        :param filename: the name of the gamerecord file
+        :param verify: check the CRC of every game that is read
+        """
+
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.verify = verify
+
+        self._data = None
+        self._data_size = 0
+
+        if not os.path.exists(filename):
+            gamerecord.write_games(filename, [])
+
+        self._load_index()
+        self.update()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, number):
+        return gamerecord.decode_game(
+            self._get_data(),
+            int(self._index['offset'][number]),
+            self.verify
+        )[0]
+
+    def __iter__(self):
+        return self.iter_games()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+    def _get_data(self):
+        """Return the memory map of the record file.
+
+        The file is only mapped again by update(), so that reading a game
+        does not have to check the size of the file.
+        """
+
+        if self._data is None:
+            self._remap()
+
+        return self._data
+
+    def _remap(self):
+        """Map the record file again if its size changed."""
+
+        size = os.path.getsize(self.filename)
+        if self._data is None or size != self._data_size:
+            self.close()
+            with open(self.filename, 'rb') as file:
+                self._data = mmap.mmap(
+                    file.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ
+                )
+            self._data_size = size
+
+    def _load_index(self):
+        """Map the index file, if it exists and has the right version."""
+
+        self._index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._indexed_size = len(gamerecord.FILE_HEADER)
+        self._saved_rows = 0
+
+        if not os.path.exists(self.index_filename):
+            return
+
+        with open(self.index_filename, 'rb') as file:
+            header = file.read(_INDEX_HEADER.size)
+        if len(header) < _INDEX_HEADER.size:
+            return
+
+        magic, version, indexed_size = _INDEX_HEADER.unpack(header)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            # an index of another version is built again
+            return
+
+        rows = (
+            os.path.getsize(self.index_filename) - _INDEX_HEADER.size
+        ) // INDEX_DTYPE.itemsize
+        if rows:
+            index = np.memmap(
+                self.index_filename,
+                dtype=INDEX_DTYPE,
+                mode='r',
+                offset=_INDEX_HEADER.size,
+                shape=(rows,)
+            )
+
+            # ignore rows written after the header was last updated
+            rows = int(np.searchsorted(index['offset'], indexed_size))
+            self._index = index[:rows]
+
+        self._indexed_size = indexed_size
+        self._saved_rows = rows
+
+    def _save_index(self, rows, indexed_size):
+        """Append rows to the index file and update its header.
+
+        Returns False if the index file could not be written.
+        """
+
+        try:
+            if self._saved_rows:
+                file = open(self.index_filename, 'r+b')
+                file.truncate(
+                    _INDEX_HEADER.size
+                    + self._saved_rows * INDEX_DTYPE.itemsize
+                )
+                file.seek(0, os.SEEK_END)
+            else:
+                file = open(self.index_filename, 'wb')
+                file.write(_INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0))
+                file.write(self._index.tobytes())
+
+            with file:
+                file.write(rows.tobytes())
+                file.flush()
+
+                # the header is written last, so that the rows are only used
+                # once they are complete
+                file.seek(0)
+                file.write(_INDEX_HEADER.pack(
+                    INDEX_MAGIC, INDEX_VERSION, indexed_size
+                ))
+        except OSError:
+            return False
+
+        return True
+
+    def update(self):
+        """Index the games appended to the record file since the last update.
+
+        A game at the end of the file that is not complete yet is indexed
+        by a later update, but a corrupt game raises an Exception.
+        """
+
+        self._remap()
+        data = self._data
+        gamerecord.check_header(data)
+
+        offset = self._indexed_size
+        if offset >= len(data):
+            return
+
+        rows = []
+        while offset < len(data):
+            if not gamerecord.is_complete_game(data, offset):
+                # a game that is still being written is indexed later
+                break
+
+            if self.verify:
+                gamerecord.verify_game(data, offset)
+            winner, player1, player2, num_moves, end = \
+                gamerecord.decode_game_info(data, offset)
+
+            rows.append((
+                offset,
+                num_moves,
+                winner,
+                get_name_key(player1),
+                get_name_key(player2)
+            ))
+            offset = end
+        if not rows:
+            return
+        rows = np.array(rows, dtype=INDEX_DTYPE)
+
+        if self._save_index(rows, offset):
+            self._load_index()
+        else:
+            # keep the index in memory only
+            self._index = np.concatenate((self._index, rows))
+            self._indexed_size = offset
+
+    def append(self, games):
+        """Append an iterable of gamerecord.GameRecord objects."""
+
+        gamerecord.write_games(self.filename, games, append=True)
+        self.update()
+
+    def get_column(self, name):
+        """Return an index column ('num_moves', 'winner', 'player1' or
+        'player2') as a NumPy array.
+        """
+
+        return self._index[name]
+
+    def filter(
+            self,
+            winner=None,
+            min_moves=None,
+            max_moves=None,
+            player=None,
+            player_id=None
+    ):
+        """Return the numbers of the games that match all given filters.
+
+        :param winner: 0, 1 or -1 for a draw
+        :param min_moves: the minimal amount of moves
+        :param max_moves: the maximal amount of moves
+        :param player: a player name that has to take part in the game
+        :param player_id: only match player as player 1 (0) or player 2 (1)
+        """
+
+        selected = np.ones(len(self._index), dtype=bool)
+        if winner is not None:
+            selected &= self._index['winner'] == winner
+        if min_moves is not None:
+            selected &= self._index['num_moves'] >= min_moves
+        if max_moves is not None:
+            selected &= self._index['num_moves'] <= max_moves
+
+        numbers = np.flatnonzero(selected)
+        if player is None:
+            return numbers
+
+        key = get_name_key(player)
+        columns = ('player1', 'player2')
+        if player_id is not None:
+            columns = (columns[player_id],)
+
+        selected[:] = False
+        for column in columns:
+            selected |= self._index[column] == key
+        numbers = numbers[selected[numbers]]
+
+        # the CRC of a name can match the CRC of another name
+        return np.array([
+            number for number in numbers
+            if player in self._get_names(number, player_id)
+        ], dtype=numbers.dtype)
+
+    def _get_names(self, number, player_id=None):
+        _, player1, player2, _, _ = gamerecord.decode_game_info(
+            self._get_data(),
+            int(self._index['offset'][number])
+        )
+
+        if player_id is None:
+            return player1, player2
+
+        return ((player1, player2)[player_id],)
+
+    def iter_games(self, numbers=None):
+        """Yield the games with the given numbers (default: all games)."""
+
+        if numbers is None:
+            numbers = range(len(self))
+
+        for number in numbers:
+            yield self[number]
+
+    def iter_positions(self, number, step=1, validate=None):
+        """Yield the start position of a game and the positions after its
+        moves, see gamerecord.iter_positions().
+
+        The same GameState object is yielded every time, changed in place.
+
+        :param number: the number of the game
+        :param step: only yield the position after every step-th move
+        :param validate: check every move with the rules (default: only if
+            the CRC of the games is not verified)
+        """
+
+        if validate is None:
+            validate = not self.verify
+
+        return gamerecord.iter_positions(self[number], step, validate)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Adds games to and queries a game database."
+    )
+
+    parser.add_argument(
+        'database',
+        metavar='DATABASE',
+        help="The gamerecord file of the database"
+    )
+    parser.add_argument(
+        '-a',
+        '--add',
+        dest='add_files',
+        metavar='FILE',
+        nargs='+',
+        help="Gamerecord files, PDN files or old pickled games to add",
+        default=[]
+    )
+    parser.add_argument(
+        '-w',
+        '--winner',
+        dest='winner',
+        type=int,
+        help="Only games won by this player (0 or 1, -1 for draws)",
+        default=None
+    )
+    parser.add_argument(
+        '--min-moves',
+        dest='min_moves',
+        type=int,
+        help="Only games with at least this many moves",
+        default=None
+    )
+    parser.add_argument(
+        '--max-moves',
+        dest='max_moves',
+        type=int,
+        help="Only games with at most this many moves",
+        default=None
+    )
+    parser.add_argument(
+        '--player',
+        dest='player',
+        help="Only games played by the player with this name",
+        default=None
+    )
+    parser.add_argument(
+        '-l',
+        '--list',
+        dest='list_games',
+        action='store_true',
+        help="Print the matching games",
+        default=False
+    )
+
+    args = parser.parse_args()
+
+    with GameDatabase(args.database) as database:
+        for filename in args.add_files:
+            database.append(pdn.read_games(filename, skip_invalid=True))
+
+        numbers = database.filter(
+            args.winner,
+            args.min_moves,
+            args.max_moves,
+            args.player
+        )
+        print("{0} of {1} games match".format(len(numbers), len(database)))
+
+        if args.list_games:
+            for number in numbers:
+                game = database[number]
+                print("{0}: {1} - {2}, {3} moves, winner {4}".format(
+                    number,
+                    game.player1_name,
+                    game.player2_name,
+                    len(game.movelist),
+                    game.winner
+                ))
+
+
+if __name__ == "__main__":
+    main()
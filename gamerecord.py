@@ -0,0 +1,527 @@
+"""A compact binary format for recorded games.
+
+A game record file starts with the 8 byte magic string b'DRAIGHTS' and a
+version byte, followed by any amount of games. Each game is stored as
+
+    body length (uint32) | body | CRC-32 of the body (uint32)
+
+and the body contains, with all integers little-endian:
+
+    winner (int8: 0, 1, -1 for a draw or UNKNOWN_WINNER)
+    name of player 1 and player 2 (uint8 length + UTF-8 bytes each)
+    start position flag (uint8), followed if set by the board
+        (BoardGrid.to_bytes(), 19 bytes), the player to move (uint8) and
+        the turn (uint16)
+    amount of moves (uint32)
+    the moves
+
+Every move is a flags byte (see the MOVE_* constants) followed, if a piece
+was moved, by its square, the length of its path and the squares of the
+path, one byte each. Capture paths are stored in full, so that a game can be
+replayed without looking up which pieces were captured.
+
+The format replaces the pickled files of earlier versions, which can be
+converted with convert_pickle() or from the command line:
+
+    python -m gamerecord old1.bin old2.bin -o games.dgr
+"""
+
+import argparse
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from collections import namedtuple
+
+import board
+
+MAGIC = b'DRAIGHTS'
+VERSION = 1
+FILE_HEADER = MAGIC + bytes([VERSION])
+
+UNKNOWN_WINNER = -128
+
+MOVE_PLAYER = 1
+MOVE_KING = 2
+MOVE_CAPTURE = 4
+MOVE_REQUEST_TIE = 8
+MOVE_ACCEPT_TIE = 16
+MOVE_RESIGN = 32
+MOVE_PIECE = 64
+
+_LENGTH = struct.Struct('<I')
+_START = struct.Struct('<BH')
+
+
+class GameRecord(namedtuple('GameRecord', (
+        'player1_name',
+        'player2_name',
+        'winner',
+        'start_state',
+        'movelist'
+))):
+    """A recorded game.
+
+    winner is 0 or 1 for the player who won, -1 for a draw or UNKNOWN_WINNER.
+    start_state is the GameState the game started from, or None for the
+    initial position, and movelist a tuple of board.CompactHistoryMove
+    objects.
+    """
+
+    __slots__ = ()
+
+    def get_start_state(self):
+        """Return a copy of the start state that can be changed."""
+
+        if self.start_state is None:
+            return board.GameState()
+
+        return board.GameState(
+            board=self.start_state.board,
+            turn=self.start_state.turn,
+            player=self.start_state.current_player,
+            tie_request=self.start_state.tie_request
+        )
+
+    @staticmethod
+    def from_history(history, player_names, winner):
+        """Create a GameRecord from a board.History object."""
+
+        start_state = history.gamestates[0][0]
+        if start_state.board == board.BoardGrid() \
+                and start_state.current_player == 0 \
+                and start_state.turn == 1:
+            start_state = None
+
+        return GameRecord(
+            player_names[0],
+            player_names[1],
+            winner,
+            start_state,
+            tuple(history.movelist)
+        )
+
+
+def _encode_name(name):
+    data = (name or '').encode('utf-8')
+    if len(data) > 255:
+        raise Exception("Player name too long: {0}".format(name))
+
+    return bytes([len(data)]) + data
+
+
+def encode_move(move):
+    """Return the bytes of a board.CompactHistoryMove."""
+
+    flags = (
+        MOVE_PLAYER * bool(move.player_id)
+        | MOVE_KING * bool(move.is_king)
+        | MOVE_CAPTURE * bool(move.captured_pieces)
+        | MOVE_REQUEST_TIE * bool(move.request_tie)
+        | MOVE_ACCEPT_TIE * bool(move.accepted_tie)
+        | MOVE_RESIGN * bool(move.resigned)
+    )
+    if move.square is None:
+        return bytes([flags])
+
+    return bytes(
+        (flags | MOVE_PIECE, move.square, len(move.path)) + tuple(move.path)
+    )
+
+
+def encode_game(game):
+    """Return the bytes of a GameRecord, including its length and CRC."""
+
+    parts = [
+        struct.pack('<b', game.winner),
+        _encode_name(game.player1_name),
+        _encode_name(game.player2_name)
+    ]
+
+    if game.start_state is None:
+        parts.append(b'\x00')
+    else:
+        parts.append(b'\x01')
+        parts.append(game.start_state.board.to_bytes())
+        parts.append(_START.pack(
+            int(game.start_state.current_player),
+            game.start_state.turn
+        ))
+
+    parts.append(_LENGTH.pack(len(game.movelist)))
+    for move in game.movelist:
+        if not isinstance(move, board.CompactHistoryMove):
+            move = board.CompactHistoryMove.from_history_move(move)
+        parts.append(encode_move(move))
+
+    body = b''.join(parts)
+
+    return _LENGTH.pack(len(body)) + body + _LENGTH.pack(zlib.crc32(body))
+
+
+def _decode_name(data, offset):
+    length = data[offset]
+    offset += 1
+
+    return bytes(data[offset:offset + length]).decode('utf-8'), \
+        offset + length
+
+
+def is_complete_game(data, offset):
+    """Return True if all bytes of the game at an offset are in data, False
+    if the data ends before the game does, e.g. while it is written.
+    """
+
+    if offset + _LENGTH.size > len(data):
+        return False
+
+    length, = _LENGTH.unpack_from(data, offset)
+
+    return offset + length + 2 * _LENGTH.size <= len(data)
+
+
+def verify_game(data, offset):
+    """Raise an Exception if the CRC of the game at an offset is wrong."""
+
+    length, = _LENGTH.unpack_from(data, offset)
+    start = offset + _LENGTH.size
+    crc, = _LENGTH.unpack_from(data, start + length)
+    if zlib.crc32(data[start:start + length]) != crc:
+        raise Exception("Corrupt game at offset {0}".format(offset))
+
+
+def decode_game_info(data, offset=0):
+    """Decode the header of a game without decoding its moves.
+
+    Returns a tuple (winner, player 1 name, player 2 name, amount of moves,
+    offset after the game).
+
+    :param data: a bytes-like object, e.g. the contents of a file or a mmap
+    :param offset: the offset of the length field of the game
+    """
+
+    length, = _LENGTH.unpack_from(data, offset)
+    start = offset + _LENGTH.size
+    end = start + length
+    if end + _LENGTH.size > len(data):
+        raise Exception("Truncated game at offset {0}".format(offset))
+
+    winner, = struct.unpack_from('<b', data, start)
+    player1_name, position = _decode_name(data, start + 1)
+    player2_name, position = _decode_name(data, position)
+    if data[position]:
+        position += 19 + _START.size
+    num_moves, = _LENGTH.unpack_from(data, position + 1)
+
+    return winner, player1_name, player2_name, num_moves, end + _LENGTH.size
+
+
+def decode_game(data, offset=0, verify=True):
+    """Decode the game that starts at an offset of a bytes-like object.
+
+    Returns a tuple (GameRecord, offset after the game).
+
+    :param data: a bytes-like object, e.g. the contents of a file or a mmap
+    :param offset: the offset of the length field of the game
+    :param verify: check the CRC of the game
+    """
+
+    length, = _LENGTH.unpack_from(data, offset)
+    start = offset + _LENGTH.size
+    end = start + length
+    if end + _LENGTH.size > len(data):
+        raise Exception("Truncated game at offset {0}".format(offset))
+
+    if verify:
+        verify_game(data, offset)
+
+    winner, = struct.unpack_from('<b', data, start)
+    player1_name, position = _decode_name(data, start + 1)
+    player2_name, position = _decode_name(data, position)
+
+    start_state = None
+    if data[position]:
+        position += 1
+        grid = board.BoardGrid.from_bytes(data[position:position + 19])
+        position += 19
+        player, turn = _START.unpack_from(data, position)
+        position += _START.size
+        start_state = board.GameState(board=grid, turn=turn, player=player)
+    else:
+        position += 1
+
+    num_moves, = _LENGTH.unpack_from(data, position)
+    position += _LENGTH.size
+
+    movelist = []
+    for _ in range(num_moves):
+        flags = data[position]
+        if flags & MOVE_PIECE:
+            square = data[position + 1]
+            path_length = data[position + 2]
+            path = tuple(data[position + 3:position + 3 + path_length])
+            position += 3 + path_length
+        else:
+            square = None
+            path = None
+            position += 1
+
+        movelist.append(board.CompactHistoryMove(
+            flags & MOVE_PLAYER,
+            square,
+            bool(flags & MOVE_KING),
+            path,
+            bool(flags & MOVE_CAPTURE),
+            bool(flags & MOVE_REQUEST_TIE),
+            bool(flags & MOVE_ACCEPT_TIE),
+            bool(flags & MOVE_RESIGN)
+        ))
+
+    if position != end:
+        raise Exception("Invalid game at offset {0}".format(offset))
+
+    return GameRecord(
+        player1_name,
+        player2_name,
+        winner,
+        start_state,
+        tuple(movelist)
+    ), end + _LENGTH.size
+
+
+def check_header(data):
+    """Raise an Exception if data does not start with a supported header."""
+
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise Exception("Not a game record file")
+    if data[len(MAGIC)] != VERSION:
+        raise Exception("Unsupported game record version {0}".format(
+            data[len(MAGIC)]
+        ))
+
+
+def _open_data(filename):
+    """Return a read-only mmap of a game record file, after checking its
+    header.
+    """
+
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < len(FILE_HEADER):
+            raise Exception("Not a game record file")
+
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        check_header(data)
+    except Exception:
+        data.close()
+        raise
+
+    return data
+
+
+def read_games(filename, verify=True):
+    """Yield the GameRecord objects stored in a file.
+
+    The file is read through a memory map, so that only the game that is
+    being decoded has to be in memory.
+    """
+
+    with _open_data(filename) as data:
+        offset = len(FILE_HEADER)
+        while offset < len(data):
+            game, offset = decode_game(data, offset, verify)
+            yield game
+
+
+def read_game(filename, number, verify=True):
+    """Return the GameRecord with a number (from 0) stored in a file.
+
+    The games before it are skipped by their headers, without decoding or
+    verifying them.
+    """
+
+    with _open_data(filename) as data:
+        offset = len(FILE_HEADER)
+        for index in range(number):
+            if offset >= len(data):
+                break
+            offset = decode_game_info(data, offset)[-1]
+
+        if number < 0 or offset >= len(data):
+            raise Exception("{0} has no game {1}".format(filename, number))
+
+        return decode_game(data, offset, verify)[0]
+
+
+def write_games(filename, games, append=False):
+    """Write GameRecord objects to a file, or append them to it."""
+
+    with open(filename, 'ab' if append else 'wb') as file:
+        if file.tell() == 0:
+            file.write(FILE_HEADER)
+
+        for game in games:
+            file.write(encode_game(game))
+
+
+def is_game_record_file(filename):
+    with open(filename, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def get_captured_positions(grid, move):
+    """Return the positions of the pieces captured by a recorded move.
+
+    The pieces are found by following the path of the move over the board
+    before the move, without checking that the move is legal.
+
+    :param grid: the board.BoardGrid before the move
+    :param move: a board.CompactHistoryMove
+    """
+
+    if not move.captured_pieces:
+        return ()
+
+    opponent_mask = grid.get_player_mask(not move.player_id)
+    captured = []
+    pos = board.SQUARE_POSITIONS[move.square]
+    for square in move.path:
+        end_pos = board.SQUARE_POSITIONS[square]
+        dx = 1 if pos[0] < end_pos[0] else -1
+        dy = 1 if pos[1] < end_pos[1] else -1
+
+        pos = (pos[0] + dx, pos[1] + dy)
+        while pos != end_pos:
+            if opponent_mask >> (10 * pos[1] + pos[0]) // 2 & 1:
+                captured.append(pos)
+            pos = (pos[0] + dx, pos[1] + dy)
+
+    return tuple(captured)
+
+
+def iter_positions(game, step=1, validate=False):
+    """Yield the start position of a game and the positions after its moves.
+
+    The moves are applied to a single GameState with GameState.make_move(),
+    so the same object is yielded every time and changed in place; copy it
+    to keep a position. Unless validate is set, the moves are trusted and
+    the captured pieces are found from the paths of the moves, which is
+    safe for games read with their CRC verified.
+
+    :param game: a GameRecord
+    :param step: only yield the position after every step-th move
+    :param validate: check every move with the rules, and raise an
+        Exception on an illegal move
+    """
+
+    state = game.get_start_state()
+    yield state
+
+    for number, move in enumerate(game.movelist, 1):
+        if move.path is None:
+            break
+
+        if validate:
+            if move.player_id != state.current_player \
+                    or state.make_move(move.piece, move.move) is None:
+                raise Exception("Invalid move on turn {0}".format(
+                    state.turn
+                ))
+        else:
+            state.make_move(
+                move.piece,
+                move.move,
+                get_captured_positions(state.board, move)
+            )
+
+        if number % step == 0:
+            yield state
+
+
+def get_winner(movelist, start_state=None):
+    """Return the winner of a list of moves by replaying them.
+
+    Returns UNKNOWN_WINNER if the game did not end.
+    """
+
+    state = start_state or board.GameState()
+    history = board.History(state)
+    for move in movelist:
+        if move.resigned:
+            return int(not move.player_id)
+        if move.accepted_tie:
+            return -1
+
+        new_state = state.get_successor(move.piece, move.move)
+        if new_state is None:
+            raise Exception("Invalid move on turn {0}".format(state.turn))
+
+        history.add_move(new_state, move, state)
+        state = new_state
+
+        if state.is_opponent_winning():
+            return int(not state.current_player)
+        elif state.is_draw(history):
+            return -1
+
+    return UNKNOWN_WINNER
+
+
+def convert_pickle(filename):
+    """Return a GameRecord of a pickled game of Game.save_history_to_file().
+
+    The pickled files do not store the result, so the game is replayed to
+    find the winner.
+    """
+
+    with open(filename, 'rb') as file:
+        data = pickle.load(file)
+
+    movelist = tuple(
+        move if isinstance(move, board.CompactHistoryMove)
+        else board.CompactHistoryMove.from_history_move(move)
+        for move in data['movelist']
+    )
+
+    return GameRecord(
+        data['player1_name'],
+        data['player2_name'],
+        get_winner(movelist),
+        None,
+        movelist
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts pickled games to the game record format."
+    )
+
+    parser.add_argument(
+        'inputs',
+        metavar='FILE',
+        nargs='+',
+        help="The pickled games to convert"
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='output',
+        metavar='FILE',
+        help="The game record file to append the games to",
+        required=True
+    )
+
+    args = parser.parse_args()
+
+    write_games(
+        args.output,
+        (convert_pickle(filename) for filename in args.inputs),
+        append=True
+    )
+
+
+if __name__ == "__main__":
+    main()
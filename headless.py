@@ -0,0 +1,386 @@
+"""Run draughts matches without graphics.
+
+The draights module imports pygame and builds the event manager and button
+geometry of the GUI for every Game, even when no window is opened. This
+module plays matches with the same rules and draw semantics as
+draights.Game.run(), but only depends on the board, draughtsrules and player
+modules, so that it can be used by short-lived worker processes.
+
+Usage:
+    python -m headless -p RandomPlayer RandomPlayer -n 100
+"""
+
+import argparse
+import os
+import time
+from ast import literal_eval
+from copy import deepcopy
+
+import board
+import gamerecord
+import player
+from draughtsrules import DraughtsRules
+from draughtsrules import TIE_REQUEST_TURN
+
+
+class PlayerConfig:
+    """A class used as initialization for the players argument of a Game
+    object.
+    """
+
+    def __init__(self, name=None, constructor=None,
+                 optional_args=None):
+        self.name = name
+
+        if constructor is None:
+            # imported here, as humanplayer depends on pygame
+            import humanplayer
+            self.constructor = humanplayer.HumanPlayer
+        else:
+            self.constructor = constructor
+
+        if optional_args is None:
+            self.optional_args = {}
+        else:
+            self.optional_args = optional_args
+
+
+class HeadlessGame:
+    """The object that runs a draughts match without graphics.
+
+    To run a match, create the object then call its run method. To run multiple
+    matches, create separate objects.
+    """
+
+    def __init__(self, players, record=False, start_state=None):
+        """Initialize the HeadlessGame object.
+
+        :param players: an iterable of length 2 of PlayerConfig objects, or
+            of player.Player objects that are reused from an earlier match
+        :param record: record the match and save it in a file with the
+            current data as name
+        :param start_state: the GameState to start from, e.g. from
+            openings.get_start_state() (default: the initial position)
+        """
+
+        self.record = record
+
+        if start_state is None:
+            self.current_state = board.GameState()
+        else:
+            self.current_state = deepcopy(start_state)
+        self.history = board.History(self.current_state)
+
+        self.players = [
+            config if isinstance(config, player.Player)
+            else create_player(config, player_id)
+            for player_id, config in enumerate(players)
+        ]
+        self.winner = -1
+
+    def play_turn(self):
+        """Ask the current player for an action and apply it.
+
+        Returns True if the game has ended.
+        """
+
+        state = self.current_state
+        action = self.players[state.current_player].get_action(
+            board.GameStateView(state),
+            board.HistoryView(self.history)
+        )
+
+        if state.tie_request == board.INVALID_TIE_REQUEST:
+            state.tie_request = board.NO_TIE_REQUEST
+
+        if action.resign:
+            self.history.add_move(
+                state,
+                board.HistoryMove(
+                    player_id=state.current_player,
+                    resign=True
+                ),
+                state
+            )
+            self.winner = int(not state.current_player)
+            return True
+        if action.accept_tie:
+            if state.turn >= TIE_REQUEST_TURN \
+                    and state.tie_request == (not state.current_player):
+                self.history.add_move(
+                    state,
+                    board.HistoryMove(
+                        player_id=state.current_player,
+                        accept_tie=True
+                    ),
+                    state
+                )
+                self.winner = -1
+                return True
+            else:
+                raise Exception(
+                    "Tie requested on turn {0}".format(state.turn)
+                )
+
+        record = DraughtsRules.get_move_record(
+            action.piece,
+            action.move,
+            state
+        )
+        if record is None:
+            raise Exception('Invalid move')
+
+        if action.request_tie:
+            if state.turn < TIE_REQUEST_TURN:
+                raise Exception(
+                    "Tie requested on turn {0}".format(state.turn)
+                )
+
+            state.tie_request = state.current_player
+
+        # the move has been validated, so the successor is made directly
+        # instead of through GameState.get_successor()
+        self.current_state = board.GameState(
+            board=state.board,
+            turn=state.turn,
+            player=state.current_player,
+            tie_request=state.tie_request
+        )
+        self.current_state.make_move(
+            record.piece,
+            record.move,
+            record.captured
+        )
+        self.history.add_move(
+            self.current_state,
+            board.HistoryMove(
+                state.current_player,
+                record.piece,
+                record.move,
+                record.num_captures > 0,
+                action.request_tie
+            ),
+            state
+        )
+
+        if self.current_state.is_opponent_winning():
+            self.winner = int(not self.current_state.current_player)
+            return True
+        elif self.current_state.is_draw(self.history):
+            self.winner = -1
+            return True
+
+        return False
+
+    def run(self, initialize_players=True):
+        """Run the draughts match.
+
+        Runs a match, then returns a tuple (history, winner)
+        history -- a board.History object with the history of the current match
+        winner -- the winner of the match, or -1 if the match was a draw
+
+        :param initialize_players: call initialize() on the players first,
+            which can be skipped for players that are reused
+        """
+
+        if initialize_players:
+            for p in self.players:
+                p.initialize()
+
+        while not self.play_turn():
+            pass
+
+        for p in self.players:
+            p.end_game(board.HistoryView(self.history), self.winner)
+
+        if self.record:
+            save_history_to_file(
+                self.history,
+                [p.name for p in self.players],
+                self.winner
+            )
+
+        return self.history, self.winner
+
+
+def create_player(config, player_id):
+    """Create a player object from a PlayerConfig object."""
+
+    return config.constructor(
+        player_id,
+        name=config.name,
+        **config.optional_args
+    )
+
+
+def save_history_to_file(history, player_names, winner):
+    """Save a game in the gamerecord format, named by the current time."""
+
+    filename = '-'.join(str(t) for t in time.localtime()[1:6]) + '.dgr'
+    gamerecord.write_games(
+        filename,
+        [gamerecord.GameRecord.from_history(history, player_names, winner)]
+    )
+
+
+def load_player(p, nographics):
+    python_path_str = os.path.expandvars("$PYTHONPATH")
+    if python_path_str.find(';') == -1:
+        python_path_dirs = python_path_str.split(':')
+    else:
+        python_path_dirs = python_path_str.split(';')
+    python_path_dirs.append('.')
+
+    for module_dir in python_path_dirs:
+        if not os.path.isdir(module_dir):
+            continue
+
+        modulenames = (
+            file for file in os.listdir(module_dir) if
+            file.endswith('player.py') and
+            not file.startswith('.') and
+            not file.startswith('_')
+        )
+        for modulename in modulenames:
+            # humanplayer is not imported without display, as it depends on
+            # pygame
+            if nographics and modulename == 'humanplayer.py':
+                if p == 'HumanPlayer':
+                    raise Exception("Cannot use HumanPlayer without display")
+                continue
+
+            try:
+                module = __import__(modulename[:-3])
+            except ImportError:
+                continue
+            if p in dir(module):
+                return getattr(module, p)
+
+    raise Exception(
+        "The player {0} is not specified in any *player.py".format(p)
+    )
+
+
+def parse_playeropts(optionstr):
+    if optionstr is None:
+        return {}
+
+    if ',' in optionstr:
+        options = optionstr.split(',')
+    else:
+        options = [optionstr]
+
+    arguments = {}
+    for option in options:
+        if '=' in option:
+            key, val = option.split('=')
+
+            try:
+                val = literal_eval(val)
+            except SyntaxError or ValueError:
+                pass
+        else:
+            key, val = option, True
+
+        arguments[key] = val
+
+    return arguments
+
+
+def parse_players(player_names, player_options, nographics):
+    players = []
+    for index in range(len(player_names)):
+        if '=' in player_names[index]:
+            name, classname = player_names[index].split('=')
+        else:
+            name, classname = None, player_names[index]
+
+        players.append(PlayerConfig(name, load_player(classname, nographics),
+                                    parse_playeropts(player_options[index])))
+
+    return players
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs draughts matches without graphics."
+    )
+
+    parser.add_argument(
+        '-p',
+        '--players',
+        dest='players',
+        metavar='PLAYER',
+        help="The player objects to be used.",
+        nargs=2,
+        default=['RandomPlayer', 'RandomPlayer']
+    )
+    parser.add_argument(
+        '-p1',
+        dest='player1_args',
+        metavar='ARGUMENTS',
+        help="Extra arguments to pass to player 1 (default: white)",
+        default=None
+    )
+    parser.add_argument(
+        '-p2',
+        dest='player2_args',
+        metavar='ARGUMENTS',
+        help="Extra arguments to pass to player 2 (default: black)",
+        default=None
+    )
+    parser.add_argument(
+        '-n',
+        '--games',
+        dest='num_games',
+        type=int,
+        help="The amount of matches to play",
+        default=1
+    )
+    parser.add_argument(
+        '-r',
+        dest='record',
+        action='store_true',
+        help="Write game history to a file named by the time it was recorded",
+        default=False
+    )
+    parser.add_argument(
+        '-b',
+        '--bitboards',
+        dest='use_bitboards',
+        action='store_true',
+        help="Use the bitboard move generator",
+        default=False
+    )
+
+    args = parser.parse_args()
+    DraughtsRules.use_bitboards = args.use_bitboards
+
+    players = parse_players(
+        args.players,
+        (args.player1_args, args.player2_args),
+        True
+    )
+
+    results = {0: 0, 1: 0, -1: 0}
+    total_moves = 0
+    t = time.perf_counter()
+    for _ in range(args.num_games):
+        history, winner = HeadlessGame(players, args.record).run()
+        results[winner] += 1
+        total_moves += len(history.movelist)
+    t = time.perf_counter() - t
+
+    print("{0} wins, {1} draws, {2} losses for {3}".format(
+        results[0], results[-1], results[1], args.players[0]
+    ))
+    print("{0} games, {1} moves in {2:.3f} s ({3:.1f} ms/game)".format(
+        args.num_games,
+        total_moves,
+        t,
+        1000 * t / args.num_games if args.num_games else 0
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""An opening book built from recorded games.
+
+The book stores, for every position that occurred in the first plies of
+the games, the moves that were played in it with the amount of games and
+the score of the player who moved. Entries are sorted by the Zobrist key of
+the position (GameState.key), so that the book is probed with a binary
+search over a memory map, without loading the file.
+
+A book file starts with a header of BOOK_HEADER.size bytes, followed by the
+entries as an array of BOOK_DTYPE. Moves are stored by their start square,
+end square and a 16-bit hash of their path, and are matched against the
+legal moves of the position when the book is probed.
+
+Usage:
+    book = OpeningBook('book.bin')
+    record = book.get_move(state)
+    if record is not None:
+        ...
+
+Books are built from game record files (e.g. written with -r), PDN files or
+old pickled games:
+
+    python -m openingbook book.bin games.dgr collection.pdn --plies 16
+"""
+
+import argparse
+import random
+import struct
+import zlib
+
+import numpy as np
+
+import board
+import gamerecord
+import pdn
+from draughtsrules import DraughtsRules
+
+BOOK_MAGIC = b'DRGOBOOK'
+BOOK_VERSION = 1
+
+# magic, version and the amount of entries
+BOOK_HEADER = struct.Struct('<8sB7xQ')
+
+BOOK_DTYPE = np.dtype([
+    ('key', '<u8'),
+    ('square', 'u1'),
+    ('end', 'u1'),
+    ('path_key', '<u2'),
+    ('games', '<u4'),
+    # twice the score: 2 for every win and 1 for every draw
+    ('points', '<u4')
+])
+
+
+def get_path_key(path):
+    """Return the 16-bit hash of the square numbers of a move path."""
+
+    return zlib.crc32(bytes(path)) & 0xffff
+
+
+def get_record_path(record):
+    """Return the square numbers of the path of a draughtsrules.MoveRecord.
+    """
+
+    return tuple(
+        board.History.convert_pos_to_index(pos) for pos in record.move
+    )
+
+
+def build_book(games, max_plies=20, min_games=1):
+    """Return the entries of a book as a sorted NumPy array of BOOK_DTYPE.
+
+    :param games: an iterable of gamerecord.GameRecord objects
+    :param max_plies: the amount of plies of every game to add
+    :param min_games: leave out moves played in fewer games
+    """
+
+    stats = {}
+    for game in games:
+        if game.winner == gamerecord.UNKNOWN_WINNER:
+            continue
+
+        state = game.get_start_state()
+        for move in game.movelist[:max_plies]:
+            if move.path is None:
+                break
+
+            if game.winner == -1:
+                points = 1
+            else:
+                points = 2 * (game.winner == move.player_id)
+
+            entry_key = (
+                state.key,
+                move.square,
+                move.path[-1],
+                get_path_key(move.path)
+            )
+            entry = stats.get(entry_key)
+            if entry is None:
+                stats[entry_key] = [1, points]
+            else:
+                entry[0] += 1
+                entry[1] += points
+
+            state.make_move(
+                move.piece,
+                move.move,
+                gamerecord.get_captured_positions(state.board, move)
+            )
+
+    entries = np.array(
+        [
+            entry_key + tuple(entry)
+            for entry_key, entry in stats.items()
+            if entry[0] >= min_games
+        ],
+        dtype=BOOK_DTYPE
+    )
+    entries.sort(order=('key', 'games'))
+
+    return entries
+
+
+def write_book(filename, entries):
+    with open(filename, 'wb') as file:
+        file.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, len(entries)))
+        file.write(entries.tobytes())
+
+
+class OpeningBook:
+    """A book file, opened with a read-only memory map."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as file:
+            header = file.read(BOOK_HEADER.size)
+        if len(header) < BOOK_HEADER.size:
+            raise Exception("Not an opening book: {0}".format(filename))
+
+        magic, version, num_entries = BOOK_HEADER.unpack(header)
+        if magic != BOOK_MAGIC:
+            raise Exception("Not an opening book: {0}".format(filename))
+        if version != BOOK_VERSION:
+            raise Exception("Unsupported opening book version {0}".format(
+                version
+            ))
+
+        self._entries = np.zeros(0, dtype=BOOK_DTYPE)
+        if num_entries:
+            self._entries = np.memmap(
+                filename,
+                dtype=BOOK_DTYPE,
+                mode='r',
+                offset=BOOK_HEADER.size,
+                shape=(num_entries,)
+            )
+        self._keys = self._entries['key']
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._entries = self._keys = np.zeros(0, dtype=BOOK_DTYPE)
+
+    def get_entries(self, state):
+        """Return the book moves of a GameState.
+
+        Returns a list of tuples (draughtsrules.MoveRecord, games, score),
+        in which score is the mean score of the player to move (1 for a
+        win, 0.5 for a draw). Moves that are not legal in the position,
+        e.g. because of a hash collision, are left out.
+        """
+
+        key = np.uint64(state.key)
+        first = np.searchsorted(self._keys, key, 'left')
+        last = np.searchsorted(self._keys, key, 'right')
+        if first == last:
+            return []
+
+        records = DraughtsRules.get_all_move_records(state)
+        entries = []
+        for entry in self._entries[first:last]:
+            for record in records:
+                path = get_record_path(record)
+                if board.History.convert_pos_to_index(record.piece.pos) \
+                        == entry['square'] \
+                        and path[-1] == entry['end'] \
+                        and get_path_key(path) == entry['path_key']:
+                    entries.append((
+                        record,
+                        int(entry['games']),
+                        int(entry['points']) / (2 * int(entry['games']))
+                    ))
+                    break
+
+        return entries
+
+    def get_move(self, state, min_games=1, best=False, rng=random):
+        """Return a book move of a GameState as a draughtsrules.MoveRecord,
+        or None if the position is not in the book.
+
+        :param state: the GameState
+        :param min_games: only play moves played in at least this many games
+        :param best: play the move with the best score instead of a random
+            move weighted by the amount of games, which varies the openings
+        :param rng: the random.Random object used to pick a move
+        """
+
+        entries = [
+            entry for entry in self.get_entries(state)
+            if entry[1] >= min_games
+        ]
+        if not entries:
+            return None
+
+        if best:
+            return max(entries, key=lambda entry: (entry[2], entry[1]))[0]
+
+        return rng.choices(
+            [record for record, _, _ in entries],
+            weights=[games for _, games, _ in entries]
+        )[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds an opening book from recorded games."
+    )
+
+    parser.add_argument(
+        'book',
+        metavar='BOOK',
+        help="The opening book file to write"
+    )
+    parser.add_argument(
+        'inputs',
+        metavar='FILE',
+        nargs='+',
+        help="Game record files, PDN files or old pickled games"
+    )
+    parser.add_argument(
+        '--plies',
+        dest='max_plies',
+        type=int,
+        help="The amount of plies of every game to add",
+        default=20
+    )
+    parser.add_argument(
+        '--min-games',
+        dest='min_games',
+        type=int,
+        help="Leave out moves played in fewer games",
+        default=1
+    )
+
+    args = parser.parse_args()
+
+    entries = build_book(
+        (
+            game
+            for filename in args.inputs
+            for game in pdn.read_games(filename, skip_invalid=True)
+        ),
+        args.max_plies,
+        args.min_games
+    )
+    write_book(args.book, entries)
+
+    print("{0} moves in {1} positions".format(
+        len(entries),
+        len(np.unique(entries['key']))
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Opening suites, used as start positions of tournament games.
+
+An opening file contains one opening per line, which is either a FEN string
+such as 'B:W31-50:B1-19,24' or a sequence of moves from the initial position
+in draughts notation, such as '1. 32-28 19-23 2. 28x19 14x23'. Move numbers
+are ignored, as is everything after a '#'.
+
+Openings are kept as strings, so that they can be sent to worker processes
+cheaply, and turned into a GameState with get_start_state().
+
+Run the module to check that moves in short notation are resolved:
+
+    python -m openings
+"""
+
+import re
+import sys
+
+import board
+from draughtsrules import DraughtsRules
+
+
+def is_fen(opening):
+    return ':' in opening
+
+
+def parse_move(move_str, state):
+    """Return the draughtsrules.MoveRecord of a move in draughts notation.
+
+    The move is given by its start and end square, e.g. '32-28' or '28x19',
+    and captures may list the squares in between, e.g. '47x36x27x18'.
+
+    :param move_str: the move as a string
+    :param state: the GameState the move is played in
+    """
+
+    squares = [int(square) for square in re.split('[-x:]', move_str)]
+    matches = []
+    for record in DraughtsRules.get_all_move_records(state):
+        path = [board.History.convert_pos_to_index(record.piece.pos)] + [
+            board.History.convert_pos_to_index(pos) for pos in record.move
+        ]
+        if path[0] != squares[0] or path[-1] != squares[-1]:
+            continue
+
+        # the squares in between have to be visited in the same order
+        remaining = iter(path[1:-1])
+        if all(square in remaining for square in squares[1:-1]):
+            matches.append(record)
+
+    if not matches:
+        raise Exception("Illegal move {0} on turn {1}".format(
+            move_str, state.turn
+        ))
+    elif len(matches) > 1 and len(set(
+            (record.move[-1], frozenset(record.captured))
+            for record in matches
+    )) > 1:
+        # captures that end on the same square and take the same pieces
+        # are the same move, even if they take them in another order
+        raise Exception("Ambiguous move {0} on turn {1}".format(
+            move_str, state.turn
+        ))
+
+    return matches[0]
+
+
+def get_start_state(opening):
+    """Return the GameState of an opening, or the initial state if None."""
+
+    if opening is None:
+        return board.GameState()
+
+    if is_fen(opening):
+        return board.GameState.from_fen(opening)
+
+    state = board.GameState()
+    for move_str in opening.split():
+        if move_str.endswith('.'):
+            continue
+
+        record = parse_move(move_str, state)
+        state.make_move(record.piece, record.move, record.captured)
+
+    if not DraughtsRules.get_all_move_records(state):
+        raise Exception("Opening {0} ends the game".format(opening))
+
+    return state
+
+
+def load_openings(filename):
+    """Return the openings in a file as a list of strings.
+
+    Every opening is checked by playing it, so that mistakes in the file
+    are found before any game starts.
+    """
+
+    openings = []
+    with open(filename, 'r') as file:
+        for line in file:
+            opening = line.split('#')[0].strip()
+            if not opening:
+                continue
+
+            get_start_state(opening)
+            openings.append(opening)
+
+    if not openings:
+        raise Exception("No openings in {0}".format(filename))
+
+    return openings
+
+
+# moves that parse_move() has to resolve, as tuples (FEN string, move,
+# the squares of the captured pieces)
+MOVE_CHECKS = (
+    # two paths capture the same pieces in another order
+    ('B:W27,28,37,K38,39:B15,16,20,K50', '50x33', (27, 28, 37, 38, 39)),
+)
+
+
+def check_parse_move():
+    """Return True if all moves of MOVE_CHECKS are resolved as expected."""
+
+    success = True
+    for fen, move_str, expected in MOVE_CHECKS:
+        state = board.GameState.from_fen(fen)
+        try:
+            captured = tuple(sorted(
+                board.History.convert_pos_to_index(pos)
+                for pos in parse_move(move_str, state).captured
+            ))
+        except Exception as e:
+            captured = repr(e)
+
+        print("{0} in {1}: captures {2}".format(move_str, fen, captured))
+        if captured != expected:
+            print("  FAILED (expected {0})".format(expected))
+            success = False
+
+    return success
+
+
+def main():
+    """Run the checks of the module."""
+
+    if not check_parse_move():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""Search the moves of the root position in parallel worker processes.
+
+ParallelSearch splits the root moves of an iterative deepening search over
+a pool of worker processes. At every depth, the best move of the previous
+depth is searched first with a full window. The other moves are then
+searched at the same time with a null window around its score, and only
+the moves that turn out to be better are searched again with a full window.
+Every worker keeps its own player object, so its transposition table and
+move ordering tables are reused for the next moves and depths. Give the
+players a tt_name in player_args to share a transposition table between
+the workers instead (see transposition.TranspositionTable).
+
+The workers search with a game-tree player class that has the search_move()
+method of searchplayer.SearchPlayer. If the pool cannot be started, e.g.
+inside a process that cannot have children, search() raises the Exception
+and the caller can fall back to searching in a single process, as
+searchplayer.ParallelSearchPlayer does.
+
+Usage:
+    parallel_search = ParallelSearch(num_workers=8)
+    record, score = parallel_search.search(state, time_limit=10)
+    parallel_search.close()
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+
+import evaluation
+import searchplayer
+from draughtsrules import DraughtsRules
+
+# the time to wait for a worker after the deadline, in seconds, as workers
+# only check the clock once in a while
+DEADLINE_MARGIN = 1.0
+
+# the state of a worker process, set by init_worker()
+_worker = {}
+
+
+def init_worker(use_bitboards, player_class, player_args):
+    DraughtsRules.use_bitboards = use_bitboards
+
+    _worker['player'] = player_class(0, **player_args)
+    _worker['player'].initialize()
+
+
+def search_move(state, record, depth, alpha, beta, deadline, game_keys):
+    """Search a root move in a worker, see SearchPlayer.search_move()."""
+
+    return _worker['player'].search_move(
+        state,
+        record,
+        depth,
+        alpha,
+        beta,
+        deadline,
+        game_keys
+    )
+
+
+class ParallelSearch:
+    """A pool of worker processes that search root moves in parallel."""
+
+    def __init__(
+            self,
+            num_workers=None,
+            player_class=None,
+            player_args=None
+    ):
+        """Initialize the ParallelSearch object.
+
+        The worker processes are started by the first search.
+
+        :param num_workers: the amount of worker processes (default: the
+            amount of CPUs)
+        :param player_class: the player class that the workers search with
+            (default: searchplayer.SearchPlayer)
+        :param player_args: a dict of extra arguments for the player class
+        """
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        if player_class is None:
+            player_class = searchplayer.SearchPlayer
+        if player_args is None:
+            player_args = {}
+
+        self.num_workers = num_workers
+        self.player_class = player_class
+        self.player_args = player_args
+        self.search_info = {}
+
+        # the weights of the players, to score forced moves
+        self._weights = None
+        if player_args.get('weights') is not None:
+            self._weights = evaluation.load_weights(player_args['weights'])
+
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=init_worker,
+                initargs=(
+                    DraughtsRules.use_bitboards,
+                    self.player_class,
+                    self.player_args
+                )
+            )
+
+        return self._executor
+
+    def search(
+            self,
+            state,
+            time_limit,
+            max_depth=searchplayer.MAX_PLY // 2,
+            game_keys=frozenset(),
+            verbose=False
+    ):
+        """Return a tuple (draughtsrules.MoveRecord, score) of the best move.
+
+        The search deepens until the time limit or max_depth is reached,
+        and the search info of the last completed depth is stored in
+        search_info, like in SearchPlayer.
+
+        :param state: the GameState to search
+        :param time_limit: the time to search, in seconds
+        :param max_depth: the maximal depth to search to
+        :param game_keys: the keys of positions that are a draw when they
+            are reached again
+        :param verbose: print the search info after every depth
+        """
+
+        start_time = time.perf_counter()
+        deadline = time.time() + time_limit
+
+        records = DraughtsRules.get_all_move_records(state)
+        if not records:
+            return None, -searchplayer.WIN_SCORE
+
+        best_index = 0
+        best_score = 0
+        self.search_info = {
+            'depth': 0,
+            'score': 0,
+            'nodes': 0,
+            'seconds': 0.0,
+            'nps': 0.0,
+            'pv': []
+        }
+        if len(records) == 1:
+            self.search_info['pv'] = [searchplayer.move_to_str(records[0])]
+            return records[0], evaluation.evaluate(state, self._weights)
+
+        executor = self._get_executor()
+        nodes = 0
+        for depth in range(1, max_depth + 1):
+            order = [best_index] + [
+                index for index in range(len(records)) if index != best_index
+            ]
+            result = self._search_depth(
+                executor,
+                state,
+                records,
+                order,
+                depth,
+                deadline,
+                game_keys
+            )
+            if result is None:
+                # keep the best move of the last completed depth
+                break
+
+            best_index, best_score, pv, depth_nodes = result
+            nodes += depth_nodes
+
+            seconds = time.perf_counter() - start_time
+            self.search_info = {
+                'depth': depth,
+                'score': best_score,
+                'nodes': nodes,
+                'seconds': seconds,
+                'nps': nodes / seconds if seconds else 0.0,
+                'pv': searchplayer.get_pv_strings(state, pv)
+            }
+            if verbose:
+                print(searchplayer.format_search_info(self.search_info))
+
+            if abs(best_score) > searchplayer.WIN_THRESHOLD \
+                    or time.time() >= deadline:
+                break
+
+        return records[best_index], best_score
+
+    @staticmethod
+    def _search_depth(
+            executor,
+            state,
+            records,
+            order,
+            depth,
+            deadline,
+            game_keys
+    ):
+        """Search all root moves to a depth.
+
+        Returns a tuple (index of the best move, score, principal variation,
+        nodes), or None if the time ran out.
+        """
+
+        win_score = searchplayer.WIN_SCORE
+
+        def submit(index, alpha, beta):
+            return executor.submit(
+                search_move,
+                state,
+                records[index],
+                depth,
+                alpha,
+                beta,
+                deadline,
+                game_keys
+            )
+
+        def wait_for(futures):
+            done, _ = wait(
+                futures,
+                timeout=max(0.0, deadline - time.time()) + DEADLINE_MARGIN,
+                return_when=FIRST_COMPLETED
+            )
+            if not done:
+                return None
+
+            return done
+
+        def cancel(futures):
+            for future in futures:
+                future.cancel()
+
+        first = submit(order[0], -win_score, win_score)
+        if wait_for([first]) is None:
+            first.cancel()
+            return None
+
+        result = first.result()
+        if result is None:
+            return None
+
+        best_index = order[0]
+        alpha, pv, nodes = result
+
+        # the futures, with the move index and the alpha of a null window
+        # search, or None for a full window search
+        pending = {
+            submit(index, alpha, alpha + 1): (index, alpha)
+            for index in order[1:]
+        }
+        while pending:
+            done = wait_for(pending)
+            if done is None:
+                cancel(pending)
+                return None
+
+            for future in done:
+                index, null_window_alpha = pending.pop(future)
+                result = future.result()
+                if result is None:
+                    cancel(pending)
+                    return None
+
+                score, move_pv, move_nodes = result
+                nodes += move_nodes
+                if null_window_alpha is not None:
+                    if score > null_window_alpha:
+                        # the move may be better, so it is searched again
+                        pending[submit(index, alpha, win_score)] = \
+                            (index, None)
+                elif score > alpha:
+                    best_index = index
+                    alpha = score
+                    pv = move_pv
+
+        return best_index, alpha, pv, nodes
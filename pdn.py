@@ -0,0 +1,465 @@
+"""Import and export of games in PDN (Portable Draughts Notation).
+
+A PDN file contains any amount of games, each made of tag pairs such as
+[White "RandomPlayer"] followed by the moves and the result:
+
+    [Event "?"]
+    [White "RandomPlayer"]
+    [Black "AlphaBetaPlayer"]
+    [Result "0-2"]
+    [GameType "20"]
+
+    1. 32-28 19-23 2. 28x19 14x23 3. 37-32 10-14 ... 0-2
+
+Games are exported with the full path of every capture, e.g. '47x36x27x18',
+so that they can be replayed without resolving anything. Files of other
+programs often only give the start and end square of a capture; such moves
+are resolved with DraughtsRules, and the intermediate squares are only
+needed when two captures with the same start and end square take
+different pieces.
+
+read_pdn() reads a file line by line and yields one gamerecord.GameRecord
+at a time, so that collections of any size can be converted without
+loading them whole. Comments, variations and annotations are skipped.
+
+Usage:
+    for game in read_pdn('collection.pdn'):
+        ...
+
+From the command line, games can be converted between PDN files, game
+record files and old pickled games:
+
+    python -m pdn collection.pdn -o games.dgr
+    python -m pdn games.dgr -o games.pdn
+
+Run it with --check to read the games of PDN_CHECKS, which contain moves
+that have to be resolved:
+
+    python -m pdn --check
+"""
+
+import argparse
+import re
+import sys
+
+import board
+import gamerecord
+import openings
+from draughtsrules import DraughtsRules
+from draughtsrules import TIE_REQUEST_TURN
+
+GAME_TYPE = '20'
+
+# the result tags of a win of white, a win of black and a draw
+RESULTS = {0: '2-0', 1: '0-2', -1: '1-1'}
+
+# the results as written by other programs
+_WINNERS = {
+    '2-0': 0,
+    '1-0': 0,
+    '0-2': 1,
+    '0-1': 1,
+    '1-1': -1,
+    '1/2-1/2': -1,
+    '0-0': gamerecord.UNKNOWN_WINNER,
+    '*': gamerecord.UNKNOWN_WINNER
+}
+
+LINE_LENGTH = 79
+
+_TOKEN = re.compile(r'\[[^\]]*\]|[{}();]|[^\s{}();\[]+')
+_TAG = re.compile(r'\[\s*(\w+)\s*"((?:[^"\\]|\\.)*)"\s*\]')
+_MOVE_NUMBER = re.compile(r'(\d+)\.+')
+
+
+def get_move_string(move):
+    """Return a board.CompactHistoryMove in PDN, e.g. '32-28' or '28x19x10'.
+    """
+
+    if move.captured_pieces:
+        return 'x'.join(str(square) for square in (move.square,) + move.path)
+
+    return '{0}-{1}'.format(move.square, move.path[-1])
+
+
+def _format_tag(name, value):
+    return '[{0} "{1}"]'.format(
+        name,
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+    )
+
+
+def export_game(game, event='?'):
+    """Return a gamerecord.GameRecord as a PDN string.
+
+    The moves are numbered from the turn of the start state, which is
+    given as a FEN tag if the game did not start from the initial position.
+
+    :param game: a gamerecord.GameRecord
+    :param event: the value of the Event tag
+    """
+
+    result = RESULTS.get(game.winner, '*')
+    lines = [
+        _format_tag('Event', event),
+        _format_tag('White', game.player1_name or '?'),
+        _format_tag('Black', game.player2_name or '?'),
+        _format_tag('Result', result),
+        _format_tag('GameType', GAME_TYPE)
+    ]
+    if game.start_state is not None:
+        lines.append(_format_tag('FEN', game.start_state.to_fen()))
+    lines.append('')
+
+    start_state = game.get_start_state()
+    turn = start_state.turn
+    tokens = []
+    for index, move in enumerate(
+            move for move in game.movelist if move.path is not None
+    ):
+        # the move number is kept on the same line as the move
+        if not move.player_id:
+            tokens.append('{0}. {1}'.format(turn, get_move_string(move)))
+        elif index == 0:
+            tokens.append('{0}... {1}'.format(turn, get_move_string(move)))
+        else:
+            tokens.append(get_move_string(move))
+
+        if move.player_id:
+            turn += 1
+    tokens.append(result)
+
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = '{0} {1}'.format(line, token) if line else token
+    lines.append(line)
+
+    return '\n'.join(lines) + '\n'
+
+
+def history_to_pdn(history, player_names, winner):
+    """Return the game of a board.History object as a PDN string."""
+
+    return export_game(
+        gamerecord.GameRecord.from_history(history, player_names, winner)
+    )
+
+
+def write_pdn(filename, games, append=False):
+    """Write gamerecord.GameRecord objects to a PDN file, or append them."""
+
+    with open(filename, 'a' if append else 'w', encoding='utf-8') as file:
+        for game in games:
+            if file.tell():
+                file.write('\n')
+            file.write(export_game(game))
+
+
+def _tokenize(lines):
+    """Yield the tokens of PDN text, without the comments."""
+
+    in_comment = False
+    for line in lines:
+        position = 0
+        while True:
+            if in_comment:
+                position = line.find('}', position) + 1
+                if not position:
+                    break
+                in_comment = False
+
+            match = _TOKEN.search(line, position)
+            if match is None:
+                break
+
+            token = match.group()
+            position = match.end()
+            if token == '{':
+                in_comment = True
+            elif token == ';':
+                # a comment until the end of the line
+                break
+            else:
+                yield token
+
+
+def parse_game(tags, moves, first_turn=None):
+    """Return the gamerecord.GameRecord of a game read from PDN.
+
+    A game that was resigned or agreed drawn before it ended by the rules
+    gets a resign move of the loser, or a tie request on the last move and
+    its acceptance, if the rules allow these on the last turn. Otherwise
+    the moves end without them, and only the winner tells the result.
+
+    :param tags: a dict of the tag pairs of the game
+    :param moves: the moves as strings, e.g. '32-28' or '28x19'
+    :param first_turn: the number of the first move, which is the turn of
+        the start state if the game starts from a FEN tag
+    """
+
+    game_type = tags.get('GameType', GAME_TYPE).split(',')[0].strip()
+    if game_type != GAME_TYPE:
+        raise Exception("Unsupported game type {0}".format(game_type))
+
+    if 'FEN' in tags:
+        state = board.GameState.from_fen(tags['FEN'])
+        if first_turn is not None:
+            state.turn = first_turn
+    else:
+        state = board.GameState()
+    history = board.History(state)
+
+    for move_str in moves:
+        record = openings.parse_move(move_str, state)
+        new_state = board.GameState(
+            board=state.board,
+            turn=state.turn,
+            player=state.current_player,
+            tie_request=state.tie_request
+        )
+        new_state.make_move(record.piece, record.move, record.captured)
+        history.add_move(
+            new_state,
+            board.HistoryMove(
+                state.current_player,
+                record.piece,
+                record.move,
+                record.num_captures > 0
+            ),
+            state
+        )
+        state = new_state
+
+    winner = _WINNERS.get(
+        tags.get('Result', '*').strip(),
+        gamerecord.UNKNOWN_WINNER
+    )
+    ended = state.is_opponent_winning() or state.is_draw(history)
+    if not ended and winner == int(not state.current_player):
+        history.movelist.append(board.CompactHistoryMove(
+            int(state.current_player), None, False, None,
+            False, False, False, True
+        ))
+    elif not ended and winner == -1 and moves \
+            and history.gamestates[-2][0].turn >= TIE_REQUEST_TURN:
+        history.movelist[-1] = history.movelist[-1]._replace(
+            request_tie=True
+        )
+        history.movelist.append(board.CompactHistoryMove(
+            int(state.current_player), None, False, None,
+            False, False, True, False
+        ))
+
+    return gamerecord.GameRecord.from_history(
+        history,
+        (tags.get('White'), tags.get('Black')),
+        winner
+    )
+
+
+def _read_games(lines, skip_invalid):
+    tags = {}
+    moves = []
+    first_turn = None
+    variation_depth = 0
+
+    def finish_game():
+        try:
+            return parse_game(tags, moves, first_turn)
+        except Exception:
+            if not skip_invalid:
+                raise
+
+    tokens = _tokenize(lines)
+    for token in tokens:
+        if token == '(':
+            variation_depth += 1
+            continue
+        elif token == ')':
+            variation_depth = max(0, variation_depth - 1)
+            continue
+        elif variation_depth:
+            continue
+
+        if token.startswith('['):
+            if moves:
+                # a game without a result ends at the tags of the next one
+                game = finish_game()
+                if game is not None:
+                    yield game
+                tags, moves, first_turn = {}, [], None
+
+            match = _TAG.match(token)
+            if match:
+                tags[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+            continue
+
+        if token in _WINNERS:
+            if token != '*' or 'Result' not in tags:
+                tags['Result'] = token
+            game = finish_game()
+            if game is not None:
+                yield game
+            tags, moves, first_turn = {}, [], None
+            continue
+
+        match = _MOVE_NUMBER.match(token)
+        if match:
+            if first_turn is None:
+                first_turn = int(match.group(1))
+            token = token[match.end():]
+
+        # annotations such as '!', '?!' and numeric annotation glyphs
+        token = token.rstrip('!?')
+        if token and not token.startswith('$'):
+            moves.append(token)
+
+    if tags or moves:
+        game = finish_game()
+        if game is not None:
+            yield game
+
+
+def read_pdn(source, skip_invalid=False):
+    """Yield the gamerecord.GameRecord objects of the games in a PDN file.
+
+    The file is read line by line, so only the game that is being read is
+    kept in memory.
+
+    :param source: the name of the file, or an iterable of lines
+    :param skip_invalid: skip games with illegal moves or an unsupported
+        game type instead of raising an Exception
+    """
+
+    if isinstance(source, str):
+        with open(
+                source,
+                'r',
+                encoding='utf-8-sig',
+                errors='replace'
+        ) as file:
+            yield from _read_games(file, skip_invalid)
+    else:
+        yield from _read_games(source, skip_invalid)
+
+
+def read_games(filename, skip_invalid=False):
+    """Yield the games of a PDN, game record or old pickled game file."""
+
+    if gamerecord.is_game_record_file(filename):
+        return gamerecord.read_games(filename)
+    elif filename.lower().endswith('.pdn'):
+        return read_pdn(filename, skip_invalid)
+
+    return iter([gamerecord.convert_pickle(filename)])
+
+
+# PDN games that read_pdn() has to read, as tuples (lines, the end squares
+# of the moves)
+PDN_CHECKS = (
+    # a capture in short notation with two paths that capture the same
+    # pieces in another order
+    (
+        (
+            '[FEN "B:W27,28,37,K38,39:B15,16,20,K50"]',
+            '[Result "0-2"]',
+            '',
+            '1... 50x33 0-2'
+        ),
+        (33,)
+    ),
+)
+
+
+def check_pdn():
+    """Return True if all games of PDN_CHECKS are read as expected."""
+
+    success = True
+    for lines, expected in PDN_CHECKS:
+        try:
+            game, = read_pdn(lines)
+            ends = tuple(move.path[-1] for move in game.movelist)
+        except Exception as e:
+            ends = repr(e)
+
+        print("{0}: {1}".format(lines[-1], ends))
+        if ends != expected:
+            print("  FAILED (expected {0})".format(expected))
+            success = False
+
+    return success
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts games between PDN and game record files."
+    )
+
+    parser.add_argument(
+        'inputs',
+        metavar='FILE',
+        nargs='*',
+        help="PDN files, game record files or old pickled games"
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='output',
+        metavar='FILE',
+        help="The file to append the games to, as PDN if its name ends in "
+             ".pdn and as game records otherwise",
+        default=None
+    )
+    parser.add_argument(
+        '--check',
+        dest='check',
+        action='store_true',
+        help="Check that the games of PDN_CHECKS are read, instead of "
+             "converting files",
+        default=False
+    )
+    parser.add_argument(
+        '--skip-invalid',
+        dest='skip_invalid',
+        action='store_true',
+        help="Skip PDN games with illegal moves instead of stopping",
+        default=False
+    )
+    parser.add_argument(
+        '-b',
+        '--bitboards',
+        dest='use_bitboards',
+        action='store_true',
+        help="Use the bitboard move generator",
+        default=False
+    )
+
+    args = parser.parse_args()
+
+    DraughtsRules.use_bitboards = args.use_bitboards
+
+    if args.check:
+        if not check_pdn():
+            sys.exit(1)
+        return
+
+    if not args.inputs or args.output is None:
+        parser.error("input files and --output are required")
+
+    games = (
+        game
+        for filename in args.inputs
+        for game in read_games(filename, args.skip_invalid)
+    )
+    if args.output.lower().endswith('.pdn'):
+        write_pdn(args.output, games, append=True)
+    else:
+        gamerecord.write_games(args.output, games, append=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""Count the leaf nodes of the game tree (perft) to test the move generator.
+
+Perft expands every legal move up to a fixed depth with
+DraughtsRules.get_all_possible_moves() and GameState.get_successor(), which
+measures the speed of the move generator and, by comparing the counts with
+known values, its correctness. Draw rules are ignored, and every capture
+path returned by the move generator is counted as a separate move.
+
+Usage:
+    python -m perft --depth 6
+    python -m perft --depth 6 --in-place --bitboards
+    python -m perft --depth 3 --fen "W:WK4:B1,6,7,8,9,14,16,17,21,27,K46"
+    python -m perft --depth 4 --divide
+    python -m perft --suite --compare
+    python -m perft --benchmark 3000
+
+The benchmark times DraughtsRules.get_all_move_records() with both move
+generators on the positions of random games.
+"""
+
+import argparse
+import random
+import sys
+import time
+from copy import deepcopy
+
+import board
+from draughtsrules import DraughtsRules
+
+INITIAL_FEN = 'W:W31-50:B1-20'
+
+# published perft counts of the initial position, indexed by depth
+INITIAL_COUNTS = (
+    1,
+    9,
+    81,
+    658,
+    4265,
+    27117,
+    167140,
+    1049442,
+    6483961,
+    41022423,
+    258895763,
+    1665861398
+)
+
+# the random games of the benchmark end after this many turns
+MAX_RANDOM_GAME_TURNS = 200
+
+# positions to test, as tuples (name, FEN string, known counts or None)
+POSITIONS = (
+    ('initial', INITIAL_FEN, INITIAL_COUNTS),
+    (
+        'man_capture_5',
+        'B:W16,22,26,27,32,33,36,38,40,42,43,44,45,46,49:B4,6,7,10,13,17,19,'
+        '20,30',
+        None
+    ),
+    (
+        'man_capture_5_white',
+        'W:W30,31,33,34,36,37,38,39,40,41,42,43,44,46,47,50:B1,2,4,5,6,8,9,10,'
+        '11,15,16,18,19,21,22,29',
+        None
+    ),
+    (
+        'king_capture_5',
+        'B:W27,32,34,36,37,38,41,43,44,47,48:B2,7,8,9,10,11,12,13,14,16,17,20,'
+        '21,35,K49',
+        None
+    ),
+    (
+        'king_capture_5_white',
+        'W:WK1,34,36,37,38,39,40,41,42,44,46,47,48,49:B3,4,5,7,8,10,11,13,14,'
+        '15,16,24,27',
+        None
+    ),
+    (
+        'king_capture_4',
+        'W:WK15,30,32,39,41,45,46,47,48,49,50:B2,3,5,8,9,17,18,19,20',
+        None
+    ),
+    (
+        'king_passes_captured_piece',
+        'B:W27,28,37,K38,39:B15,16,20,K50',
+        None
+    )
+)
+
+
+def perft(state, depth):
+    """Return the amount of leaf nodes at a given depth below a state."""
+
+    if depth == 0:
+        return 1
+
+    nodes = 0
+    for piece, moves in DraughtsRules.get_all_possible_moves(state):
+        if depth == 1:
+            nodes += len(moves)
+            continue
+
+        for move in moves:
+            nodes += perft(state.get_successor(piece, move), depth - 1)
+
+    return nodes
+
+
+def perft_in_place(state, depth):
+    """Like perft(), but using GameState.make_move() and unmake_move()."""
+
+    if depth == 0:
+        return 1
+
+    records = DraughtsRules.get_all_move_records(state)
+    if depth == 1:
+        return len(records)
+
+    nodes = 0
+    for record in records:
+        token = state.make_move(record.piece, record.move, record.captured)
+        nodes += perft_in_place(state, depth - 1)
+        state.unmake_move(token)
+
+    return nodes
+
+
+def move_to_str(record):
+    """Return a move in draughts notation, including the full capture path."""
+
+    return ('x' if record.captured else '-').join(
+        str(board.History.convert_pos_to_index(pos))
+        for pos in (record.piece.pos,) + record.move
+    )
+
+
+def divide(state, depth):
+    """Return a list of tuples (move string, leaf nodes) for each root move.
+    """
+
+    return sorted(
+        (
+            move_to_str(record),
+            perft(state.get_successor(record.piece, record.move), depth - 1)
+        )
+        for record in DraughtsRules.get_all_move_records(state)
+    )
+
+
+def timed_perft(state, depth, in_place=False):
+    """Return a tuple (leaf nodes, seconds)."""
+
+    t = time.perf_counter()
+    if in_place:
+        nodes = perft_in_place(state, depth)
+    else:
+        nodes = perft(state, depth)
+
+    return nodes, time.perf_counter() - t
+
+
+def compare_engines(state, depth):
+    """Return True if both move generators give the same counts.
+
+    The root moves are divided, so that differences are printed per move.
+    """
+
+    use_bitboards = DraughtsRules.use_bitboards
+    counts = []
+    for engine in (False, True):
+        DraughtsRules.use_bitboards = engine
+        counts.append(dict(divide(state, depth)))
+    DraughtsRules.use_bitboards = use_bitboards
+
+    for move in sorted(set(counts[0]) | set(counts[1])):
+        if counts[0].get(move) != counts[1].get(move):
+            print("  {0}: {1} (lists) != {2} (bitboards)".format(
+                move,
+                counts[0].get(move),
+                counts[1].get(move)
+            ))
+
+    return counts[0] == counts[1]
+
+
+def get_random_positions(num_positions, seed=0):
+    """Return a list of GameState objects of random games, with all the
+    positions of every game in which a move can be made.
+    """
+
+    rng = random.Random(seed)
+    states = []
+    while len(states) < num_positions:
+        state = board.GameState.from_fen(INITIAL_FEN)
+        while len(states) < num_positions \
+                and state.turn < MAX_RANDOM_GAME_TURNS:
+            records = DraughtsRules.get_all_move_records(state)
+            if not records:
+                break
+
+            states.append(deepcopy(state))
+            record = rng.choice(records)
+            state.make_move(record.piece, record.move, record.captured)
+
+    return states
+
+
+def benchmark_engines(states, repeat=5):
+    """Return a tuple (seconds with lists, seconds with bitboards) of the
+    time per position of DraughtsRules.get_all_move_records(), the best of
+    a number of runs.
+    """
+
+    use_bitboards = DraughtsRules.use_bitboards
+    times = [float('inf'), float('inf')]
+    for _ in range(repeat):
+        for engine in (False, True):
+            DraughtsRules.use_bitboards = engine
+            t = time.perf_counter()
+            for state in states:
+                DraughtsRules.get_all_move_records(state)
+            times[engine] = min(times[engine], time.perf_counter() - t)
+    DraughtsRules.use_bitboards = use_bitboards
+
+    return times[0] / len(states), times[1] / len(states)
+
+
+def run_position(
+        name,
+        fen,
+        depth,
+        known_counts=None,
+        compare=False,
+        in_place=False
+):
+    """Run perft on a position up to a depth, return True if all checks pass.
+    """
+
+    state = board.GameState.from_fen(fen)
+    success = True
+
+    print("{0}: {1}".format(name, fen))
+    for current_depth in range(1, depth + 1):
+        nodes, seconds = timed_perft(state, current_depth, in_place)
+
+        status = ''
+        if known_counts is not None and current_depth < len(known_counts):
+            if nodes == known_counts[current_depth]:
+                status = 'ok'
+            else:
+                status = 'FAILED (expected {0})'.format(
+                    known_counts[current_depth]
+                )
+                success = False
+
+        print("  depth {0}: {1} nodes in {2:.3f} s ({3:.0f} nodes/s) {4}"
+              .format(current_depth, nodes, seconds,
+                      nodes / seconds if seconds else 0, status))
+
+    if compare:
+        if compare_engines(state, depth):
+            print("  move generators agree")
+        else:
+            print("  move generators DISAGREE")
+            success = False
+
+    return success
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Count leaf nodes of the draughts game tree."
+    )
+
+    parser.add_argument(
+        '-d',
+        '--depth',
+        dest='depth',
+        type=int,
+        help="The depth to search to.",
+        default=4
+    )
+    parser.add_argument(
+        '--fen',
+        dest='fen',
+        help="The position to start from (default: initial position)",
+        default=INITIAL_FEN
+    )
+    parser.add_argument(
+        '--divide',
+        dest='divide',
+        action='store_true',
+        help="Print the leaf nodes for each move of the root position",
+        default=False
+    )
+    parser.add_argument(
+        '--suite',
+        dest='suite',
+        action='store_true',
+        help="Run all positions of the test suite",
+        default=False
+    )
+    parser.add_argument(
+        '--compare',
+        dest='compare',
+        action='store_true',
+        help="Check that both move generators give the same counts",
+        default=False
+    )
+    parser.add_argument(
+        '--in-place',
+        dest='in_place',
+        action='store_true',
+        help="Use GameState.make_move() instead of get_successor()",
+        default=False
+    )
+    parser.add_argument(
+        '--benchmark',
+        dest='benchmark',
+        metavar='POSITIONS',
+        type=int,
+        help="Time both move generators on this many positions of random "
+             "games",
+        default=None
+    )
+    parser.add_argument(
+        '-b',
+        '--bitboards',
+        dest='use_bitboards',
+        action='store_true',
+        help="Use the bitboard move generator",
+        default=False
+    )
+
+    args = parser.parse_args()
+    DraughtsRules.use_bitboards = args.use_bitboards
+
+    if args.benchmark is not None:
+        lists, bitboards = benchmark_engines(
+            get_random_positions(args.benchmark)
+        )
+        print("lists: {0:.1f} us, bitboards: {1:.1f} us per position, "
+              "{2:.1f} times faster".format(
+                  lists * 1e6,
+                  bitboards * 1e6,
+                  lists / bitboards
+              ))
+        return
+
+    if args.divide:
+        state = board.GameState.from_fen(args.fen)
+        t = time.perf_counter()
+        counts = divide(state, args.depth)
+        t = time.perf_counter() - t
+
+        for move, nodes in counts:
+            print("{0}: {1}".format(move, nodes))
+
+        nodes = sum(nodes for _, nodes in counts)
+        print("{0} moves, {1} nodes in {2:.3f} s ({3:.0f} nodes/s)".format(
+            len(counts), nodes, t, nodes / t if t else 0
+        ))
+        return
+
+    if args.suite:
+        positions = POSITIONS
+    else:
+        positions = [
+            (name, fen, counts) for name, fen, counts in POSITIONS
+            if fen == args.fen
+        ] or [('position', args.fen, None)]
+
+    success = all([
+        run_position(
+            name,
+            fen,
+            args.depth,
+            counts,
+            args.compare,
+            args.in_place
+        )
+        for name, fen, counts in positions
+    ])
+
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
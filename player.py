@@ -1,3 +1,8 @@
+from collections import namedtuple
+
+import board
+
+
 class Move:
     """An object that holds move information."""
 
@@ -16,6 +21,86 @@ class Move:
         self.accept_tie = accept_tie
 
 
+class CompactMove(namedtuple('CompactMove', (
+        'square',
+        'is_king',
+        'path',
+        'request_tie',
+        'resign',
+        'accept_tie'
+))):
+    """An immutable Move that stores square numbers (1 to 50).
+
+    square is the square number of the piece to move and path a tuple of the
+    square numbers it stops at. It can be returned from Player.get_action()
+    instead of a Move object: the piece and move properties convert the
+    squares back to a board.Piece and positions.
+    """
+
+    __slots__ = ()
+
+    def __new__(
+            cls,
+            square=None,
+            is_king=False,
+            path=None,
+            request_tie=False,
+            resign=False,
+            accept_tie=False
+    ):
+        return super(CompactMove, cls).__new__(
+            cls, square, is_king, path, request_tie, resign, accept_tie
+        )
+
+    @property
+    def piece(self):
+        if self.square is None:
+            return None
+
+        return board.Piece(board.SQUARE_POSITIONS[self.square], self.is_king)
+
+    @property
+    def move(self):
+        if self.path is None:
+            return None
+
+        return tuple(board.SQUARE_POSITIONS[square] for square in self.path)
+
+    @staticmethod
+    def from_move(move):
+        if move.piece is None:
+            square = None
+            is_king = False
+        else:
+            square = board.History.convert_pos_to_index(move.piece.pos)
+            is_king = bool(move.piece.is_king)
+
+        if move.move is None:
+            path = None
+        else:
+            path = tuple(
+                board.History.convert_pos_to_index(pos) for pos in move.move
+            )
+
+        return CompactMove(
+            square,
+            is_king,
+            path,
+            move.request_tie,
+            move.resign,
+            move.accept_tie
+        )
+
+    def to_move(self):
+        return Move(
+            self.piece,
+            self.move,
+            self.request_tie,
+            self.resign,
+            self.accept_tie
+        )
+
+
 class Player:
     """A player object."""
 
@@ -39,6 +124,10 @@ class Player:
 
         This method is called every turn for an action to take.
 
+        Both arguments are read-only views (board.GameStateView and
+        board.HistoryView); use copy.deepcopy() to get a copy that can be
+        changed, e.g. to call GameState.make_move() on.
+
         :param current_state: the current game state (board.GameState)
         :param history: the history of the game so far (board.History)
         """
@@ -51,7 +140,8 @@ class Player:
         This method is called after the game is finished to allow players
         to perform final actions such as learning.
 
-        :param history: the history of the game (board.History)
+        :param history: the history of the game (a read-only
+            board.HistoryView)
         :param winner: the winner of the game. Equal to a playerID (0 or 1)
             or -1 if the game was a draw.
         """
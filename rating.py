@@ -0,0 +1,304 @@
+"""Elo ratings and sequential testing of match results.
+
+Results use the winner values of Game.run(): 0 if white won, 1 if black won
+and -1 for a draw. Elo differences are on the logistic scale, on which a
+difference of 400 points means an expected score of 10 to 1.
+
+elo_difference() estimates the Elo difference between two players with a
+confidence interval. bayeselo() fits ratings to the games of a tournament
+with the model of the BayesElo program: white has an advantage, draws are
+modelled by the drawelo parameter, and a few virtual draws between
+opponents keep the ratings finite when a player wins or loses everything.
+SPRT runs the sequential probability ratio test on the results of a match,
+which can be stopped as soon as the test has decided.
+
+Run the module to check that the SPRT decides matches in which one player
+wins every game:
+
+    python -m rating
+"""
+
+import math
+import sys
+from statistics import NormalDist
+
+ELO_SCALE = math.log(10) / 400
+
+# the largest Elo difference returned for scores of 0 and 1
+MAX_ELO = 1000
+
+# the largest change of a rating in one iteration of bayeselo()
+MAX_STEP = 100
+
+# the virtual wins, draws and losses added to the variance of the SPRT
+PRIOR_GAMES = 1
+
+
+def expected_score(elo):
+    """Return the expected score of a player that is elo points stronger."""
+
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo_from_score(score):
+    """Return the Elo difference that gives an expected score."""
+
+    if score <= 0:
+        return -MAX_ELO
+    elif score >= 1:
+        return MAX_ELO
+
+    return max(-MAX_ELO, min(MAX_ELO, -400 * math.log10(1 / score - 1)))
+
+
+def get_score_stats(wins, draws, losses):
+    """Return a tuple (mean score, variance of the score of a game)."""
+
+    games = wins + draws + losses
+    if not games:
+        return 0.5, 0.0
+
+    score = (wins + 0.5 * draws) / games
+    variance = (
+        wins * (1 - score) ** 2
+        + draws * (0.5 - score) ** 2
+        + losses * score ** 2
+    ) / games
+
+    return score, variance
+
+
+def elo_difference(wins, draws, losses, confidence=0.95):
+    """Return a tuple (Elo difference, lower bound, upper bound).
+
+    The bounds are the confidence interval of the Elo difference, computed
+    from the normal approximation of the mean score.
+
+    :param wins: the amount of games won by the player
+    :param draws: the amount of drawn games
+    :param losses: the amount of games lost by the player
+    :param confidence: the probability that the interval contains the true
+        difference
+    """
+
+    games = wins + draws + losses
+    score, variance = get_score_stats(wins, draws, losses)
+    margin = 0.0
+    if games:
+        margin = NormalDist().inv_cdf((1 + confidence) / 2) \
+            * math.sqrt(variance / games)
+
+    return (
+        elo_from_score(score),
+        elo_from_score(score - margin),
+        elo_from_score(score + margin)
+    )
+
+
+def _get_outcome_probabilities(elo, advantage, drawelo):
+    """Return the probabilities (white wins, black wins, draw).
+
+    :param elo: the rating of white minus the rating of black
+    """
+
+    white_wins = expected_score(elo + advantage - drawelo)
+    black_wins = expected_score(-elo - advantage - drawelo)
+
+    return white_wins, black_wins, 1 - white_wins - black_wins
+
+
+def bayeselo(
+        games,
+        num_players,
+        advantage=32.8,
+        drawelo=97.3,
+        prior=2,
+        max_iterations=1000
+):
+    """Fit ratings to the results of games.
+
+    Returns a list of tuples (rating, standard error), one for each player.
+    The ratings average to 0. The errors are those of a single rating when
+    all other ratings are known, which slightly underestimates the error
+    of the difference between two players.
+
+    :param games: an iterable of tuples (white player, black player, winner)
+        in which the players are indices and winner is 0, 1 or -1
+    :param num_players: the amount of players
+    :param advantage: the Elo advantage of playing white
+    :param drawelo: the Elo parameter that sets the amount of draws
+    :param prior: the amount of virtual draws between each pair of players
+        that played each other
+    :param max_iterations: the maximum amount of updates of all ratings
+    """
+
+    # count the outcomes per pairing, as (white wins, black wins, draws)
+    pairings = {}
+    for white, black, winner in games:
+        counts = pairings.setdefault((white, black), [0, 0, 0])
+        counts[winner if winner >= 0 else 2] += 1
+
+    for white, black in list(pairings):
+        pairings[(white, black)][2] += prior / 2
+
+    ratings = [0.0] * num_players
+    information = [0.0] * num_players
+    for _ in range(max_iterations):
+        gradient = [0.0] * num_players
+        information = [0.0] * num_players
+        for (white, black), counts in pairings.items():
+            probabilities = _get_outcome_probabilities(
+                ratings[white] - ratings[black], advantage, drawelo
+            )
+
+            # the derivatives of the probabilities to the rating difference
+            white_slope = ELO_SCALE * probabilities[0] \
+                * (1 - probabilities[0])
+            black_slope = -ELO_SCALE * probabilities[1] \
+                * (1 - probabilities[1])
+            slopes = (white_slope, black_slope, -white_slope - black_slope)
+
+            games_played = sum(counts)
+            score = sum(
+                count * slope / probability
+                for count, slope, probability
+                in zip(counts, slopes, probabilities)
+            )
+            fisher = games_played * sum(
+                slope ** 2 / probability
+                for slope, probability in zip(slopes, probabilities)
+            )
+
+            gradient[white] += score
+            gradient[black] -= score
+            information[white] += fisher
+            information[black] += fisher
+
+        # the steps are limited, as the first steps can overshoot far when
+        # a player won or lost almost every game
+        steps = [
+            max(-MAX_STEP, min(MAX_STEP, gradient[index] / information[index]))
+            if information[index] else 0
+            for index in range(num_players)
+        ]
+        mean_step = sum(steps) / num_players if num_players else 0
+        ratings = [
+            rating + step - mean_step for rating, step in zip(ratings, steps)
+        ]
+
+        if max(abs(step) for step in steps) < 0.01:
+            break
+
+    return [
+        (
+            rating,
+            1 / math.sqrt(fisher) if fisher else float('inf')
+        )
+        for rating, fisher in zip(ratings, information)
+    ]
+
+
+class SPRT:
+    """A sequential probability ratio test on the results of a match.
+
+    The test decides between the hypotheses that the Elo difference of the
+    player is elo0 (H0) or elo1 (H1). Results are added one by one, and
+    status() tells when the test has decided. The log-likelihood ratio uses
+    the normal approximation of the mean score of the games, which also
+    handles draws. The variance of the score includes PRIOR_GAMES virtual
+    wins, draws and losses, so a match that is won, drawn or lost
+    completely is decided as well.
+    """
+
+    def __init__(self, elo0=0, elo1=10, alpha=0.05, beta=0.05):
+        """Initialize the SPRT object.
+
+        :param elo0: the Elo difference of the null hypothesis
+        :param elo1: the Elo difference of the alternative hypothesis
+        :param alpha: the probability of accepting H1 if H0 is true
+        :param beta: the probability of accepting H0 if H1 is true
+        """
+
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def add_result(self, score):
+        """Add the result of a game: 1 for a win, 0.5 for a draw, 0 for a
+        loss of the player.
+        """
+
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def get_llr(self):
+        """Return the log-likelihood ratio of H1 against H0."""
+
+        games = self.wins + self.draws + self.losses
+        if not games:
+            return 0.0
+
+        score, _ = get_score_stats(self.wins, self.draws, self.losses)
+
+        # a virtual win, draw and loss keep the variance above 0 when all
+        # games have the same result, so that such a match still decides
+        _, variance = get_score_stats(
+            self.wins + PRIOR_GAMES,
+            self.draws + PRIOR_GAMES,
+            self.losses + PRIOR_GAMES
+        )
+
+        score0 = expected_score(self.elo0)
+        score1 = expected_score(self.elo1)
+
+        return (score1 - score0) * (2 * score - score0 - score1) \
+            * games / (2 * variance)
+
+    def status(self):
+        """Return 'H1' or 'H0' if the test accepted a hypothesis, or None."""
+
+        llr = self.get_llr()
+        if llr >= self.upper_bound:
+            return 'H1'
+        elif llr <= self.lower_bound:
+            return 'H0'
+
+        return None
+
+
+def check_sprt():
+    """Return True if the SPRT decides matches with one-sided results."""
+
+    success = True
+    for score, games, expected in ((1, 200, 'H1'), (0, 200, 'H0')):
+        sprt = SPRT()
+        for _ in range(games):
+            sprt.add_result(score)
+
+        status = sprt.status()
+        print("{0} games with score {1}: {2}".format(games, score, status))
+        if status != expected:
+            print("  FAILED (expected {0})".format(expected))
+            success = False
+
+    return success
+
+
+def main():
+    """Run the checks of the module."""
+
+    if not check_sprt():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
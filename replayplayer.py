@@ -2,16 +2,42 @@ import player
 
 
 class ReplayPlayer(player.Player):
-    def __init__(self, player_id, movelist, name=None):
+    def __init__(self, player_id, movelist=None, name=None, database=None,
+                 game=0):
+        """Initialize the ReplayPlayer object.
+
+        :param movelist: the board.CompactHistoryMove objects of this player
+        :param database: the file of a gamedatabase.GameDatabase to load the
+            moves of this player from, if no movelist is given
+        :param game: the number of the game in the database
+        """
+
+        if movelist is None:
+            # imported here, as gamedatabase depends on NumPy
+            import gamedatabase
+
+            with gamedatabase.GameDatabase(database) as games:
+                record = games[game]
+
+            movelist = [
+                move for move in record.movelist
+                if move.player_id == player_id
+            ]
+
+            if name is None:
+                name = (record.player1_name, record.player2_name)[player_id]
+
         if name is None:
             name = "Replay"
 
         self.movelist = movelist
+        self.move_index = 0
 
         super(ReplayPlayer, self).__init__(player_id, name)
 
     def get_action(self, current_state, history):
-        currentmove = self.movelist.pop(0)
+        currentmove = self.movelist[self.move_index]
+        self.move_index += 1
 
         if currentmove.resigned:
             return player.Move(resign=True)
@@ -0,0 +1,720 @@
+"""A player that searches the game tree with alpha-beta.
+
+SearchPlayer runs a negamax alpha-beta search with iterative deepening
+until its time per move runs out. Moves are ordered by the best move of the
+previous iteration, killer moves and the history heuristic, positions that
+were searched before are looked up in a transposition table, and at the
+leaves a quiescence search plays out all captures, as these are forced.
+Positions are evaluated with an evaluation.Evaluator, which is updated with
+every move instead of scanning the board; the weights option loads its
+feature weights from a file.
+
+The options can be given with -p1 and -p2, e.g.
+
+    python -m headless -p SearchPlayer RandomPlayer -p1 time_limit=0.5
+
+After every move, the depth, score, nodes per second and principal
+variation of the search are stored in search_info, and printed with the
+verbose option. Run the module to search a single position, which doubles
+as a benchmark of the move generator:
+
+    python -m searchplayer --fen "W:W31-50:B1-20" --time 5 --bitboards
+
+ParallelSearchPlayer searches the root moves in worker processes with
+parallelsearch.ParallelSearch, set by its num_workers option or by --workers
+when the module is run.
+
+With the book option, the moves of an opening book are played without
+searching, as long as the position is in the book (see openingbook).
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from copy import deepcopy
+
+import board
+import player
+from evaluation import Evaluator
+from evaluation import load_weights
+from draughtsrules import DraughtsRules
+from draughtsrules import TIE_REQUEST_TURN
+from perft import move_to_str
+from transposition import EXACT
+from transposition import LOWER_BOUND
+from transposition import UPPER_BOUND
+from transposition import TranspositionTable
+from transposition import get_move_code
+
+WIN_SCORE = 100000
+
+# scores above this are wins in a known amount of moves
+WIN_THRESHOLD = WIN_SCORE - 1000
+
+MAX_PLY = 128
+
+# the score of a win found in the endgame tables, minus its distance
+TABLEBASE_WIN_SCORE = WIN_THRESHOLD - MAX_PLY - 256
+
+# how often the clock is checked, in nodes
+CHECK_INTERVAL = 1024
+
+
+def get_move_key(record):
+    return record.piece.pos, tuple(record.move)
+
+
+def get_pv_strings(state, pv):
+    """Return a principal variation of move keys in draughts notation.
+
+    :param state: the GameState the variation starts from, which is
+        restored afterwards
+    :param pv: a list of move keys, see get_move_key()
+    """
+
+    strings = []
+    tokens = []
+    for move_key in pv:
+        for record in DraughtsRules.get_all_move_records(state):
+            if get_move_key(record) == move_key:
+                break
+        else:
+            break
+
+        strings.append(move_to_str(record))
+        tokens.append(state.make_move(
+            record.piece,
+            record.move,
+            record.captured
+        ))
+
+    for token in reversed(tokens):
+        state.unmake_move(token)
+
+    return strings
+
+
+def format_search_info(search_info):
+    """Return the search_info of a SearchPlayer as a line of text."""
+
+    return "depth {0} score {1} nodes {2} time {3:.2f} s ({4:.0f} " \
+           "nodes/s) pv {5}".format(
+               search_info['depth'],
+               search_info['score'],
+               search_info['nodes'],
+               search_info['seconds'],
+               search_info['nps'],
+               ' '.join(search_info['pv'])
+           )
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchPlayer(player.Player):
+    def __init__(
+            self,
+            player_id,
+            name=None,
+            time_limit=1.0,
+            max_depth=MAX_PLY // 2,
+            tt_size=1 << 18,
+            verbose=False,
+            tablebase=None,
+            book=None,
+            tt_name=None,
+            weights=None
+    ):
+        """Initialize the SearchPlayer object.
+
+        :param time_limit: the time to search per move, in seconds
+        :param max_depth: the maximal depth to search to
+        :param tt_size: the maximal amount of positions in the
+            transposition table, which takes 16 bytes per position
+        :param verbose: print the search info after every iteration
+        :param tablebase: the directory of endgame tables to probe, see
+            the tablebase module
+        :param book: the opening book file to play the first moves from,
+            see the openingbook module
+        :param tt_name: the name of a shared transposition table to use,
+            see the transposition module
+        :param weights: a JSON file with the weights of the evaluation
+            features, see the evaluation module
+        """
+
+        if name is None:
+            name = "Search"
+
+        super(SearchPlayer, self).__init__(player_id, name)
+
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.tt_size = tt_size
+        self.verbose = verbose
+        self.tablebase = tablebase
+        self.book = book
+        self.tt_name = tt_name
+        self.weights = weights
+
+        self.transpositions = TranspositionTable(tt_size, name=tt_name)
+        self.search_info = {}
+
+        self._evaluator = Evaluator(
+            load_weights(weights) if weights is not None else None
+        )
+        self._deadline = None
+        self._nodes = 0
+        self._killers = [[None, None] for _ in range(MAX_PLY)]
+        self._history = {}
+        self._pv = [[] for _ in range(MAX_PLY + 1)]
+        self._path_keys = []
+        self._game_keys = frozenset()
+        self._tablebase = None
+        self._book = None
+
+    def initialize(self):
+        if self.tt_name is None:
+            # a shared table is cleared by the process that created it
+            self.transpositions.clear()
+        self._history.clear()
+
+        if self.tablebase is not None and self._tablebase is None:
+            # imported here, as tablebase depends on NumPy
+            import tablebase
+            self._tablebase = tablebase.Tablebase(self.tablebase)
+
+        if self.book is not None and self._book is None:
+            # imported here, as openingbook depends on NumPy
+            import openingbook
+            self._book = openingbook.OpeningBook(self.book)
+
+    def get_action(self, current_state, history):
+        state = deepcopy(current_state)
+
+        if self._book is not None:
+            record = self._book.get_move(state)
+            if record is not None:
+                self.search_info = {
+                    'depth': 0,
+                    'score': 0,
+                    'nodes': 0,
+                    'seconds': 0.0,
+                    'nps': 0.0,
+                    'pv': [move_to_str(record)]
+                }
+                return player.Move(piece=record.piece, move=record.move)
+
+        # positions that occurred twice in the game are a draw when they
+        # are reached again
+        game_keys = frozenset(
+            key for key, count in history.position_counts.items()
+            if count >= 2
+        )
+
+        record, score = self.search(state, game_keys)
+
+        if state.turn >= TIE_REQUEST_TURN \
+                and state.tie_request == (not state.current_player) \
+                and score < 0:
+            return player.Move(accept_tie=True)
+
+        return player.Move(piece=record.piece, move=record.move)
+
+    def search(self, state, game_keys=frozenset()):
+        """Return a tuple (draughtsrules.MoveRecord, score) of the best move.
+
+        The search deepens until the time limit or max_depth is reached.
+        The state is changed during the search, but restored afterwards.
+
+        :param state: the GameState to search
+        :param game_keys: the keys of positions that are a draw when they
+            are reached again
+        """
+
+        start_time = time.perf_counter()
+        self._deadline = start_time + self.time_limit
+        self._nodes = 0
+        self._game_keys = game_keys
+        for killers in self._killers:
+            killers[0] = killers[1] = None
+        self._path_keys = [state.key]
+        self.transpositions.new_search()
+        self._evaluator.reset(state.board)
+
+        records = DraughtsRules.get_all_move_records(state)
+        if not records:
+            return None, -WIN_SCORE
+
+        best_record = records[0]
+        best_score = 0
+        self.search_info = {
+            'depth': 0,
+            'score': 0,
+            'nodes': 0,
+            'seconds': 0.0,
+            'nps': 0.0,
+            'pv': []
+        }
+        if len(records) == 1:
+            # a forced move is played without searching
+            self.search_info['pv'] = [move_to_str(best_record)]
+            return best_record, self._evaluator.evaluate(state)
+
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score = self._negamax(state, depth, -WIN_SCORE, WIN_SCORE, 0)
+            except SearchTimeout:
+                # keep the best move of the last completed iteration
+                break
+
+            best_move_key = self._pv[0][0] if self._pv[0] else None
+            for record in records:
+                if get_move_key(record) == best_move_key:
+                    best_record = record
+            best_score = score
+
+            seconds = time.perf_counter() - start_time
+            self.search_info = {
+                'depth': depth,
+                'score': score,
+                'nodes': self._nodes,
+                'seconds': seconds,
+                'nps': self._nodes / seconds if seconds else 0.0,
+                'pv': get_pv_strings(state, self._pv[0])
+            }
+            if self.verbose:
+                print(format_search_info(self.search_info))
+
+            if abs(score) > WIN_THRESHOLD:
+                break
+
+        return best_record, best_score
+
+    def search_move(
+            self,
+            state,
+            record,
+            depth,
+            alpha,
+            beta,
+            deadline,
+            game_keys=frozenset()
+    ):
+        """Search a single move of the root position, e.g. in a worker of
+        parallelsearch.ParallelSearch.
+
+        Returns a tuple (score, principal variation as move keys, nodes),
+        with the score of the root position, or None if the time ran out.
+
+        :param state: the root GameState, which is restored afterwards
+        :param record: the draughtsrules.MoveRecord of the move to search
+        :param depth: the depth to search to, including the move
+        :param alpha: the lower bound of the window of the root position
+        :param beta: the upper bound of the window of the root position
+        :param deadline: the time.time() at which the search stops, which
+            is the same in all processes
+        :param game_keys: the keys of positions that are a draw when they
+            are reached again
+        """
+
+        self._deadline = time.perf_counter() + deadline - time.time()
+        self._nodes = 0
+        self._game_keys = game_keys
+        self._path_keys = [state.key]
+        self._evaluator.reset(state.board)
+
+        token = self._evaluator.make_move(
+            state,
+            record.piece,
+            record.move,
+            record.captured
+        )
+        self._path_keys.append(state.key)
+        try:
+            score = -self._negamax(state, depth - 1, -beta, -alpha, 1)
+        except SearchTimeout:
+            return None
+        finally:
+            self._evaluator.unmake_move(state, token)
+
+        return score, [get_move_key(record)] + self._pv[1], self._nodes
+
+    def _check_time(self):
+        self._nodes += 1
+        if self._nodes % CHECK_INTERVAL == 0 \
+                and time.perf_counter() > self._deadline:
+            raise SearchTimeout()
+
+    def _order_moves(self, records, tt_move_code, ply):
+        killers = self._killers[ply]
+
+        tt_record = None
+        if tt_move_code is not None:
+            for record in records:
+                if get_move_code(record) == tt_move_code:
+                    tt_record = record
+                    break
+
+        def get_order(record):
+            if record is tt_record:
+                return -3 * WIN_SCORE
+
+            move_key = get_move_key(record)
+            if move_key == killers[0]:
+                return -2 * WIN_SCORE
+            elif move_key == killers[1]:
+                return -2 * WIN_SCORE + 1
+
+            return -self._history.get(move_key, 0)
+
+        records.sort(key=get_order)
+
+    def _store(self, key, depth, score, flag, record, ply):
+        # wins are stored relative to this position instead of the root
+        if score > WIN_THRESHOLD:
+            score += ply
+        elif score < -WIN_THRESHOLD:
+            score -= ply
+
+        self.transpositions.store(
+            key,
+            depth,
+            flag,
+            score,
+            get_move_code(record) if record is not None else None
+        )
+
+    def _negamax(self, state, depth, alpha, beta, ply):
+        self._check_time()
+        self._pv[ply] = []
+
+        key = state.key
+        if ply and (key in self._game_keys or key in self._path_keys[:-1]):
+            return 0
+
+        if ply and self._tablebase is not None:
+            score = self._probe_tablebase(state, ply)
+            if score is not None:
+                return score
+
+        records = DraughtsRules.get_all_move_records(state)
+        if not records:
+            return -WIN_SCORE + ply
+
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self._quiescence(state, alpha, beta, ply, records)
+
+        original_alpha = alpha
+        tt_move_code = None
+        entry = self.transpositions.probe(key)
+        if entry is not None:
+            entry_depth, flag, score, tt_move_code = entry
+            if score > WIN_THRESHOLD:
+                score -= ply
+            elif score < -WIN_THRESHOLD:
+                score += ply
+
+            if ply and entry_depth >= depth and (
+                    flag == EXACT
+                    or flag == LOWER_BOUND and score >= beta
+                    or flag == UPPER_BOUND and score <= alpha
+            ):
+                return score
+
+        self._order_moves(records, tt_move_code, ply)
+
+        best_score = -WIN_SCORE
+        best_record = None
+        best_move_key = None
+        for record in records:
+            token = self._evaluator.make_move(
+                state,
+                record.piece,
+                record.move,
+                record.captured
+            )
+            self._path_keys.append(state.key)
+            try:
+                score = -self._negamax(
+                    state, depth - 1, -beta, -alpha, ply + 1
+                )
+            finally:
+                self._path_keys.pop()
+                self._evaluator.unmake_move(state, token)
+
+            if score > best_score:
+                best_score = score
+                best_record = record
+                best_move_key = get_move_key(record)
+
+            if score > alpha:
+                alpha = score
+                self._pv[ply] = [best_move_key] + self._pv[ply + 1]
+
+            if alpha >= beta:
+                if not record.captured:
+                    killers = self._killers[ply]
+                    if killers[0] != best_move_key:
+                        killers[1] = killers[0]
+                        killers[0] = best_move_key
+                    self._history[best_move_key] = \
+                        self._history.get(best_move_key, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self._store(key, depth, best_score, flag, best_record, ply)
+
+        return best_score
+
+    def _probe_tablebase(self, state, ply):
+        """Return the score of a position in the tablebase, or None."""
+
+        if state.board.count_pieces(0) + state.board.count_pieces(1) \
+                > self._tablebase.max_pieces:
+            return None
+
+        result = self._tablebase.probe(state.board, state.current_player)
+        if result is None:
+            return None
+
+        result, distance = result
+        if result == self._tablebase.DRAW:
+            return 0
+
+        # wins in the table score below wins found by the search, and the
+        # shortest wins score highest
+        score = TABLEBASE_WIN_SCORE - ply - (distance or 0)
+
+        return score if result == self._tablebase.WIN else -score
+
+    def _quiescence(self, state, alpha, beta, ply, records):
+        """Search the captures of a position until it is quiet.
+
+        Captures are forced, so a position with captures is not evaluated.
+        """
+
+        if not records[0].captured or ply >= MAX_PLY - 1:
+            return self._evaluator.evaluate(state)
+
+        best_score = -WIN_SCORE
+        for record in records:
+            token = self._evaluator.make_move(
+                state,
+                record.piece,
+                record.move,
+                record.captured
+            )
+            try:
+                self._check_time()
+                self._pv[ply + 1] = []
+                next_records = DraughtsRules.get_all_move_records(state)
+                if next_records:
+                    score = -self._quiescence(
+                        state, -beta, -alpha, ply + 1, next_records
+                    )
+                else:
+                    score = WIN_SCORE - ply - 1
+            finally:
+                self._evaluator.unmake_move(state, token)
+
+            if score > best_score:
+                best_score = score
+            if score > alpha:
+                alpha = score
+                self._pv[ply] = [get_move_key(record)] + self._pv[ply + 1]
+            if alpha >= beta:
+                break
+
+        return best_score
+
+
+class ParallelSearchPlayer(SearchPlayer):
+    """A SearchPlayer that searches the root moves in worker processes.
+
+    With num_workers=1, or if the worker processes cannot be started, it
+    searches like a SearchPlayer in its own process. The workers share a
+    transposition table in shared memory, which is created by the first
+    parallel search and removed by close(), which end_game() calls.
+    """
+
+    def __init__(
+            self,
+            player_id,
+            name=None,
+            num_workers=None,
+            **kwargs
+    ):
+        """Initialize the ParallelSearchPlayer object.
+
+        :param num_workers: the amount of worker processes (default: the
+            amount of CPUs)
+        :param kwargs: the options of SearchPlayer
+        """
+
+        if name is None:
+            name = "ParallelSearch"
+
+        super(ParallelSearchPlayer, self).__init__(player_id, name, **kwargs)
+
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self._parallel_search = None
+
+    def search(self, state, game_keys=frozenset()):
+        if self.num_workers > 1:
+            try:
+                return self._search_parallel(state, game_keys)
+            except (OSError, AssertionError, BrokenProcessPool) as e:
+                print("Searching in a single process: {0!r}".format(e))
+                self.close()
+                self.num_workers = 1
+
+        return super(ParallelSearchPlayer, self).search(state, game_keys)
+
+    def _search_parallel(self, state, game_keys):
+        if self._parallel_search is None:
+            # imported here, as parallelsearch depends on this module
+            from parallelsearch import ParallelSearch
+
+            self.transpositions.close()
+            self.transpositions = TranspositionTable(self.tt_size, shared=True)
+            self._parallel_search = ParallelSearch(
+                self.num_workers,
+                SearchPlayer,
+                {
+                    'tt_size': self.tt_size,
+                    'tt_name': self.transpositions.name,
+                    'tablebase': self.tablebase,
+                    'weights': self.weights
+                }
+            )
+
+        # the workers store entries of the generation of the shared table
+        self.transpositions.new_search()
+        result = self._parallel_search.search(
+            state,
+            self.time_limit,
+            self.max_depth,
+            game_keys,
+            self.verbose
+        )
+        self.search_info = self._parallel_search.search_info
+
+        return result
+
+    def end_game(self, history, winner):
+        # the workers and the shared table are started again by the first
+        # search of the next game
+        self.close()
+
+    def close(self):
+        """Stop the worker processes and remove the shared transposition
+        table.
+        """
+
+        if self._parallel_search is not None:
+            self._parallel_search.close()
+            self._parallel_search = None
+
+            self.transpositions.close()
+            self.transpositions = TranspositionTable(self.tt_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Searches a position with the SearchPlayer."
+    )
+
+    parser.add_argument(
+        '--fen',
+        dest='fen',
+        help="The position to search (default: initial position)",
+        default='W:W31-50:B1-20'
+    )
+    parser.add_argument(
+        '-t',
+        '--time',
+        dest='time_limit',
+        type=float,
+        help="The time to search, in seconds",
+        default=5.0
+    )
+    parser.add_argument(
+        '-d',
+        '--depth',
+        dest='max_depth',
+        type=int,
+        help="The maximal depth to search to",
+        default=MAX_PLY // 2
+    )
+    parser.add_argument(
+        '--tt-size',
+        dest='tt_size',
+        type=int,
+        help="The amount of positions in the transposition table, of 16 "
+             "bytes each",
+        default=1 << 18
+    )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        dest='num_workers',
+        type=int,
+        help="Search the root moves in this many worker processes",
+        default=1
+    )
+    parser.add_argument(
+        '-b',
+        '--bitboards',
+        dest='use_bitboards',
+        action='store_true',
+        help="Use the bitboard move generator",
+        default=False
+    )
+
+    args = parser.parse_args()
+
+    DraughtsRules.use_bitboards = args.use_bitboards
+
+    state = board.GameState.from_fen(args.fen)
+    search_player = ParallelSearchPlayer(
+        state.current_player,
+        num_workers=args.num_workers,
+        time_limit=args.time_limit,
+        max_depth=args.max_depth,
+        tt_size=args.tt_size,
+        verbose=True
+    )
+    record, _ = search_player.search(state)
+
+    stats = search_player.transpositions.get_stats()
+    if search_player.num_workers > 1:
+        # the workers probe the shared table, so only its fill is known here
+        print("transposition table: {0} entries ({1:.1f} MB), {2:.1%} "
+              "filled".format(
+                  stats['size'],
+                  stats['bytes'] / (1 << 20),
+                  stats['fill']
+              ))
+    else:
+        print("transposition table: {0} entries ({1:.1f} MB), {2:.1%} "
+              "filled, {3:.1%} hits, {4} collisions".format(
+                  stats['size'],
+                  stats['bytes'] / (1 << 20),
+                  stats['fill'],
+                  stats['hit_rate'],
+                  stats['collisions']
+              ))
+    search_player.close()
+    if record is not None:
+        print("best move {0}".format(move_to_str(record)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+"""Generate training samples from games between players.
+
+Games are played in worker processes, which turn every game into samples of
+(position, move, outcome) from the game states of its History, and return
+them as compact NumPy arrays. The samples are written to a directory in
+shards of SAMPLE_DTYPE arrays, compressed with numpy.savez_compressed(), so
+that the main process only keeps the samples of the shard that is being
+filled. Positions that were sampled before, by their Zobrist key, are left
+out, unless --keep-duplicates is given.
+
+Shards only hold whole games, and next to every shard an index file lists
+the games that were completed in it and the keys of its samples. Running
+the same command again with the same directory resumes it from the index
+files: the games of the shards are not played again, and the games of
+which the samples were not written yet are. The games are numbered, and
+the random module of the worker is seeded with the seed and number of each
+game, so that games between random players are the same when they are
+played again. Use a higher amount of games to add games to a directory.
+
+A sample has the bitboards of the position (see BoardGrid.get_bitboards()),
+the player to move, the move that was played, by its start and end square
+and a hash of its path (see openingbook.get_path_key()), and the result of
+the game for the player to move: 1 for a win, 0 for a draw and -1 for a
+loss. load_samples() reads the samples of a directory, e.g. to fit the
+weights of the evaluation module with evaluation.get_feature_matrix().
+
+Usage:
+    python -m selfplay samples -p SearchPlayer SearchPlayer \
+        -p1 time_limit=0.1 -p2 time_limit=0.1 -n 10000 -j 4
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+
+import numpy as np
+
+import headless
+import openings
+import tournament
+from draughtsrules import DraughtsRules
+from openingbook import get_path_key
+
+SAMPLE_DTYPE = np.dtype([
+    ('key', '<u8'),
+    ('occupied', '<u8'),
+    ('kings', '<u8'),
+    ('player1', '<u8'),
+    ('player', 'u1'),
+    ('result', 'i1'),
+    ('square', 'u1'),
+    ('end', 'u1'),
+    ('path_key', '<u2'),
+    ('ply', '<u2'),
+    ('game', '<u4')
+])
+
+SETTINGS_FILENAME = 'selfplay.json'
+SHARD_PATTERN = 'shard-{0:05d}.npz'
+SHARD_GLOB = 'shard-*.npz'
+INDEX_PATTERN = 'index-{0:05d}.npz'
+
+# the state of a worker process, set by init_worker()
+_worker = {}
+
+
+def init_worker(use_bitboards, players, opening_list, seed):
+    DraughtsRules.use_bitboards = use_bitboards
+
+    _worker['players'] = players
+    _worker['openings'] = opening_list
+    _worker['seed'] = seed
+
+
+def get_samples(history, winner, game_index):
+    """Return the samples of a played game as an array of SAMPLE_DTYPE.
+
+    :param history: the board.History of the game
+    :param winner: the winner of the game, or -1 for a draw
+    :param game_index: the number of the game
+    """
+
+    samples = []
+    for ply, ((state, _), move) in enumerate(
+            zip(history.gamestates, history.movelist)
+    ):
+        if move.path is None:
+            # resigning and accepting a tie
+            continue
+
+        if winner == -1:
+            result = 0
+        else:
+            result = 1 if winner == state.current_player else -1
+
+        samples.append(
+            (state.key,)
+            + state.board.get_bitboards()
+            + (
+                state.current_player,
+                result,
+                move.square,
+                move.path[-1],
+                get_path_key(move.path),
+                ply,
+                game_index
+            )
+        )
+
+    return np.array(samples, dtype=SAMPLE_DTYPE)
+
+
+def play_games(game_indices):
+    """Play a chunk of games in a worker process.
+
+    Returns a tuple (samples, games, errors), in which samples is an array
+    of the samples of all games, games a list of the indices of the games
+    that were played and errors a list of tuples (game index, error
+    message).
+    """
+
+    samples = []
+    games = []
+    errors = []
+    for game_index in game_indices:
+        random.seed('{0}-{1}'.format(_worker['seed'], game_index))
+
+        opening = None
+        if _worker['openings']:
+            opening = _worker['openings'][
+                game_index % len(_worker['openings'])
+            ]
+
+        try:
+            history, winner = headless.HeadlessGame(
+                _worker['players'],
+                start_state=openings.get_start_state(opening)
+            ).run()
+        except Exception as e:
+            errors.append((game_index, repr(e)))
+            continue
+
+        samples.append(get_samples(history, winner, game_index))
+        games.append(game_index)
+
+    if samples:
+        samples = np.concatenate(samples)
+    else:
+        samples = np.zeros(0, dtype=SAMPLE_DTYPE)
+
+    return samples, games, errors
+
+
+def get_shard_filenames(directory):
+    return sorted(glob.glob(os.path.join(directory, SHARD_GLOB)))
+
+
+def read_shard(filename):
+    with np.load(filename) as data:
+        return data['samples']
+
+
+def load_samples(directory):
+    """Return the samples of all shards in a directory as one array."""
+
+    shards = [read_shard(filename)
+              for filename in get_shard_filenames(directory)]
+    if not shards:
+        return np.zeros(0, dtype=SAMPLE_DTYPE)
+
+    return np.concatenate(shards)
+
+
+def _contains(sorted_values, values):
+    """Return a bool array of which values are in a sorted array."""
+
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+
+    indices = np.searchsorted(sorted_values, values)
+    indices[indices == len(sorted_values)] = 0
+
+    return sorted_values[indices] == values
+
+
+def _write_atomic(filename, write):
+    """Write a file with write(file), so that it only gets its name when it
+    has been written completely.
+    """
+
+    with open(filename + '.tmp', 'wb') as file:
+        write(file)
+    os.replace(filename + '.tmp', filename)
+
+
+class ShardWriter:
+    """Writes samples to numbered shards in a directory.
+
+    Every shard holds the samples of whole games, and has an index file
+    with the games that were completed in it, which may have had no new
+    samples, and the sorted keys of its samples. The index files are read
+    when the writer is created, to find the games that were played and the
+    positions that were sampled, without reading the shards. The keys of
+    the shards are kept in a sorted NumPy array, and those of the samples
+    that are not written yet in a set.
+    """
+
+    def __init__(self, directory, shard_size, deduplicate=True):
+        """Initialize the ShardWriter object.
+
+        :param directory: the directory of the shards, which is created if
+            needed
+        :param shard_size: the amount of samples after which a shard is
+            written, which can be exceeded by the samples of the last game
+        :param deduplicate: leave out positions that were sampled before
+        """
+
+        self.directory = directory
+        self.shard_size = shard_size
+        self.deduplicate = deduplicate
+
+        self.num_samples = 0
+        self.num_duplicates = 0
+
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_games = []
+        self._buffer_keys = set()
+
+        os.makedirs(directory, exist_ok=True)
+        filenames = get_shard_filenames(directory)
+        games = [np.zeros(0, dtype=np.uint32)]
+        keys = [np.zeros(0, dtype=np.uint64)]
+        for number in range(len(filenames)):
+            shard_games, shard_keys, num_samples = self._read_index(number)
+            games.append(shard_games)
+            keys.append(shard_keys)
+            self.num_samples += num_samples
+        self.num_shards = len(filenames)
+
+        # the games of which all samples are in the shards, and the keys of
+        # the samples
+        self.games = np.unique(np.concatenate(games))
+        self._seen_keys = np.unique(np.concatenate(keys))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_filenames(self, number):
+        return (
+            os.path.join(self.directory, SHARD_PATTERN.format(number)),
+            os.path.join(self.directory, INDEX_PATTERN.format(number))
+        )
+
+    def _read_index(self, number):
+        """Return a tuple (games, keys, amount of samples) of a shard."""
+
+        shard_filename, index_filename = self._get_filenames(number)
+        if not os.path.exists(index_filename):
+            # a shard written without an index
+            samples = read_shard(shard_filename)
+            return (
+                np.unique(samples['game']).astype(np.uint32),
+                np.unique(samples['key']),
+                len(samples)
+            )
+
+        with np.load(index_filename) as data:
+            return data['games'], data['keys'], int(data['num_samples'])
+
+    def add(self, samples, games):
+        """Add the samples of completed games, and write a shard if it is
+        full.
+
+        :param samples: an array of SAMPLE_DTYPE
+        :param games: the indices of the games, including games without
+            samples
+        """
+
+        if self.deduplicate and len(samples):
+            # the first sample of every key that is not in the shards, and
+            # of those the samples with keys that are not in the buffer
+            keys, indices = np.unique(samples['key'], return_index=True)
+            is_new = ~_contains(self._seen_keys, keys)
+            buffer_keys = self._buffer_keys
+            new_indices = []
+            for key, index in zip(
+                    keys[is_new].tolist(),
+                    indices[is_new].tolist()
+            ):
+                if key not in buffer_keys:
+                    buffer_keys.add(key)
+                    new_indices.append(index)
+            new_indices.sort()
+
+            self.num_duplicates += len(samples) - len(new_indices)
+            samples = samples[new_indices]
+
+        self._buffer.append(samples)
+        self._buffer_size += len(samples)
+        self._buffer_games.extend(games)
+
+        if self._buffer_size >= self.shard_size:
+            self._write_shard()
+
+    def close(self):
+        """Write the remaining samples to a last, smaller shard."""
+
+        if self._buffer_size or self._buffer_games:
+            self._write_shard()
+
+    def _write_shard(self):
+        if self._buffer:
+            samples = np.concatenate(self._buffer)
+        else:
+            samples = np.zeros(0, dtype=SAMPLE_DTYPE)
+        games = np.array(self._buffer_games, dtype=np.uint32)
+
+        # the keys are only sorted once per shard
+        keys = np.unique(samples['key'])
+
+        shard_filename, index_filename = self._get_filenames(self.num_shards)
+
+        # the index is written first, as the games only count as completed
+        # once the shard exists
+        _write_atomic(index_filename, lambda file: np.savez(
+            file,
+            games=games,
+            keys=keys,
+            num_samples=len(samples)
+        ))
+        _write_atomic(shard_filename, lambda file: np.savez_compressed(
+            file,
+            samples=samples
+        ))
+
+        self.num_shards += 1
+        self.num_samples += len(samples)
+        self.games = np.union1d(self.games, games)
+        if self.deduplicate:
+            self._seen_keys = np.union1d(self._seen_keys, keys)
+
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_games = []
+        self._buffer_keys = set()
+
+
+def check_settings(directory, settings):
+    """Store the settings of a run in a directory, or check that they are
+    the same as the stored settings when it is resumed.
+    """
+
+    filename = os.path.join(directory, SETTINGS_FILENAME)
+    if os.path.exists(filename):
+        with open(filename, 'r') as file:
+            if json.load(file) != settings:
+                raise Exception(
+                    "{0} belongs to a different run".format(directory)
+                )
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    with open(filename, 'w') as file:
+        json.dump(settings, file, indent=4)
+        file.write('\n')
+
+
+def generate_samples(
+        directory,
+        players,
+        num_games,
+        num_workers=None,
+        chunk_size=1,
+        shard_size=1 << 20,
+        deduplicate=True,
+        opening_list=None,
+        seed=0
+):
+    """Play games in worker processes and write their samples to shards.
+
+    At most two chunks of games per worker are waiting or being played at
+    a time, so that the samples are written as the games finish.
+
+    :param directory: the directory to write the shards to
+    :param players: a list of two PlayerConfig objects
+    :param num_games: the total amount of games, including the games of
+        earlier runs in the directory
+    :param num_workers: the amount of worker processes (default: the amount
+        of CPUs minus two)
+    :param chunk_size: the amount of games sent to a worker at once
+    :param shard_size: the amount of samples after which a shard is written
+    :param deduplicate: leave out positions that were sampled before
+    :param opening_list: a list of openings to start the games from, see
+        openings.load_openings()
+    :param seed: the seed of the random games
+    """
+
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 1) - 2)
+
+    settings = {
+        'players': tournament.get_player_names(players),
+        'deduplicate': deduplicate,
+        'seed': seed
+    }
+    if opening_list:
+        settings['openings'] = opening_list
+    check_settings(directory, settings)
+
+    writer = ShardWriter(directory, shard_size, deduplicate)
+    pending_games = np.setdiff1d(
+        np.arange(num_games),
+        writer.games
+    ).tolist()
+    if len(pending_games) < num_games:
+        print("Resuming with {0} samples in {1} shards, {2} games to "
+              "play".format(
+                  writer.num_samples,
+                  writer.num_shards,
+                  len(pending_games)
+              ))
+
+    chunks = [
+        pending_games[start:start + chunk_size]
+        for start in range(0, len(pending_games), chunk_size)
+    ]
+    chunks.reverse()
+
+    start_time = time.perf_counter()
+    num_played = 0
+    num_shards = writer.num_shards
+    with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=init_worker,
+            initargs=(DraughtsRules.use_bitboards, players, opening_list, seed)
+    ) as executor, writer:
+        futures = set()
+        while chunks or futures:
+            while chunks and len(futures) < 2 * num_workers:
+                futures.add(executor.submit(play_games, chunks.pop()))
+
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                samples, games, errors = future.result()
+                for game_index, error in errors:
+                    print("Game {0} failed: {1}".format(game_index, error))
+
+                writer.add(samples, games)
+                num_played += len(games)
+
+            if writer.num_shards > num_shards:
+                num_shards = writer.num_shards
+                seconds = time.perf_counter() - start_time
+                print("{0} shards, {1} samples, {2} games played in {3:.1f} "
+                      "s ({4:.1f} games/s), {5} duplicates".format(
+                          writer.num_shards,
+                          writer.num_samples,
+                          num_played,
+                          seconds,
+                          num_played / seconds,
+                          writer.num_duplicates
+                      ))
+
+    print("{0} samples in {1} shards in {2}".format(
+        writer.num_samples,
+        writer.num_shards,
+        directory
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes samples of games between players to shards."
+    )
+
+    parser.add_argument(
+        'directory',
+        metavar='DIRECTORY',
+        help="The directory to write the shards to, or to resume"
+    )
+    parser.add_argument(
+        '-p',
+        '--players',
+        dest='players',
+        metavar='PLAYER',
+        help="The player objects to be used",
+        nargs=2,
+        default=['RandomPlayer', 'RandomPlayer']
+    )
+    parser.add_argument(
+        '-p1',
+        dest='player1_args',
+        metavar='ARGUMENTS',
+        help="Extra arguments to pass to player 1 (default: white)",
+        default=None
+    )
+    parser.add_argument(
+        '-p2',
+        dest='player2_args',
+        metavar='ARGUMENTS',
+        help="Extra arguments to pass to player 2 (default: black)",
+        default=None
+    )
+    parser.add_argument(
+        '-n',
+        '--games',
+        dest='num_games',
+        type=int,
+        help="The total amount of games to play",
+        default=1000
+    )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        dest='num_workers',
+        type=int,
+        help="The amount of worker processes (default: CPUs minus two)",
+        default=None
+    )
+    parser.add_argument(
+        '--chunk-size',
+        dest='chunk_size',
+        type=int,
+        help="The amount of games sent to a worker at once",
+        default=1
+    )
+    parser.add_argument(
+        '--shard-size',
+        dest='shard_size',
+        type=int,
+        help="The amount of samples after which a shard is written",
+        default=1 << 20
+    )
+    parser.add_argument(
+        '--keep-duplicates',
+        dest='deduplicate',
+        action='store_false',
+        help="Keep positions that were sampled before",
+        default=True
+    )
+    parser.add_argument(
+        '-o',
+        '--openings',
+        dest='openings_file',
+        help="A file with openings to start the games from",
+        default=None
+    )
+    parser.add_argument(
+        '-s',
+        '--seed',
+        dest='seed',
+        type=int,
+        help="The seed of the random games",
+        default=0
+    )
+    parser.add_argument(
+        '-b',
+        '--bitboards',
+        dest='use_bitboards',
+        action='store_true',
+        help="Use the bitboard move generator",
+        default=False
+    )
+
+    args = parser.parse_args()
+    DraughtsRules.use_bitboards = args.use_bitboards
+
+    players = headless.parse_players(
+        args.players,
+        (args.player1_args, args.player2_args),
+        True
+    )
+
+    opening_list = None
+    if args.openings_file is not None:
+        opening_list = openings.load_openings(args.openings_file)
+
+    generate_samples(
+        args.directory,
+        players,
+        args.num_games,
+        args.num_workers,
+        args.chunk_size,
+        args.shard_size,
+        args.deduplicate,
+        opening_list,
+        args.seed
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,675 @@
+"""Endgame tablebases for positions with few pieces.
+
+A tablebase stores the game-theoretic result of every position with a given
+material signature: the amount of white men, white kings, black men and
+black kings. Tables are generated by retrograde analysis, from the
+positions without moves back to the positions that lead to them, and every
+table only depends on tables with fewer pieces or fewer men, which are
+generated first.
+
+Each signature is stored in two files in the tablebase directory, named by
+the signature (e.g. '0201' for two white kings against one black king):
+
+    0201.wdl: the result of every position for the player to move, in 2
+        bits (DRAW, WIN, LOSS or INVALID for impossible indices), packed 4
+        positions in a byte
+    0201.dtw: the distance to the end of the game in plies with best play,
+        one byte per position (255 if it is longer), for wins and losses
+
+Both files start with a header of FILE_HEADER.size bytes. The .dtw files are
+only needed to play the shortest wins, and can be left out. Positions are
+indexed by the colexicographic rank of the squares of each group of pieces
+and by the player to move, see get_index().
+
+The results are those of the rules of the game without the move counters of
+History (the onevs2_moves, onevs3_moves and king move draws), so a win that
+takes longer than these allow is a draw in a game.
+
+Tables are probed through read-only memory maps, so any amount of processes
+can share them without locks:
+
+    tablebase = Tablebase('tables')
+    result = tablebase.probe(state.board, state.current_player)
+
+and generated from the command line:
+
+    python -m tablebase tables --pieces 4 --workers 8
+"""
+
+import argparse
+import itertools
+import math
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bitboardrules import BitboardRules
+from bitboardrules import SQUARES
+
+DRAW = 0
+WIN = 1
+LOSS = 2
+INVALID = 3
+
+MAX_DTW = 255
+
+WDL_MAGIC = b'DRGTBWDL'
+DTW_MAGIC = b'DRGTBDTW'
+VERSION = 1
+
+# magic, version and the amounts of white men, white kings, black men and
+# black kings
+FILE_HEADER = struct.Struct('<8sB4B3x')
+
+# the squares (0 to 49) that each kind of piece can be on, as (first
+# square, amount of squares): white men are crowned on row 0 and black men
+# on row 9
+WHITE_MAN_SQUARES = (5, 45)
+KING_SQUARES = (0, 50)
+BLACK_MAN_SQUARES = (0, 45)
+
+GROUP_SQUARES = (
+    WHITE_MAN_SQUARES,
+    KING_SQUARES,
+    BLACK_MAN_SQUARES,
+    KING_SQUARES
+)
+
+PROMOTION_ROWS = (0b11111, 0b11111 << 45)
+
+# COMBINATIONS[n][k] is n choose k
+COMBINATIONS = tuple(
+    tuple(math.comb(n, k) for k in range(10)) for n in range(51)
+)
+
+
+def get_signature_name(signature):
+    return ''.join(str(count) for count in signature)
+
+
+def get_signatures(max_pieces):
+    """Return the signatures with up to max_pieces pieces, in the order in
+    which they are generated.
+    """
+
+    signatures = [
+        signature
+        for signature in itertools.product(range(max_pieces + 1), repeat=4)
+        if signature[0] + signature[1] and signature[2] + signature[3]
+        and sum(signature) <= max_pieces
+    ]
+
+    # captures lead to fewer pieces and promotions to fewer men
+    signatures.sort(key=lambda signature: (
+        sum(signature), signature[0] + signature[2], signature
+    ))
+
+    return signatures
+
+
+def get_group_sizes(signature):
+    """Return the amount of square combinations of each group of pieces."""
+
+    return tuple(
+        COMBINATIONS[num_squares][count]
+        for (_, num_squares), count in zip(GROUP_SQUARES, signature)
+    )
+
+
+def get_table_size(signature):
+    """Return the amount of indices of a signature, for both players."""
+
+    return 2 * math.prod(get_group_sizes(signature))
+
+
+def _get_rank(mask, first_square):
+    """Return the colexicographic rank of the squares in a mask."""
+
+    rank = 0
+    count = 0
+    mask >>= first_square
+    while mask:
+        lowest_bit = mask & -mask
+        count += 1
+        rank += COMBINATIONS[lowest_bit.bit_length() - 1][count]
+        mask ^= lowest_bit
+
+    return rank
+
+
+def get_signature(masks):
+    """Return the signature of the masks (white men, white kings, black men,
+    black kings).
+    """
+
+    return tuple(bin(mask).count('1') for mask in masks)
+
+
+def get_masks(grid):
+    """Return the masks (white men, white kings, black men, black kings) of
+    a board.BoardGrid.
+    """
+
+    occupied, kings, player1 = grid.get_bitboards()
+    player0 = occupied & ~player1
+
+    return (
+        player0 & ~kings,
+        player0 & kings,
+        player1 & ~kings,
+        player1 & kings
+    )
+
+
+def get_index(masks, player_id, signature=None):
+    """Return the index of a position in the table of its signature.
+
+    :param masks: the masks (white men, white kings, black men, black kings)
+    :param player_id: the player to move
+    :param signature: the signature of the masks, if it is known
+    """
+
+    if signature is None:
+        signature = get_signature(masks)
+
+    index = 0
+    for mask, (first_square, num_squares), count in zip(
+            masks, GROUP_SQUARES, signature
+    ):
+        index = index * COMBINATIONS[num_squares][count] \
+            + _get_rank(mask, first_square)
+
+    return 2 * index + player_id
+
+
+def _get_group_masks(first_square, num_squares, count):
+    """Return a list of the masks of all combinations of squares, ordered by
+    their rank.
+    """
+
+    masks = [0] * COMBINATIONS[num_squares][count]
+    for squares in itertools.combinations(range(num_squares), count):
+        mask = 0
+        for square in squares:
+            mask |= 1 << square + first_square
+        masks[_get_rank(mask, first_square)] = mask
+
+    return masks
+
+
+class Tablebase:
+    """A directory of tables, opened with mmap when they are first probed.
+
+    max_pieces is the largest amount of pieces of the tables in the
+    directory.
+    """
+
+    DRAW = DRAW
+    WIN = WIN
+    LOSS = LOSS
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._tables = {}
+
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            self.max_pieces = max((
+                sum(int(count) for count in filename[:4])
+                for filename in os.listdir(directory)
+                if filename.endswith('.wdl') and filename[:4].isdigit()
+            ), default=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for wdl, dtw in self._tables.values():
+            wdl.close()
+            if dtw is not None:
+                dtw.close()
+        self._tables.clear()
+
+    def _open(self, filename, magic):
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(magic)] != magic \
+                or data[len(magic)] != VERSION:
+            data.close()
+            raise Exception("Invalid tablebase file {0}".format(filename))
+
+        return data
+
+    def _get_table(self, signature):
+        table = self._tables.get(signature)
+        if table is None:
+            path = os.path.join(
+                self.directory,
+                get_signature_name(signature)
+            )
+            wdl = self._open(path + '.wdl', WDL_MAGIC)
+            if wdl is None:
+                return None
+
+            table = (wdl, self._open(path + '.dtw', DTW_MAGIC))
+            self._tables[signature] = table
+
+        return table
+
+    def probe_masks(self, masks, player_id):
+        """Return a tuple (result, distance) for the player to move, or None
+        if the position is not in the tablebase.
+
+        The result is DRAW, WIN or LOSS, and the distance the amount of
+        plies to the end of the game (MAX_DTW if it is longer), or None for
+        draws and tables without distances.
+
+        :param masks: the masks (white men, white kings, black men, black
+            kings)
+        :param player_id: the player to move
+        """
+
+        signature = get_signature(masks)
+        if not signature[2 * player_id] + signature[2 * player_id + 1]:
+            # the player to move has no pieces left
+            return LOSS, 0
+
+        table = self._get_table(signature)
+        if table is None:
+            return None
+
+        wdl, dtw = table
+        index = get_index(masks, player_id, signature)
+        result = wdl[FILE_HEADER.size + (index >> 2)] >> 2 * (index & 3) & 3
+        if result == INVALID:
+            raise Exception("Invalid position in table {0}".format(
+                get_signature_name(signature)
+            ))
+
+        distance = None
+        if dtw is not None and result != DRAW:
+            distance = dtw[FILE_HEADER.size + index]
+
+        return result, distance
+
+    def probe(self, grid, player_id):
+        """Return a tuple (result, distance) of a board.BoardGrid, see
+        probe_masks().
+        """
+
+        return self.probe_masks(get_masks(grid), player_id)
+
+
+# the state of a worker process, set by init_worker()
+_worker = {}
+
+
+def init_worker(directory):
+    _worker['tablebase'] = Tablebase(directory)
+    _worker['group_masks'] = {}
+
+
+def _get_worker_group_masks(signature):
+    group_masks = []
+    for (first_square, num_squares), count in zip(GROUP_SQUARES, signature):
+        key = (first_square, num_squares, count)
+        if key not in _worker['group_masks']:
+            _worker['group_masks'][key] = _get_group_masks(*key)
+        group_masks.append(_worker['group_masks'][key])
+
+    return group_masks
+
+
+def get_moves(signature, start, stop):
+    """Generate the moves of the positions with indices start to stop.
+
+    Moves within the table are returned as edges, and the results of moves
+    to other tables are looked up in the tablebase. Returns a tuple of
+    NumPy arrays (amount of moves, or -1 for an invalid index; the level of
+    the earliest win through another table; edge sources; edge targets;
+    sources and levels of moves to positions that other tables have as won
+    by the opponent). The level of a win or loss is its distance in plies.
+    """
+
+    tablebase = _worker['tablebase']
+    group_masks = _get_worker_group_masks(signature)
+    group_sizes = get_group_sizes(signature)
+    num_pieces = sum(signature)
+
+    num_moves = np.full(stop - start, -1, dtype=np.int32)
+    win_levels = np.full(stop - start, np.iinfo(np.int32).max, dtype=np.int32)
+    edge_sources = []
+    edge_targets = []
+    won_sources = []
+    won_levels = []
+
+    for index in range(start, stop):
+        player_id = index & 1
+        rest = index >> 1
+        ranks = [0] * 4
+        for group in range(3, -1, -1):
+            rest, ranks[group] = divmod(rest, group_sizes[group])
+        masks = [group_masks[group][ranks[group]] for group in range(4)]
+
+        if sum(masks) != masks[0] | masks[1] | masks[2] | masks[3]:
+            # pieces on the same square
+            continue
+
+        player_men = masks[2 * player_id]
+        player_kings = masks[2 * player_id + 1]
+        opponent_men = masks[2 - 2 * player_id]
+        opponent_kings = masks[3 - 2 * player_id]
+        player_mask = player_men | player_kings
+        kings = player_kings | opponent_kings
+
+        moves = BitboardRules.get_square_moves(
+            player_mask,
+            opponent_men | opponent_kings,
+            kings,
+            player_id,
+            SQUARES
+        )
+
+        offset = index - start
+        count = 0
+        for square, square_moves in moves.items():
+            bit = 1 << square
+            is_king = player_kings & bit
+            for path, captured in square_moves:
+                count += 1
+
+                end_bit = 1 << path[-1]
+                captured_mask = 0
+                for captured_square in captured:
+                    captured_mask |= 1 << captured_square
+
+                promoted = not is_king \
+                    and end_bit & PROMOTION_ROWS[player_id]
+                if is_king:
+                    new_men = player_men
+                    new_kings = player_kings & ~bit | end_bit
+                elif promoted:
+                    new_men = player_men & ~bit
+                    new_kings = player_kings | end_bit
+                else:
+                    new_men = player_men & ~bit | end_bit
+                    new_kings = player_kings
+
+                new_masks = [
+                    new_men,
+                    new_kings,
+                    opponent_men & ~captured_mask,
+                    opponent_kings & ~captured_mask
+                ]
+                if player_id:
+                    new_masks = new_masks[2:] + new_masks[:2]
+
+                if not captured and not promoted:
+                    edge_sources.append(index)
+                    edge_targets.append(
+                        get_index(new_masks, 1 - player_id, signature)
+                    )
+                    continue
+
+                result, distance = tablebase.probe_masks(
+                    new_masks,
+                    1 - player_id
+                )
+                if distance is None and result != DRAW:
+                    raise Exception(
+                        "Table without distances for {0} pieces".format(
+                            num_pieces
+                        )
+                    )
+
+                if result == LOSS:
+                    win_levels[offset] = min(
+                        win_levels[offset],
+                        distance + 1
+                    )
+                elif result == WIN:
+                    won_sources.append(index)
+                    won_levels.append(distance + 1)
+
+        num_moves[offset] = count
+
+    return (
+        num_moves,
+        win_levels,
+        np.array(edge_sources, dtype=np.int64),
+        np.array(edge_targets, dtype=np.int64),
+        np.array(won_sources, dtype=np.int64),
+        np.array(won_levels, dtype=np.int32)
+    )
+
+
+def _gather(starts, values, nodes):
+    """Return the concatenated values[starts[node]:starts[node + 1]]."""
+
+    lengths = starts[nodes + 1] - starts[nodes]
+    if not lengths.sum():
+        return values[:0]
+
+    positions = np.repeat(starts[nodes] - np.cumsum(lengths) + lengths,
+                          lengths) + np.arange(lengths.sum())
+
+    return values[positions]
+
+
+def solve(size, num_moves, win_levels, edges, won_moves):
+    """Return the arrays (results, distances) of a table.
+
+    The positions are resolved level by level: a position is won at level
+    n if a move leads to a position lost at level n - 1, and lost at level
+    n if all moves lead to positions won by the opponent, the last of them
+    at level n - 1. Positions that are never resolved are draws.
+
+    :param size: the amount of indices of the table
+    :param num_moves: the amount of moves of every index, -1 if invalid
+    :param win_levels: the earliest level at which a move to another table
+        wins
+    :param edges: a tuple of arrays (sources, targets) of the moves within
+        the table
+    :param won_moves: a tuple of arrays (sources, levels) of the moves to
+        other tables that the opponent wins
+    """
+
+    results = np.full(size, INVALID, dtype=np.uint8)
+    results[num_moves >= 0] = DRAW
+    distances = np.zeros(size, dtype=np.int32)
+    remaining = num_moves.astype(np.int64)
+    unresolved = num_moves >= 0
+
+    # the predecessors of every position, as a compressed sparse array
+    sources, targets = edges
+    order = np.argsort(targets, kind='stable')
+    predecessors = sources[order]
+    starts = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(targets, minlength=size), out=starts[1:])
+
+    won_sources, won_levels = won_moves
+    order = np.argsort(won_levels, kind='stable')
+    won_sources = won_sources[order]
+    won_levels = won_levels[order]
+
+    max_level = max(
+        int(won_levels[-1]) if len(won_levels) else 0,
+        int(win_levels[win_levels < np.iinfo(np.int32).max].max(initial=0))
+    )
+
+    # positions without moves are lost
+    lost = np.flatnonzero(num_moves == 0)
+    won = lost[:0]
+    results[lost] = LOSS
+    unresolved[lost] = False
+
+    level = 0
+    while len(lost) or len(won) or level < max_level:
+        level += 1
+
+        new_won = np.union1d(
+            _gather(starts, predecessors, lost),
+            np.flatnonzero(win_levels == level)
+        )
+        new_won = new_won[unresolved[new_won]]
+        results[new_won] = WIN
+        distances[new_won] = level
+        unresolved[new_won] = False
+
+        first, last = np.searchsorted(won_levels, (level, level + 1))
+        decremented = np.concatenate((
+            _gather(starts, predecessors, won),
+            won_sources[first:last]
+        ))
+        np.subtract.at(remaining, decremented, 1)
+        new_lost = np.unique(decremented)
+        new_lost = new_lost[unresolved[new_lost]
+                            & (remaining[new_lost] == 0)]
+        results[new_lost] = LOSS
+        distances[new_lost] = level
+        unresolved[new_lost] = False
+
+        won = new_won
+        lost = new_lost
+
+    return results, distances
+
+
+def write_table(directory, signature, results, distances):
+    """Write the .wdl and .dtw files of a table."""
+
+    path = os.path.join(directory, get_signature_name(signature))
+
+    padded = np.full(-len(results) % 4 + len(results), INVALID, np.uint8)
+    padded[:len(results)] = results
+    padded = padded.reshape(-1, 4)
+    packed = (
+        padded[:, 0]
+        | padded[:, 1] << 2
+        | padded[:, 2] << 4
+        | padded[:, 3] << 6
+    ).astype(np.uint8)
+
+    distances = np.minimum(distances, MAX_DTW).astype(np.uint8)
+    for extension, magic, data in (
+            ('.dtw', DTW_MAGIC, distances),
+            ('.wdl', WDL_MAGIC, packed)
+    ):
+        # the files are written under another name first, so that a
+        # table is never probed while it is incomplete
+        temporary = path + extension + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(FILE_HEADER.pack(magic, VERSION, *signature))
+            file.write(data.tobytes())
+        os.replace(temporary, path + extension)
+
+
+def generate(directory, max_pieces, num_workers=None, chunk_size=4096):
+    """Generate all tables with up to max_pieces pieces.
+
+    Tables that already exist are kept, so that an interrupted generation
+    can be continued.
+
+    :param directory: the tablebase directory
+    :param max_pieces: the maximal amount of pieces
+    :param num_workers: the amount of worker processes (default: the amount
+        of CPUs)
+    :param chunk_size: the amount of indices sent to a worker at once
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=init_worker,
+            initargs=(directory,)
+    ) as executor:
+        for signature in get_signatures(max_pieces):
+            name = get_signature_name(signature)
+            if os.path.exists(os.path.join(directory, name + '.wdl')):
+                continue
+
+            t = time.perf_counter()
+            size = get_table_size(signature)
+            chunks = list(executor.map(
+                get_moves,
+                itertools.repeat(signature),
+                range(0, size, chunk_size),
+                (min(size, start + chunk_size)
+                 for start in range(0, size, chunk_size))
+            ))
+
+            results, distances = solve(
+                size,
+                np.concatenate([chunk[0] for chunk in chunks]),
+                np.concatenate([chunk[1] for chunk in chunks]),
+                (
+                    np.concatenate([chunk[2] for chunk in chunks]),
+                    np.concatenate([chunk[3] for chunk in chunks])
+                ),
+                (
+                    np.concatenate([chunk[4] for chunk in chunks]),
+                    np.concatenate([chunk[5] for chunk in chunks])
+                )
+            )
+            write_table(directory, signature, results, distances)
+
+            counts = np.bincount(results, minlength=4)
+            print("{0}: {1} positions, {2} wins, {3} draws, {4} losses, "
+                  "longest {5} plies ({6:.1f} s)".format(
+                      name,
+                      size - counts[INVALID],
+                      counts[WIN],
+                      counts[DRAW],
+                      counts[LOSS],
+                      distances.max(initial=0),
+                      time.perf_counter() - t
+                  ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates endgame tablebases."
+    )
+
+    parser.add_argument(
+        'directory',
+        metavar='DIRECTORY',
+        help="The directory to write the tables to"
+    )
+    parser.add_argument(
+        '-p',
+        '--pieces',
+        dest='max_pieces',
+        type=int,
+        help="The maximal amount of pieces",
+        default=3
+    )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        dest='num_workers',
+        type=int,
+        help="The amount of worker processes (default: the amount of CPUs)",
+        default=None
+    )
+
+    args = parser.parse_args()
+
+    generate(args.directory, args.max_pieces, args.num_workers)
+
+
+if __name__ == "__main__":
+    main()
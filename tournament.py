@@ -1,10 +1,47 @@
-"""This module includes functions to simulate a tournament between players."""
+"""This module includes functions to simulate a tournament between players.
 
+Matches are played in worker processes and their results are processed as
+soon as they come in, so the standings can be followed while the tournament
+is running. If a checkpoint file is given, every result is appended to it,
+and running the same tournament again with the same file only plays the
+matches that have no result yet.
+
+Workers are sent the player configurations once and receive the matches in
+chunks. With reuse_players, every worker creates each player once per color
+and keeps it for all of its matches, calling end_game() after every match,
+so that players with an expensive setup only pay for it once per worker.
+
+Games can start from the openings of an opening file (see the openings
+module). Both games of a pair with reversed colors get the same opening, so
+that repeated sets of deterministic players do not replay the same games.
+
+At the end of a round robin tournament, the ratings of the players are
+estimated with rating.bayeselo(). play_sprt_match() plays two players
+against each other until a sequential probability ratio test decides
+whether the first one is stronger, which usually takes far fewer games than
+a match of a fixed length.
+
+Usage:
+    python -m tournament -p RandomPlayer Random2=RandomPlayer -n 10 \
+        -j 4 -c tournament.ckpt --reuse-players --chunk-size 20
+    python -m tournament -p NewPlayer OldPlayer --sprt 0 10 -o openings.txt
+"""
+
+import argparse
+import itertools
+import json
+import os
 import time
-from multiprocessing import Pool
-from os import cpu_count
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
 
-import draights
+import headless
+import openings
+import rating
+from draughtsrules import DraughtsRules
 
 
 def create_roundrobin_schedule(players):
@@ -29,32 +66,313 @@ def create_roundrobin_schedule(players):
     return schedule + list(tuple(reversed(match)) for match in schedule)
 
 
-RESULT_BYE = 2
+# the amount of times in a row the worker processes are restarted after one
+# of them died without any match finishing, before the tournament is aborted
+MAX_RESTARTS = 3
+
+
+# the state of a worker process, set by init_worker()
+_worker = {}
+
+
+def init_worker(use_bitboards, players, reuse_players):
+    DraughtsRules.use_bitboards = use_bitboards
+
+    _worker['players'] = players
+    _worker['reuse_players'] = reuse_players
+    _worker['instances'] = {}
+
+
+def get_worker_player(player_index, player_id):
+    """Return a player object for a player of the tournament.
+
+    If players are reused, each player is created and initialized once per
+    worker for each color, otherwise a new object is created every time.
+    """
+
+    config = _worker['players'][player_index]
+    if not _worker['reuse_players']:
+        return headless.create_player(config, player_id)
+
+    key = (player_index, player_id)
+    if key not in _worker['instances']:
+        instance = headless.create_player(config, player_id)
+        instance.initialize()
+        _worker['instances'][key] = instance
+
+    return _worker['instances'][key]
+
+
+def play_matches(matches):
+    """Play a chunk of matches in a worker process.
+
+    Returns a tuple (results, errors), in which results is a list of tuples
+    (match index, winner, seconds) and errors a list of tuples (match index,
+    error message).
+
+    :param matches: a list of tuples (match index, white player index, black
+        player index, opening), in which opening is a string from
+        openings.load_openings() or None
+    """
+
+    results = []
+    errors = []
+    for index, white, black, opening in matches:
+        t = time.process_time()
+        try:
+            game = headless.HeadlessGame(
+                (get_worker_player(white, 0), get_worker_player(black, 1)),
+                start_state=openings.get_start_state(opening)
+            )
+            _, winner = game.run(not _worker['reuse_players'])
+        except Exception as e:
+            errors.append((index, repr(e)))
+
+            # the players may have been left in an unusable state
+            _worker['instances'].pop((white, 0), None)
+            _worker['instances'].pop((black, 1), None)
+            continue
+
+        results.append((index, winner, time.process_time() - t))
+
+    return results, errors
+
+
+def get_player_names(players):
+    """Return the names of a list of PlayerConfig objects."""
+
+    return [
+        player.name if player.name is not None
+        else player.constructor.__name__
+        for player in players
+    ]
+
+
+def get_match_opening(index, schedule_length, opening_list):
+    """Return the opening of a match, or None if there are no openings.
+
+    A schedule of create_roundrobin_schedule() is made of two halves, in
+    which the second half repeats the matches of the first half with the
+    colors reversed. Both matches of such a pair get the same opening, and
+    every pair of a repeated schedule gets the next opening.
+
+    :param index: the index of the match in the (repeated) schedule
+    :param schedule_length: the length of a single schedule
+    :param opening_list: a list of openings or None
+    """
+
+    if not opening_list:
+        return None
+
+    half = schedule_length // 2
+    pair = index // schedule_length * half + index % schedule_length % half
+
+    return opening_list[pair % len(opening_list)]
+
+
+def get_checkpoint_header(names, num_matches, opening_list):
+    header = {'players': names, 'num_matches': num_matches}
+    if opening_list:
+        header['openings'] = opening_list
+
+    return header
+
+
+def _read_checkpoint_header(filename):
+    """Return the header line of a checkpoint file, or None if the file does
+    not exist or a crash left it without a complete header.
+    """
+
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename, 'r') as file:
+        line = file.readline()
+
+    if not line.endswith('\n') or not line.strip():
+        return None
+
+    return line
+
+
+def load_checkpoint(filename, names, num_matches, opening_list=None):
+    """Return the results stored in a checkpoint file as {match: winner}.
+
+    Returns an empty dict if the file does not exist or has no complete
+    header. Incomplete lines, left behind by a crash, are ignored.
+
+    :param filename: the name of the checkpoint file
+    :param names: the player names of the tournament
+    :param num_matches: the total amount of matches of the tournament
+    :param opening_list: the openings of the tournament
+    """
+
+    if _read_checkpoint_header(filename) is None:
+        return {}
+
+    results = {}
+    with open(filename, 'r') as file:
+        header = json.loads(file.readline())
+        if header != get_checkpoint_header(names, num_matches, opening_list):
+            raise Exception(
+                "Checkpoint {0} belongs to a different tournament".format(
+                    filename
+                )
+            )
 
+        for line in file:
+            try:
+                index, winner = json.loads(line)
+            except ValueError:
+                continue
+            results[index] = winner
 
-def play_match(players):
-    if any(player is None for player in players):
-        return RESULT_BYE
+    return results
 
-    print("Playing {0} - {1}".format(players[0][0].name, players[1][0].name))
 
-    t = time.process_time()
-    game = draights.Game((players[0][0], players[1][0]), False)
-    _, winner = game.run()
-    t = time.process_time() - t
+def open_checkpoint(filename, names, num_matches, opening_list=None):
+    """Open a checkpoint file for appending, and write its header if new.
 
-    result = "draw"
-    if 0 <= winner <= 1:
-        result = players[winner][0].name
+    A file without a complete header is started over.
+    """
+
+    is_new = _read_checkpoint_header(filename) is None
+    file = open(filename, 'w' if is_new else 'a+')
+    if is_new:
+        file.write(json.dumps(
+            get_checkpoint_header(names, num_matches, opening_list)
+        ) + '\n')
+        file.flush()
+    else:
+        # start on a new line if the last one was not finished
+        file.seek(0, os.SEEK_END)
+        if file.tell() > 0:
+            file.seek(file.tell() - 1)
+            if file.read(1) != '\n':
+                file.write('\n')
+
+    return file
+
+
+def format_standings(names, points, num_played, num_matches):
+    """Return the standings table as a string."""
+
+    width = max(len(name) for name in names)
+    lines = ["Standings after {0}/{1} matches".format(num_played, num_matches)]
+    ranking = sorted(range(len(names)), key=lambda index: -points[index])
+    for rank, index in enumerate(ranking):
+        lines.append("{0:>3}. {1:<{2}} {3:>7}".format(
+            rank + 1, names[index], width, points[index]
+        ))
+
+    return '\n'.join(lines)
 
-    print("{0} - {1}: {2} in {3}".format(players[0][0].name, players[1][0].name,
-                                         result, t))
 
-    return winner
+def format_ratings(names, ratings):
+    """Return a table of (rating, standard error) tuples as a string."""
+
+    width = max(len(name) for name in names)
+    lines = ["Ratings (BayesElo)"]
+    ranking = sorted(range(len(names)), key=lambda index: -ratings[index][0])
+    for rank, index in enumerate(ranking):
+        lines.append("{0:>3}. {1:<{2}} {3:>7.1f} +/- {4:.1f}".format(
+            rank + 1, names[index], width, ratings[index][0],
+            1.96 * ratings[index][1]
+        ))
+
+    return '\n'.join(lines)
+
+
+def run_matches(players, matches, num_workers=None, chunk_size=1,
+                reuse_players=False):
+    """Play matches in worker processes and yield the results as they come in.
+
+    Yields tuples (match index, winner, seconds, error), in which error is
+    None, or a message if the match raised an exception. At most two chunks
+    of matches per worker are submitted at a time, and the next matches are
+    only taken from matches when a chunk is done. If a worker process dies,
+    the workers are restarted with the submitted matches that have no
+    result yet. When the generator is closed, the matches that were not
+    started yet are cancelled.
+
+    :param players: a list of PlayerConfig objects
+    :param matches: an iterable of tuples (match index, white player index,
+        black player index, opening)
+    :param num_workers: the amount of worker processes (default: the amount
+        of CPUs minus two)
+    :param chunk_size: the amount of matches sent to a worker at once
+    :param reuse_players: create the players once in each worker instead of
+        once per match
+    """
+
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 1) - 2)
+
+    matches = iter(matches)
+    finished = set()
+    restarts = 0
+
+    # the matches that were submitted before a worker process died
+    retry = []
+    while True:
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=init_worker,
+            initargs=(DraughtsRules.use_bitboards, players, reuse_players)
+        )
+        chunks = {}
+        num_finished = len(finished)
+        try:
+            while True:
+                while len(chunks) < 2 * num_workers:
+                    chunk = retry[:chunk_size]
+                    del retry[:chunk_size]
+                    if not chunk:
+                        chunk = list(itertools.islice(matches, chunk_size))
+                    if not chunk:
+                        break
+                    chunks[executor.submit(play_matches, chunk)] = chunk
+                if not chunks:
+                    return
+
+                done, _ = wait(chunks, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk_results, errors = future.result()
+                    del chunks[future]
+
+                    for index, error in errors:
+                        finished.add(index)
+                        yield index, None, None, error
+
+                    for index, winner, seconds in chunk_results:
+                        finished.add(index)
+                        yield index, winner, seconds, None
+        except BrokenProcessPool:
+            retry = [
+                match
+                for chunk in chunks.values()
+                for match in chunk
+                if match[0] not in finished
+            ] + retry
+
+            if len(finished) > num_finished:
+                restarts = 0
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise
+
+            print("A worker process died, restarting {0} matches".format(
+                len(retry)
+            ))
+        finally:
+            executor.shutdown(cancel_futures=True)
 
 
 def play_roundrobin_tournament(players, num_sets=1, win_points=1,
-                               draw_points=0.5, loss_points=0):
+                               draw_points=0.5, loss_points=0,
+                               num_workers=None, checkpoint_file=None,
+                               standings_interval=10, chunk_size=1,
+                               reuse_players=False, opening_list=None):
     """Simulate a double round robin tournament with all players.
 
     The total number of matches played will be
@@ -70,28 +388,343 @@ def play_roundrobin_tournament(players, num_sets=1, win_points=1,
         players in case of a draw.
     :param loss_points: the amount of points that will be assigned to a player
         in case of a loss.
+    :param num_workers: the amount of worker processes (default: the amount
+        of CPUs minus two)
+    :param checkpoint_file: a file to append the results to, from which the
+        tournament is resumed if it already exists
+    :param standings_interval: print the standings after this many results
+    :param chunk_size: the amount of matches sent to a worker at once
+    :param reuse_players: create the players once in each worker instead of
+        once per match
+    :param opening_list: a list of openings from openings.load_openings(),
+        played by both players with each color
     """
 
     t = time.time()
 
-    players = [[player, 0] for player in players]
+    names = get_player_names(players)
+    schedule = create_roundrobin_schedule(list(range(len(players))))
+    schedule_length = len(schedule)
+    schedule = schedule * num_sets
+    matches = [
+        (
+            index,
+            white,
+            black,
+            get_match_opening(index, schedule_length, opening_list)
+        )
+        for index, (white, black) in enumerate(schedule)
+        if white is not None and black is not None
+    ]
+    print("Playing {0} matches".format(len(matches)))
+
+    results = {}
+    checkpoint = None
+    if checkpoint_file is not None:
+        results = load_checkpoint(
+            checkpoint_file, names, len(schedule), opening_list
+        )
+        checkpoint = open_checkpoint(
+            checkpoint_file, names, len(schedule), opening_list
+        )
+        if results:
+            print("Resuming with {0} results from {1}".format(
+                len(results), checkpoint_file
+            ))
+
+    points = [0] * len(players)
+
+    def get_ratings():
+        return rating.bayeselo(
+            (
+                (schedule[index][0], schedule[index][1], winner)
+                for index, winner in results.items()
+            ),
+            len(players)
+        )
+
+    def add_result(index, winner):
+        match = schedule[index]
+        if 0 <= winner <= 1:
+            points[match[winner]] += win_points
+            points[match[not winner]] += loss_points
+        elif winner == -1:
+            points[match[0]] += draw_points
+            points[match[1]] += draw_points
+
+    def handle_result(index, winner, seconds):
+        results[index] = winner
+        add_result(index, winner)
+        if checkpoint is not None:
+            checkpoint.write(json.dumps([index, winner]) + '\n')
+            checkpoint.flush()
 
-    matches = create_roundrobin_schedule(players[:])
-    matches = matches * num_sets
-    print("Playing {0} matches".format(sum(
-        match[0] is not None and match[1] is not None for match in matches)))
-    with Pool(processes=cpu_count() - 2 or 1) as pool:
-        results = pool.map(play_match, matches)
+        white, black = schedule[index]
+        result = "draw"
+        if 0 <= winner <= 1:
+            result = names[schedule[index][winner]]
+        print("{0} - {1}: {2} in {3:.2f}".format(
+            names[white], names[black], result, seconds
+        ))
 
-    for i in range(len(results)):
-        if 0 <= results[i] <= 1:
-            matches[i][results[i]][1] += win_points
-            matches[i][not results[i]][1] += loss_points
-        elif results[i] == -1:
-            matches[i][0][1] += draw_points
-            matches[i][1][1] += draw_points
+        if len(results) % standings_interval == 0:
+            print(format_standings(
+                names, points, len(results), len(matches)
+            ))
+            print(format_ratings(names, get_ratings()))
+
+    for index, winner in results.items():
+        add_result(index, winner)
+
+    failed = []
+    pending = [match for match in matches if match[0] not in results]
+    try:
+        for index, winner, seconds, error in run_matches(
+                players,
+                pending,
+                num_workers,
+                chunk_size,
+                reuse_players
+        ):
+            if error is None:
+                handle_result(index, winner, seconds)
+            else:
+                white, black = schedule[index]
+                print("{0} - {1} failed: {2}".format(
+                    names[white], names[black], error
+                ))
+                failed.append(index)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    if len(results) % standings_interval != 0:
+        print(format_standings(names, points, len(results), len(matches)))
+        print(format_ratings(names, get_ratings()))
+    if failed:
+        print("{0} matches failed, run the tournament again with the same "
+              "checkpoint to retry them".format(len(failed)))
 
     t = time.time() - t
     print("Tournament finished in {0} seconds".format(t))
 
-    return players
+    return [[player, points[index]] for index, player in enumerate(players)]
+
+
+def play_sprt_match(players, elo0=0, elo1=10, alpha=0.05, beta=0.05,
+                    max_pairs=10000, num_workers=None, chunk_size=2,
+                    reuse_players=False, report_interval=100,
+                    opening_list=None):
+    """Play a match between two players until an SPRT decides.
+
+    Games are played in pairs in which each player plays white once. The
+    test is updated with every result, and the match stops as soon as it
+    accepts a hypothesis, or after max_pairs pairs of games. The matches are
+    submitted a few chunks at a time, so that few are left to cancel when
+    the test ends.
+
+    The test counts every game as an independent trinomial result (win,
+    draw or loss), and ignores that both games of a pair are played from
+    the same opening. If an opening favours one color, the two games of a
+    pair are correlated, and the test is less accurate than one that
+    scores the pairs.
+
+    Returns a tuple (status, wins, draws, losses) from the point of view of
+    the first player, in which status is 'H1' if the first player is elo1
+    stronger, 'H0' if it is at most elo0 stronger, or None if undecided.
+
+    :param players: a list of two PlayerConfig objects, of the player to
+        test and its baseline
+    :param elo0: the Elo difference of the null hypothesis
+    :param elo1: the Elo difference of the alternative hypothesis
+    :param alpha: the probability of accepting H1 if H0 is true
+    :param beta: the probability of accepting H0 if H1 is true
+    :param max_pairs: the maximum amount of pairs of games
+    :param num_workers: the amount of worker processes (default: the amount
+        of CPUs minus two)
+    :param chunk_size: the amount of matches sent to a worker at once
+    :param reuse_players: create the players once in each worker instead of
+        once per match
+    :param report_interval: print the state of the test after this many
+        results
+    :param opening_list: a list of openings from openings.load_openings(),
+        of which each pair of games plays the next one
+    """
+
+    names = get_player_names(players)
+    schedule = create_roundrobin_schedule([0, 1])
+    schedule_length = len(schedule)
+    matches = (
+        (
+            index,
+            schedule[index % schedule_length][0],
+            schedule[index % schedule_length][1],
+            get_match_opening(index, schedule_length, opening_list)
+        )
+        for index in range(schedule_length * max_pairs)
+    )
+
+    sprt = rating.SPRT(elo0, elo1, alpha, beta)
+    print("SPRT {0} vs {1}: elo0={2}, elo1={3}, bounds [{4:.2f}, {5:.2f}]"
+          .format(names[0], names[1], elo0, elo1, sprt.lower_bound,
+                  sprt.upper_bound))
+
+    status = None
+    with closing(run_matches(
+            players,
+            matches,
+            num_workers,
+            chunk_size,
+            reuse_players
+    )) as results:
+        for index, winner, _, error in results:
+            if error is not None:
+                print("Match {0} failed: {1}".format(index, error))
+                continue
+
+            if winner == -1:
+                sprt.add_result(0.5)
+            else:
+                sprt.add_result(float(
+                    schedule[index % schedule_length][winner] == 0
+                ))
+
+            status = sprt.status()
+            num_games = sprt.wins + sprt.draws + sprt.losses
+            if status is not None or num_games % report_interval == 0:
+                elo, lower, upper = rating.elo_difference(
+                    sprt.wins, sprt.draws, sprt.losses
+                )
+                print("{0} games: +{1} ={2} -{3}, Elo {4:.1f} [{5:.1f}, "
+                      "{6:.1f}], LLR {7:.2f}".format(
+                          num_games, sprt.wins, sprt.draws, sprt.losses,
+                          elo, lower, upper, sprt.get_llr()
+                      ))
+            if status is not None:
+                break
+
+    print("SPRT result: {0}".format(status or "undecided"))
+
+    return status, sprt.wins, sprt.draws, sprt.losses
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs a round robin tournament without graphics."
+    )
+
+    parser.add_argument(
+        '-p',
+        '--players',
+        dest='players',
+        metavar='PLAYER',
+        help="The player objects to be used, as [name=]classname",
+        nargs='+',
+        required=True
+    )
+    parser.add_argument(
+        '-n',
+        '--sets',
+        dest='num_sets',
+        type=int,
+        help="The amount of times players play each other with both colors",
+        default=1
+    )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        dest='num_workers',
+        type=int,
+        help="The amount of worker processes (default: CPUs minus two)",
+        default=None
+    )
+    parser.add_argument(
+        '-c',
+        '--checkpoint',
+        dest='checkpoint_file',
+        metavar='FILE',
+        help="Append results to FILE and resume from it if it exists",
+        default=None
+    )
+    parser.add_argument(
+        '--chunk-size',
+        dest='chunk_size',
+        type=int,
+        help="The amount of matches sent to a worker at once",
+        default=1
+    )
+    parser.add_argument(
+        '--reuse-players',
+        dest='reuse_players',
+        action='store_true',
+        help="Create the players once per worker instead of once per match",
+        default=False
+    )
+    parser.add_argument(
+        '--sprt',
+        dest='sprt',
+        metavar=('ELO0', 'ELO1'),
+        type=float,
+        nargs=2,
+        help="Play the two players until an SPRT of ELO0 against ELO1 "
+             "decides",
+        default=None
+    )
+    parser.add_argument(
+        '-o',
+        '--openings',
+        dest='openings_file',
+        metavar='FILE',
+        help="A file of openings (FEN strings or move sequences) to play "
+             "with both colors",
+        default=None
+    )
+    parser.add_argument(
+        '-b',
+        '--bitboards',
+        dest='use_bitboards',
+        action='store_true',
+        help="Use the bitboard move generator",
+        default=False
+    )
+
+    args = parser.parse_args()
+    DraughtsRules.use_bitboards = args.use_bitboards
+
+    if args.sprt is not None and len(args.players) != 2:
+        parser.error("--sprt needs exactly two players")
+
+    players = headless.parse_players(
+        args.players,
+        [None] * len(args.players),
+        True
+    )
+
+    opening_list = None
+    if args.openings_file is not None:
+        opening_list = openings.load_openings(args.openings_file)
+    if args.sprt is not None:
+        play_sprt_match(
+            players,
+            args.sprt[0],
+            args.sprt[1],
+            num_workers=args.num_workers,
+            chunk_size=args.chunk_size,
+            reuse_players=args.reuse_players,
+            opening_list=opening_list
+        )
+        return
+
+    play_roundrobin_tournament(
+        players,
+        args.num_sets,
+        num_workers=args.num_workers,
+        checkpoint_file=args.checkpoint_file,
+        chunk_size=args.chunk_size,
+        reuse_players=args.reuse_players,
+        opening_list=opening_list
+    )
+
+
+if __name__ == "__main__":
+    main()
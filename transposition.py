@@ -0,0 +1,293 @@
+"""A fixed-size transposition table for game-tree search.
+
+The table is preallocated as two arrays of 64-bit words, so its memory use
+is known in advance: 16 bytes per entry. Every entry packs the depth, bound,
+score and best move of a position in a data word, and the position key is
+stored XOR the data word. Entries that were written halfway by another
+process, or belong to another position, then fail the key check instead of
+returning a wrong entry, so the table can be shared between processes
+without locks.
+
+The entries are grouped in buckets of BUCKET_SIZE. The first entry of a
+bucket keeps the deepest search of the current generation, and the others
+are always replaced. Start a new generation with new_search() before every
+search, so that entries of earlier searches are replaced first. The
+generation is stored next to the entries, so a new_search() of the process
+that created a shared table also starts a new generation in the processes
+that are attached to it.
+
+With shared=True the table is created in shared memory, and other processes
+attach to it by its name:
+
+    table = TranspositionTable(1 << 20, shared=True)
+    # in a worker process
+    worker_table = TranspositionTable(1 << 20, name=table.name)
+
+The statistics of get_stats() can be used to size the table, e.g. printed
+after a search by running searchplayer.
+"""
+
+import weakref
+import zlib
+from multiprocessing import shared_memory
+
+import board
+
+EMPTY = 0
+EXACT = 1
+LOWER_BOUND = 2
+UPPER_BOUND = 3
+
+BUCKET_SIZE = 2
+
+# the fields of a data word: move, depth, bound, generation and score
+MOVE_BITS = 28
+DEPTH_SHIFT = 28
+BOUND_SHIFT = 36
+GENERATION_SHIFT = 38
+SCORE_SHIFT = 46
+
+MAX_DEPTH = 0xff
+MAX_GENERATION = 0xff
+SCORE_OFFSET = 1 << 17
+
+
+def get_move_code(record):
+    """Return a draughtsrules.MoveRecord packed in MOVE_BITS bits.
+
+    The code holds the square numbers of the piece and the end of the
+    move, and a 16-bit hash of the squares in between.
+    """
+
+    path = bytes(
+        board.History.convert_pos_to_index(pos) for pos in record.move
+    )
+    square = board.History.convert_pos_to_index(record.piece.pos)
+
+    return square | path[-1] << 6 | (zlib.crc32(path) & 0xffff) << 12
+
+
+def _release(views, shared, unlink):
+    """Release the memoryviews of a table, as the shared memory can only be
+    closed without them.
+    """
+
+    for view in views:
+        view.release()
+
+    if shared is not None:
+        shared.close()
+        if unlink:
+            shared.unlink()
+
+
+class TranspositionTable:
+    """A transposition table with a fixed amount of entries."""
+
+    def __init__(self, size=1 << 18, shared=False, name=None):
+        """Initialize the TranspositionTable object.
+
+        :param size: the maximal amount of entries, rounded down to a power
+            of two
+        :param shared: create the table in shared memory
+        :param name: the name of a shared table to attach to, which must
+            have the same size
+        """
+
+        num_buckets = 1
+        while num_buckets * 2 * BUCKET_SIZE <= size:
+            num_buckets *= 2
+
+        self.size = num_buckets * BUCKET_SIZE
+        self.nbytes = 16 * self.size
+
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.collisions = 0
+
+        self._mask = num_buckets - 1
+        self._shared_memory = None
+        self._owner = name is None
+        if name is not None:
+            self._shared_memory = shared_memory.SharedMemory(name=name)
+            if self._shared_memory.size < self.nbytes + 8:
+                self._shared_memory.close()
+                raise Exception(
+                    "Shared transposition table {0} is too small".format(name)
+                )
+            buffer = self._shared_memory.buf
+        elif shared:
+            self._shared_memory = shared_memory.SharedMemory(
+                create=True,
+                size=self.nbytes + 8
+            )
+            buffer = self._shared_memory.buf
+        else:
+            buffer = memoryview(bytearray(self.nbytes + 8))
+
+        self._keys = buffer[:8 * self.size].cast('Q')
+        self._data = buffer[8 * self.size:self.nbytes].cast('Q')
+        self._generation = buffer[self.nbytes:self.nbytes + 8].cast('Q')
+
+        # the table is released when it is closed or garbage collected, or
+        # when the process exits, and the shared memory is removed if this
+        # object created it
+        self._finalizer = weakref.finalize(
+            self,
+            _release,
+            (self._keys, self._data, self._generation),
+            self._shared_memory,
+            self._shared_memory is not None and self._owner
+        )
+
+    @property
+    def name(self):
+        """The name of the shared memory, or None if it is not shared."""
+
+        if self._shared_memory is None:
+            return None
+
+        return self._shared_memory.name
+
+    @property
+    def generation(self):
+        """The generation of the entries that are stored."""
+
+        return self._generation[0]
+
+    @generation.setter
+    def generation(self, value):
+        self._generation[0] = value
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the table, and remove the shared memory if it was
+        created by this object.
+        """
+
+        if self._keys is None:
+            return
+
+        self._finalizer()
+        self._keys = self._data = self._generation = None
+        self._shared_memory = None
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+
+        self._keys.cast('B')[:] = bytes(8 * self.size)
+        self._data.cast('B')[:] = bytes(8 * self.size)
+
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.collisions = 0
+
+    def new_search(self):
+        """Start a new generation of entries."""
+
+        self.generation = (self.generation + 1) & MAX_GENERATION
+
+    def probe(self, key):
+        """Return the entry of a position as a tuple (depth, bound, score,
+        move code), or None if it is not in the table.
+
+        :param key: the 64-bit key of the position (GameState.key)
+        """
+
+        self.probes += 1
+
+        data = self._data
+        keys = self._keys
+        index = (key & self._mask) * BUCKET_SIZE
+        for slot in range(index, index + BUCKET_SIZE):
+            entry = data[slot]
+            if entry and keys[slot] ^ entry == key:
+                self.hits += 1
+                return (
+                    entry >> DEPTH_SHIFT & MAX_DEPTH,
+                    entry >> BOUND_SHIFT & 3,
+                    (entry >> SCORE_SHIFT) - SCORE_OFFSET,
+                    entry & ((1 << MOVE_BITS) - 1) or None
+                )
+
+        return None
+
+    def store(self, key, depth, bound, score, move_code=None):
+        """Store the result of a search of a position.
+
+        :param key: the 64-bit key of the position (GameState.key)
+        :param depth: the depth of the search
+        :param bound: EXACT, LOWER_BOUND or UPPER_BOUND
+        :param score: the score, between -SCORE_OFFSET and SCORE_OFFSET
+        :param move_code: the best move, see get_move_code()
+        """
+
+        self.stores += 1
+
+        entry = (move_code or 0) \
+            | min(max(depth, 0), MAX_DEPTH) << DEPTH_SHIFT \
+            | bound << BOUND_SHIFT \
+            | self.generation << GENERATION_SHIFT \
+            | score + SCORE_OFFSET << SCORE_SHIFT
+
+        data = self._data
+        keys = self._keys
+        index = (key & self._mask) * BUCKET_SIZE
+
+        # an entry of the same position is always replaced
+        for slot in range(index, index + BUCKET_SIZE):
+            old_entry = data[slot]
+            if old_entry and keys[slot] ^ old_entry == key:
+                data[slot] = entry
+                keys[slot] = key ^ entry
+                return
+
+        # the first entry is replaced by a search that is at least as deep,
+        # or when it is of an earlier generation
+        old_entry = data[index]
+        if old_entry \
+                and old_entry >> GENERATION_SHIFT & MAX_GENERATION \
+                == self.generation \
+                and old_entry >> DEPTH_SHIFT & MAX_DEPTH > depth:
+            index += 1 + (key >> 32) % (BUCKET_SIZE - 1)
+            old_entry = data[index]
+
+        if old_entry:
+            self.collisions += 1
+
+        data[index] = entry
+        keys[index] = key ^ entry
+
+    def get_fill(self):
+        """Return the fraction of the entries that are in use."""
+
+        return sum(1 for entry in self._data if entry) / self.size
+
+    def get_stats(self):
+        """Return a dict of statistics of the table since it was cleared.
+
+        collisions counts the stores that replaced an entry of another
+        position.
+        """
+
+        return {
+            'size': self.size,
+            'bytes': self.nbytes,
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.probes if self.probes else 0.0,
+            'stores': self.stores,
+            'collisions': self.collisions,
+            'fill': self.get_fill()
+        }